@@ -3,25 +3,397 @@
 FSMScorer - A class to assign scores to FSMs based on how well they classify strings through their output.
 
     Classes:
+        ReferenceDict - a dict of reference strings to outputs, that counts changes to its set of keys and numbers them for O(1) random access.
+        PrefixTrie - the reference strings compiled into a flattened prefix tree, so shared prefixes are only run once.
+        TrackedScore - a cached score that also records which reference strings the machine gives each output on.
+        RunRecord - the states of one machine at every node of the prefix trie, indexed by arc and final state, to rescore its clones.
         FSMScorer - scores 
+        AgreementScorer - scores FSMs exactly on all strings up to a length, by agreement with a target machine, without enumerating them.
+
+    Functions:
+        balanced_reference_dict - a reference dict of strings balanced between those a target machine accepts and rejects.
 
 '''
 
 import logging
+import sys
+import weakref
+
+import numpy as np
 
 import automata
+import scorecache
+
+class ReferenceDict(dict):
+    '''A dict from reference strings to expected outputs, which counts the changes to its set of keys in key_version.
+    Changing the output of an existing key does not count, as the prefix trie only depends on the keys; value_version counts those.
+    The keys are also numbered from 0 in a list, with the position of each in a second dict, so that key_at() picks the n-th in O(1)
+    for drawing keys at random; remove_at() and every other removal fill the gap with the last key, so they are O(1) as well.'''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.key_version = 0
+        self.value_version = 0
+        self._keys = list(self)
+        self._position = {k: n for n, k in enumerate(self._keys)}
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.key_version += 1
+            self._position[key] = len(self._keys)
+            self._keys.append(key)
+        self.value_version += 1
+        super().__setitem__(key, value)
+
+    def __reduce__(self):
+        # Unpickling a dict subclass sets its items before its attributes, which __setitem__ would need.
+        return (self.__class__, (dict(self),), self.__dict__)
+
+    def _unindex(self, key):
+        '''Drop the key from the list, moving the last key into its place.'''
+        n = self._position.pop(key)
+        last = self._keys.pop()
+        if n < len(self._keys):
+            self._keys[n] = last
+            self._position[last] = n
+
+    def key_at(self, n):
+        '''Return the n-th key.'''
+        return self._keys[n]
+
+    def remove_at(self, n):
+        '''Remove the n-th key, and return it and its output; the last key takes its number.'''
+        key = self._keys[n]
+        return key, self.pop(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._unindex(key)
+        self.key_version += 1
+
+    def pop(self, *args):
+        n = len(self)
+        r = super().pop(*args)
+        if len(self) != n:
+            self._unindex(args[0])
+            self.key_version += 1
+        return r
+
+    def popitem(self):
+        r = super().popitem()
+        self._unindex(r[0])
+        self.key_version += 1
+        return r
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        for k in self:
+            if k not in self._position:
+                self._position[k] = len(self._keys)
+                self._keys.append(k)
+        self.key_version += 1
+        self.value_version += 1
+
+    def clear(self):
+        super().clear()
+        self._keys = []
+        self._position = {}
+        self.key_version += 1
+
+
+class PrefixTrie(object):
+    '''The reference strings compiled into a prefix tree, flattened into parallel lists in depth-first pre-order.
+    Node 0 is the root (the empty string); every other node has the index of its parent node and the symbol on the edge from it.
+    As parents always come before their children, one pass over the nodes runs a machine over every reference string at once,
+    stepping each shared prefix only once.  The subtree of node i is the range of nodes from i up to (excluding) end[i].'''
+
+    def __init__(self, strings) -> None:
+        # Build a nested dict tree first; the None key of a node holds the reference string ending there.
+        root = dict()
+        for s in strings:
+            node = root
+            for symbol in s:
+                node = node.setdefault(symbol, dict())
+            node[None] = s
+
+        self.parent = []
+        self.symbol = []
+        self.depth = []
+        self.terminals = []     # pairs of node index and the reference string ending at that node
+        stack = [(root, -1, None, 0)]
+        while stack:
+            node, parent, symbol, depth = stack.pop()
+            index = len(self.parent)
+            self.parent.append(parent)
+            self.symbol.append(symbol)
+            self.depth.append(depth)
+            if None in node:
+                self.terminals.append((index, node[None]))
+            # Push the children in reverse, so that they are numbered in insertion order.
+            for child_symbol in reversed([k for k in node if k is not None]):
+                stack.append((node[child_symbol], index, child_symbol, depth + 1))
+
+        # the position of each reference string among the terminals, which is also its bit in output bitmaps
+        self.terminal_index = {w: position for position, (_, w) in enumerate(self.terminals)}
+
+        self.end = list(range(1, len(self.parent) + 1))
+        for i in range(len(self.parent) - 1, 0, -1):
+            if self.end[i] > self.end[self.parent[i]]:
+                self.end[self.parent[i]] = self.end[i]
+
+        self._steps = list(zip(self.parent[1:], self.symbol[1:]))
+        self._levels = None
+        self._arrays = None
+
+    def size(self):
+        '''The number of nodes, i.e. one more than the number of steps it takes to run a machine over all the reference strings.'''
+        return len(self.parent)
+
+    def arrays(self):
+        '''Return NumPy arrays of the parents and edge symbols of the nodes from 1 upward, and of the nodes of the terminals, which are in increasing order.'''
+        if self._arrays is None:
+            self._arrays = (np.array(self.parent[1:], dtype=np.int64),
+                            np.array(self.symbol[1:], dtype=np.int64),
+                            np.array([node for node, _ in self.terminals], dtype=np.int64))
+        return self._arrays
+
+    def width(self):
+        '''One more than the highest symbol on any edge; no other input can affect a run over the trie.'''
+        return max(self.symbol[1:], default=0) + 1
+
+    def levels(self):
+        '''Return, for each depth from 1 upward, NumPy arrays of the nodes at that depth, their parents and their edge symbols.'''
+        if self._levels is None:
+            depth = np.array(self.depth, dtype=np.int64)
+            parent = np.array(self.parent, dtype=np.int64)
+            symbol = np.array([0] + list(self.symbol[1:]), dtype=np.int64)
+            order = np.argsort(depth, kind="stable")
+            bounds = np.searchsorted(depth[order], np.arange(1, depth.max() + 2))
+            self._levels = []
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                nodes = order[first:last]
+                self._levels.append((nodes, parent[nodes], symbol[nodes]))
+        return self._levels
+
+    def run(self, automaton):
+        '''Return the list of states the automaton reaches at each node of the trie, starting from its starting state at the root.
+        A CanonicalMooreMachine is compiled into a table of rows first, so that each step is two list lookups.'''
+        states = [automaton.starting_state()]
+        append = states.append
+        if isinstance(automaton, automata.CanonicalMooreMachine):
+            rows = automata.CompiledRun(automaton).rows(self.width())
+            for parent, symbol in self._steps:
+                append(rows[states[parent]][symbol])
+        else:
+            next_state = automaton.next_state
+            for parent, symbol in self._steps:
+                append(next_state(states[parent], symbol))
+        return states
+
+
+class TrackedScore(int):
+    '''A score, as stored in the cache when the scorer tracks outputs: an int that also holds, for each output the machine gives
+    on some reference string, a bitmap of those strings, by their position among the terminals of the prefix trie.
+    This is enough to update the score when the expected output of one string changes, without running the machine again.'''
+
+    def __new__(cls, score, bitmaps):
+        r = super().__new__(cls, score)
+        r.bitmaps = bitmaps
+        return r
+
+    @classmethod
+    def from_outputs(cls, outputs, expected):
+        '''Construct from 1-D NumPy arrays of the outputs of a machine and the expected outputs, both in terminal order.'''
+        bitmaps = dict()
+        for value in np.unique(outputs).tolist():
+            bits = np.packbits(outputs == value, bitorder="little")
+            bitmaps[value] = int.from_bytes(bits.tobytes(), "little")
+        return cls(int((outputs == expected).sum()), bitmaps)
+
+    def __getnewargs__(self):
+        return (int(self), self.bitmaps)
+
+    def rescored(self, bit, old, new):
+        '''Return the score after the expected output of the reference string at the given bit changes from old to new.'''
+        delta = (1 if self.bitmaps.get(new, 0) & bit else 0) - (1 if self.bitmaps.get(old, 0) & bit else 0)
+        return self if delta == 0 else TrackedScore(self + delta, self.bitmaps)
+
+    def __sizeof__(self):
+        return super().__sizeof__() + sum(sys.getsizeof(b) for b in self.bitmaps.values())
+
+
+class RunRecord(object):
+    '''The run of a CanonicalMooreMachine over a PrefixTrie: the state it reaches at every node and its output at every terminal,
+    recorded after the given number of modifications of the machine.  A clone with a few changed arcs and outputs only reaches
+    different states in the subtrees entered through a changed arc, and only gives different outputs there and where the run ends
+    in a state whose output changed; derive() redoes just those parts.  The inverted index from arcs to the nodes entered through
+    them, and from states to the terminals ending in them, is built when first needed, as a record may never be derived from.'''
+
+    def __init__(self, modifications, states, outputs) -> None:
+        self.modifications = modifications
+        self.states = states
+        self.outputs = outputs
+        self._index = None
+
+    @classmethod
+    def from_run(cls, machine, trie):
+        '''Run the machine over the trie, and return the record of it.'''
+        states = np.array(trie.run(machine), dtype=np.int64)
+        output = machine.output
+        outputs = np.array([output(s) for s in states[trie.arrays()[2]].tolist()])
+        return cls(machine.modifications(), states, outputs)
+
+    def _build_index(self, trie):
+        parents, symbols, terminal_nodes = trie.arrays()
+        arc_ids = self.states[parents] * trie.width() + symbols
+        arc_order = np.argsort(arc_ids, kind="stable")
+        finals = self.states[terminal_nodes]
+        final_order = np.argsort(finals, kind="stable")
+        # Nodes are numbered from 1 in the arc index, as the root is not entered through any arc.
+        self._index = (arc_ids[arc_order], arc_order + 1, finals[final_order], final_order)
+
+    def arc_nodes(self, trie, arcs):
+        '''Return the sorted array of the nodes entered through any of the arcs, given as pairs of state and input.'''
+        if self._index is None:
+            self._build_index(trie)
+        sorted_ids, nodes, _, _ = self._index
+        width = trie.width()
+        ids = np.array([s * width + c for s, c in arcs if 0 <= c < width], dtype=np.int64)
+        first = np.searchsorted(sorted_ids, ids, side="left")
+        last = np.searchsorted(sorted_ids, ids, side="right")
+        return np.sort(np.concatenate([nodes[f:l] for f, l in zip(first.tolist(), last.tolist())] + [nodes[:0]]))
+
+    def final_positions(self, trie, states):
+        '''Return an array of the positions of the terminals whose run ends in any of the states.'''
+        if self._index is None:
+            self._build_index(trie)
+        _, _, sorted_finals, positions = self._index
+        states = np.array(list(states), dtype=np.int64)
+        first = np.searchsorted(sorted_finals, states, side="left")
+        last = np.searchsorted(sorted_finals, states, side="right")
+        return np.concatenate([positions[f:l] for f, l in zip(first.tolist(), last.tolist())] + [positions[:0]])
+
+    def derive(self, machine, trie, arcs, states):
+        '''Return the record of a machine that differs from the recorded one at most in the given arcs and the outputs of the given states.'''
+        new_states = self.states.tolist()
+        outputs = self.outputs.copy()
+        terminal_nodes = trie.arrays()[2]
+        redo = np.zeros(len(outputs), dtype=bool)
+        rows = automata.CompiledRun(machine).rows(trie.width())
+        parent = trie.parent
+        symbol = trie.symbol
+        limit = 0
+        for root in self.arc_nodes(trie, arcs).tolist():
+            if root < limit:
+                # inside a subtree already rerun
+                continue
+            limit = trie.end[root]
+            for j in range(root, limit):
+                new_states[j] = rows[new_states[parent[j]]][symbol[j]]
+            redo[np.searchsorted(terminal_nodes, root):np.searchsorted(terminal_nodes, limit)] = True
+        if states:
+            redo[self.final_positions(trie, states)] = True
+        output = machine.output
+        positions = np.flatnonzero(redo)
+        outputs[positions] = [output(new_states[node]) for node in terminal_nodes[positions].tolist()]
+        return RunRecord(machine.modifications(), np.array(new_states, dtype=np.int64), outputs)
+
 
 class FSMScorer(object):
-    '''A class to score FSMs based on their outputs against a reference set of strings.'''
+    '''A class to score FSMs based on their outputs against a reference set of strings.
+    The keys of the reference dict are compiled into a PrefixTrie, which is rebuilt whenever they change.'''
 
-    def __init__(self) -> None:
+    def __init__(self, cache=None) -> None:
         self.reference_dict = dict()
-        # initialise the cache
-        self.cache = dict()
+        # initialise the cache; by default an unbounded one (see scorecache for bounded ones)
+        self.cache = cache if cache is not None else scorecache.ScoreCache()
+        # whether cache keys are computed from minimised machines, so that all equivalent machines share a cache entry
+        self.minimise_keys = False
+        # whether cached scores hold the outputs of their machines, so that set_output can update them instead of emptying the cache
+        self.track_outputs = False
+        # whether to keep a RunRecord of each CanonicalMooreMachine scored while it exists, so that its clones can be scored from it
+        self.index_runs = False
+        self._runs = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # The recorded runs are keyed by weak references, which cannot be pickled; a copy starts without them.
+        state = self.__dict__.copy()
+        state["_runs"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._runs = weakref.WeakKeyDictionary()
+
+    @property
+    def reference_dict(self):
+        '''The dict of reference strings to expected outputs, a ReferenceDict.  Setting it to a plain dict stores a ReferenceDict copy
+        of it, which counts the changes made to it from then on; later changes to the plain dict are not seen.'''
+        return self._reference_dict
+
+    @reference_dict.setter
+    def reference_dict(self, rd):
+        self._reference_dict = rd if isinstance(rd, ReferenceDict) else ReferenceDict(rd)
+        self._trie = None
+        self._expected = None
+        # cached scores were computed against the previous table
+        self._cache_version = None
+
+    def cache_key(self, automaton):
+        '''Return the key of the automaton in the cache: a hash of its canonical form, shared by all machines with the same reachable behaviour.'''
+        return automata.canonical_key(automaton, self.minimise_keys)
+
+    def trie(self):
+        '''Return the PrefixTrie of the reference strings, rebuilding it if the set of strings has changed since it was last built.'''
+        if self._trie is None or self._trie_version != self._reference_dict.key_version:
+            self._trie = PrefixTrie(self._reference_dict.keys())
+            self._trie_version = self._reference_dict.key_version
+            # the recorded runs were over the previous trie
+            self._runs = weakref.WeakKeyDictionary()
+            self._expected = None
+        return self._trie
+
+    def expected_outputs(self):
+        '''Return a NumPy array of the expected outputs of the reference strings, in the order of the terminals of the trie.'''
+        trie = self.trie()
+        if self._expected is None or self._expected_version != self._reference_dict.value_version:
+            self._expected = np.array([self._reference_dict[w] for _, w in trie.terminals])
+            self._expected_version = self._reference_dict.value_version
+        return self._expected
+
+    def run_record(self, automaton):
+        '''Return the RunRecord of a CanonicalMooreMachine over the trie: kept from an earlier call if it has not changed since,
+        derived from that of the machine it was cloned from if that is known, and otherwise made by running it.'''
+        trie = self.trie()
+        record = self._runs.get(automaton)
+        if record is None or record.modifications != automaton.modifications():
+            record = None
+            arcs = set()
+            states = set()
+            log = automaton.edit_log()
+            while record is None and log is not None:
+                arcs |= log.arcs
+                states |= log.states
+                origin = log.origin()
+                origin_record = self._runs.get(origin) if origin is not None else None
+                if origin_record is not None and origin_record.modifications == log.modifications:
+                    record = origin_record.derive(automaton, trie, arcs, states)
+                log = log.previous
+            if record is None:
+                record = RunRecord.from_run(automaton, trie)
+            self._runs[automaton] = record
+        return record
 
 
     @classmethod
     def from_reference_dict(cls, rd):
+        '''Constructor from a dict of reference strings to expected outputs.  A plain dict is copied into a ReferenceDict, so later
+        changes to rd are not seen; change the scorer's reference_dict instead.  A ReferenceDict is used as it is.'''
         r = cls()
         r.reference_dict = rd
         return r
@@ -41,47 +413,350 @@ class FSMScorer(object):
     
     def ref_and_output(self, n):
         '''Return the n-th reference string and its output.'''
-        k = list(self.reference_dict.keys())[n]
+        k = self.reference_dict.key_at(n)
         return (k, self.reference_dict[k])
 
     def set_output(self, s, out):
-        '''Set the expected output for string s to out.'''
-        self.reference_dict[s] = out
-        # This has modified at least one string/output pair, therefore reset the cache
-        self.reset()
+        '''Set the expected output for string s to out.
+        If outputs are tracked and s is already a reference string, the cached scores are updated; otherwise the cache is emptied.'''
+        rd = self.reference_dict
+        if self.track_outputs and s in rd and self._cache_version == rd.key_version:
+            old = rd[s]
+            rd[s] = out
+            if old != out:
+                self._rescore(s, old, out)
+        else:
+            rd[s] = out
+            # This has modified at least one string/output pair, therefore reset the cache
+            self.reset()
+
+    def _rescore(self, s, old, new):
+        '''Update the cached scores for the expected output of string s changing from old to new.
+        Scores cached without their outputs cannot be updated, so they are dropped.'''
+        bit = 1 << self.trie().terminal_index[s]
+        for key, score in list(self.cache.items()):
+            if isinstance(score, TrackedScore):
+                rescored = score.rescored(bit, old, new)
+                if rescored is not score:
+                    self.cache[key] = rescored
+            else:
+                self.cache.discard(key)
     
     def reset(self):
-        self.cache = dict()
+        self.cache.clear()
+        self._cache_version = self._reference_dict.key_version
+
+    def cache_stats(self):
+        '''Return the statistics of the score cache: entries, hits, misses, evictions, hit rate and estimated bytes.'''
+        return self.cache.stats()
+
+    def _check_cache(self):
+        '''Empty the cache if reference strings have been added or removed since it was filled.'''
+        if self._cache_version != self._reference_dict.key_version:
+            self.reset()
+
+    # The largest number of (machine, trie node) states score_population holds at once.
+    POPULATION_CHUNK = 1 << 22
+
+    def score_population(self, automata_list, compute=None):
+        '''Returns the list of scores of a whole batch of CanonicalMooreMachines, computed together with NumPy.
+        Their transition tables are padded into one machines x states x inputs tensor, and every machine advances
+        through one depth of the prefix trie at a time, in one vectorised gather per depth.  Cached scores are reused, and new ones cached.
+        With index_runs, the machines not in the cache are instead scored one at a time from their run records, as score() does.
+        With compute, a function returning the list of the scores of a list of machines, such as SMO_GP passes to have them scored
+        in a pool of workers, the machines not in the cache are scored by it instead.'''
+        self._check_cache()
+        return _cached_scores(self, automata_list, compute if compute is not None else self._compute_population)
+
+    def _compute_population(self, machines):
+        '''Return the list of the scores of the machines, computed as score_population() describes, without the cache.'''
+        if self.index_runs:
+            # The runs of mutants are derived from those of their parents, as score() does, rather than made anew.
+            expected = self.expected_outputs()
+            return [self._count(self.run_record(a).outputs, expected) for a in machines]
+        trie = self.trie()
+        nodes = np.array([node for node, _ in trie.terminals], dtype=np.int64)
+        expected = np.array([self.reference_dict[w] for _, w in trie.terminals])
+        symbols = max((s for s in trie.symbol[1:]), default=0) + 1
+        chunk = max(1, self.POPULATION_CHUNK // trie.size())
+        scores = []
+        for first in range(0, len(machines), chunk):
+            outputs = self._score_batch(machines[first:first + chunk], trie, nodes, symbols)
+            if self.track_outputs:
+                scores.extend(TrackedScore.from_outputs(row, expected) for row in outputs)
+            else:
+                scores.extend((outputs == expected).sum(axis=1).tolist())
+        return scores
+
+    def _count(self, outputs, expected):
+        '''Return the score of an array of outputs at the terminals of the trie: a TrackedScore if outputs are tracked, else the count of them
+        that are as expected.'''
+        if self.track_outputs:
+            return TrackedScore.from_outputs(outputs, expected)
+        return int((outputs == expected).sum())
+
+    def _score_batch(self, machines, trie, nodes, symbols):
+        '''Run a list of machines in one pass over the levels of the trie; returns their outputs at the given nodes, as a machines x nodes array.'''
+        # Every stored arc, as score() follows them (see arc_rows).
+        rows = [m.arc_rows() for m in machines]
+        state_count = max(len(r) for r in rows)
+        input_count = max(max(len(r[0]) for r in rows), symbols)
+
+        # Pad every machine to the same size with self-loops, and flatten the tensor so that one index reaches any arc.
+        table = np.repeat(np.arange(state_count, dtype=np.int32)[np.newaxis, :, np.newaxis], len(machines), axis=0)
+        table = np.repeat(table, input_count, axis=2)
+        outputs = np.zeros((len(machines), state_count), dtype=np.int32)
+        for k, m in enumerate(machines):
+            t = np.array(rows[k], dtype=np.int32).reshape(len(rows[k]), -1)
+            table[k, :t.shape[0], :t.shape[1]] = t
+            outputs[k, :len(rows[k])] = m.arc_outputs()
+        flat = table.reshape(-1)
+        base = (np.arange(len(machines), dtype=np.int64) * state_count)[:, np.newaxis]
+
+        states = np.zeros((len(machines), trie.size()), dtype=np.int64)
+        for level_nodes, parents, level_symbols in trie.levels():
+            states[:, level_nodes] = flat[(base + states[:, parents]) * input_count + level_symbols]
+
+        return outputs[np.arange(len(machines))[:, np.newaxis], states[:, nodes]]
 
     def score(self, automaton):
         '''Returns the number of correct results.'''
         #First, check if the automaton's score is cached
-        h = str(automaton)
-        if h in self.cache:
-            logging.debug("CACHED score" + str(self.cache[h]))
-            return self.cache[h]
+        self._check_cache()
+        h = self.cache_key(automaton)
+        cached = self.cache.get(h)
+        if cached is not None:
+            logging.debug("CACHED score%s", cached)
+            return cached
         else:
-            # not cached, compute value, cache it and return it
-            count = 0
-            run = automata.MooreMachineRun(automaton)
-            for w in self.reference_dict.keys():
-                run.reset()
-                run.multistep(w)
-                output = run.output()
-                logging.debug("For input " + str(w) + " the output is " + str(output))
-
-                if output == self.reference_dict[w]:
-                    count += 1
+            # not cached, compute value by walking the trie once, cache it and return it
+            trie = self.trie()
+            if self.index_runs and isinstance(automaton, automata.CanonicalSemiAutomaton):
+                count = self._count(self.run_record(automaton).outputs, self.expected_outputs())
+            elif self.track_outputs:
+                states = trie.run(automaton)
+                output = automaton.output
+                count = TrackedScore.from_outputs(np.array([output(states[node]) for node, _ in trie.terminals]),
+                                                  self.expected_outputs())
+            else:
+                states = trie.run(automaton)
+                output = automaton.output
+                rd = self.reference_dict
+                count = 0
+                for node, w in trie.terminals:
+                    if output(states[node]) == rd[w]:
+                        count += 1
             # cache before returning
             self.cache[h] = count
-            logging.debug("Score is " + str(count))
+            logging.debug("Score is %d", count)
             if count == len(self.reference_dict):
                 logging.info("Maximal score reached.")
             return count
 
+class AgreementScorer(object):
+    '''Scores FSMs by the exact number of strings over the target machine's inputs, of every length up to max_length, on which their
+    output agrees with the target's.  It can stand in for an FSMScorer whose reference dict held all of those strings, which could
+    never be enumerated for long strings.  The strings of each length leading to each pair of states reachable in the product of
+    the candidate and the target are counted by dynamic programming, in O(max_length * pairs * inputs) time rather than
+    O(inputs ** max_length * max_length).  Scores are Python integers, exact however large.'''
+
+    def __init__(self, target, max_length, cache=None) -> None:
+        self.target = target
+        self.max_length = max_length
+        self.cache = cache if cache is not None else scorecache.ScoreCache()
+        # whether cache keys are computed from minimised machines, as for FSMScorer
+        self.minimise_keys = False
+        # Accepted for compatibility with FSMScorer; there are no reference strings to track outputs or index runs over.
+        self.track_outputs = False
+        self.index_runs = False
+        self._target_table = target.arc_rows(target.input_count())
+        self._target_outputs = target.arc_outputs()
+
+    def cache_key(self, automaton):
+        '''Return the key of the automaton in the cache, as FSMScorer does.'''
+        return automata.canonical_key(automaton, self.minimise_keys)
+
+    def table_size(self):
+        '''Returns the number of strings scored on, which is the maximal score.'''
+        return sum(self.target.input_count() ** length for length in range(self.max_length + 1))
+
+    def reset(self):
+        self.cache.clear()
+
+    def cache_stats(self):
+        '''Return the statistics of the score cache: entries, hits, misses, evictions, hit rate and estimated bytes.'''
+        return self.cache.stats()
+
+    def product(self, automaton):
+        '''Return the transition array of the part of the product of the automaton and the target reachable from their starting states,
+        with the pairs of states numbered in breadth-first order, and the boolean array of the pairs whose outputs agree.'''
+        input_count = self.target.input_count()
+        table = automaton.arc_rows(input_count)
+        outputs = automaton.arc_outputs()
+        target_table = self._target_table
+        target_outputs = self._target_outputs
+
+        number = {(0, 0): 0}
+        pairs = [(0, 0)]
+        product = []
+        # The loop also visits the pairs appended as they are discovered.
+        for p, q in pairs:
+            row = []
+            for c in range(input_count):
+                reached = (table[p][c], target_table[q][c])
+                k = number.get(reached)
+                if k is None:
+                    k = number[reached] = len(pairs)
+                    pairs.append(reached)
+                row.append(k)
+            product.append(row)
+        agree = np.array([outputs[p] == target_outputs[q] for p, q in pairs], dtype=bool)
+        return np.array(product, dtype=np.int64).reshape(len(pairs), input_count), agree
+
+    def length_agreements(self, automaton):
+        '''Return the list, for each length from 0 to max_length, of the number of strings of that length on which the automaton's
+        output agrees with the target's.'''
+        product, agree = self.product(automaton)
+        input_count = product.shape[1]
+        # Summing the counts of the pairs leading to each pair, grouped by sorting the arcs by the pair they lead to; every pair but
+        # the starting one is led to, but the starting one may not be.
+        targets = product.reshape(-1)
+        order = np.argsort(targets, kind="stable")
+        sources = order // input_count
+        led_to, starts = np.unique(targets[order], return_index=True)
+
+        counts = np.zeros(len(agree), dtype=np.int64)
+        counts[0] = 1
+        agreements = []
+        for length in range(self.max_length + 1):
+            agreements.append(int(counts[agree].sum()))
+            if length < self.max_length:
+                # Counts below input_count ** length fit 64 bits; beyond that, switch to Python integers.
+                if counts.dtype != object and input_count ** (length + 1) >= 2**63:
+                    counts = counts.astype(object)
+                summed = np.add.reduceat(counts[sources], starts) if len(sources) else counts[:0]
+                counts = np.zeros(len(agree), dtype=counts.dtype)
+                counts[led_to] = summed
+        return agreements
+
+    def score_population(self, automata_list, compute=None):
+        '''Returns the list of scores of a list of automata.  Cached scores are reused, and new ones cached; with compute, a function
+        returning the list of the scores of a list of automata, the automata not in the cache are scored by it, as for FSMScorer.'''
+        return _cached_scores(self, automata_list, compute if compute is not None else self._compute_population)
+
+    def _compute_population(self, automata_list):
+        return [sum(self.length_agreements(a)) for a in automata_list]
+
+    def score(self, automaton):
+        '''Returns the number of strings up to max_length on which the automaton agrees with the target.'''
+        h = self.cache_key(automaton)
+        cached = self.cache.get(h)
+        if cached is not None:
+            return cached
+        count = sum(self.length_agreements(automaton))
+        self.cache[h] = count
+        if count == self.table_size():
+            logging.info("Maximal score reached.")
+        return count
+
+
+def _cached_scores(scorer, automata_list, compute):
+    '''Return the list of the scores of the automata from the scorer's cache, scoring those not in it, each behaviour once, with
+    compute(list of automata), and caching the new scores.'''
+    keys = [scorer.cache_key(a) for a in automata_list]
+    results = dict()
+    pending = dict()
+    for key, a in zip(keys, automata_list):
+        if key not in results and key not in pending:
+            cached = scorer.cache.get(key)
+            if cached is None:
+                pending[key] = a
+            else:
+                results[key] = cached
+
+    if pending:
+        for key, count in zip(pending, compute(list(pending.values()))):
+            results[key] = count
+            scorer.cache[key] = count
+            if count == scorer.table_size():
+                logging.info("Maximal score reached.")
+
+    return [results[key] for key in keys]
+
+
+def balanced_reference_dict(machine, n, input_count):
+    '''Return a reference dict of n strings over range(input_count) to the outputs of the CanonicalMooreMachine on them, balanced
+    between outputs 1 and 0: going through the strings in length-lexicographic order, a string is taken whenever the counts of the
+    two are equal, and otherwise only if its output is the one behind.  Instead of running every string from the starting state,
+    the strings of each length are searched depth first, each carrying its state from its prefix, and a prefix is only extended if
+    some suffix of the remaining length leads from its state to an output still wanted; so the many strings that would be passed
+    over are mostly never made.  If the machine can give no more strings that would be taken, the dict is returned short.'''
+    compiled = automata.CompiledRun(machine)
+    rows = [row[:input_count] for row in compiled.rows(input_count)]
+    outputs = compiled.outputs()
+    table = np.array(rows, dtype=np.int64).reshape(len(rows), input_count)
+    # reach[o][r][s]: whether some string of length r leads from state s to a state with output o.
+    layers = [np.array(outputs) == 0, np.array(outputs) == 1]
+    reach = ([layers[0].tolist()], [layers[1].tolist()])
+    start = machine.starting_state()
+    d = {}
+    negative = 0
+    positive = 0
+    seen = {}
+    length = 0
+    while True:
+        # The layers of each length follow from those of the one before, so once they repeat, so do the strings to be taken.
+        key = layers[0].tobytes() + layers[1].tobytes()
+        if key in seen and seen[key] == len(d):
+            logging.warning("Only %d reference strings could be found", len(d))
+            return d
+        seen[key] = len(d)
+
+        reach0 = reach[0]
+        reach1 = reach[1]
+        if (positive >= negative and reach0[length][start]) or (positive <= negative and reach1[length][start]):
+            path = [start]
+            choices = [0]
+            word = []
+            while path:
+                depth = len(word)
+                if depth == length:
+                    result = outputs[path[-1]]
+                    d[tuple(word)] = result
+                    if result == 1:
+                        positive += 1
+                    else:
+                        negative += 1
+                    if positive + negative >= n:
+                        return d
+                else:
+                    row = rows[path[-1]]
+                    r0 = reach0[length - depth - 1]
+                    r1 = reach1[length - depth - 1]
+                    c = choices[-1]
+                    while c < input_count and not ((positive >= negative and r0[row[c]]) or (positive <= negative and r1[row[c]])):
+                        c += 1
+                    if c < input_count:
+                        choices[-1] = c + 1
+                        path.append(row[c])
+                        choices.append(0)
+                        word.append(c)
+                        continue
+                path.pop()
+                choices.pop()
+                if word:
+                    word.pop()
+
+        length += 1
+        layers = [layer[table].any(axis=1) if input_count else np.zeros_like(layer) for layer in layers]
+        reach[0].append(layers[0].tolist())
+        reach[1].append(layers[1].tolist())
+
+
 # Unit testing code.
 
 
+import pickle
 import unittest as ut
 
 class TestCSA(ut.TestCase):
@@ -100,7 +775,7 @@ class TestCSA(ut.TestCase):
         s = f.score(a)
 
         self.assertEqual(s, 0)
-        self.assertTrue(str(a) in f.cache)
+        self.assertTrue(f.cache_key(a) in f.cache)
         self.assertFalse("" in f.cache)
 
     
@@ -129,6 +804,33 @@ class TestCSA(ut.TestCase):
         _,s = f.ref_and_output(1)
         self.assertEqual(s, 2)
 
+    def test_indexed_keys(self):
+        rd = ReferenceDict({(): 0, (0,): 1})
+        rd[(1,)] = 0
+        rd.update({(0, 0): 1, (): 1})
+        rd.setdefault((1, 1), 0)
+        self.assertEqual([rd.key_at(n) for n in range(len(rd))], [(), (0,), (1,), (0, 0), (1, 1)])
+
+        # Removals move the last key into the gap.
+        version = rd.key_version
+        self.assertEqual(rd.remove_at(1), ((0,), 1))
+        self.assertEqual([rd.key_at(n) for n in range(len(rd))], [(), (1, 1), (1,), (0, 0)])
+        del rd[()]
+        rd.pop((1,))
+        rd.pop((2,), None)
+        self.assertEqual([rd.key_at(n) for n in range(len(rd))], [(0, 0), (1, 1)])
+        self.assertEqual(rd.key_version, version + 3)
+        k, _ = rd.popitem()
+        self.assertEqual([rd.key_at(0)], [w for w in ((0, 0), (1, 1)) if w != k])
+
+        g = pickle.loads(pickle.dumps(rd))
+        self.assertEqual(g.key_at(0), rd.key_at(0))
+        g[(2,)] = 1
+        self.assertEqual(g.key_at(1), (2,))
+        g.clear()
+        with self.assertRaises(IndexError):
+            g.key_at(0)
+
 
     def test_from_function(self):
         def Kleene_of(repeated, s):
@@ -153,7 +855,276 @@ class TestCSA(ut.TestCase):
         self.assertEqual(len(f.reference_dict), 3)
         self.assertEqual(s, 2)
         self.assertEqual(len(f.cache), 1)
-        self.assertTrue(str(a) in f.cache)
+        self.assertTrue(f.cache_key(a) in f.cache)
+
+    def test_trie(self):
+        t = PrefixTrie([(), (0, 1), (0, 1, 1), (0, 0), (1,)])
+        # root, 0, 01, 011, 00, 1
+        self.assertEqual(t.size(), 6)
+        self.assertEqual(t.parent, [-1, 0, 1, 2, 1, 0])
+        self.assertEqual(t.symbol[1:], [0, 1, 1, 0, 1])
+        self.assertEqual(t.end, [6, 5, 4, 4, 5, 6])
+        self.assertEqual([w for _, w in t.terminals], [(), (0, 1), (0, 1, 1), (0, 0), (1,)])
+
+    def test_trie_score(self):
+        a = automata.CanonicalMooreMachine.from_string(
+            "1 2 1\n"
+            "0 0 2\n"
+            "0 2 2")
+        rd = {(0, 1): 1, (0, 1, 1): 1, (1, 1, 0): 0, (): 1, (0,): 1}
+        f = FSMScorer.from_reference_dict(rd)
+        run = automata.MooreMachineRun(a)
+        expected = 0
+        for w, o in rd.items():
+            run.reset()
+            run.multistep(w)
+            if run.output() == o:
+                expected += 1
+        self.assertEqual(f.score(a), expected)
+
+        # Adding a string rebuilds the trie; changing an output does not.
+        trie = f.trie()
+        f.reference_dict[(1, 1)] = 1
+        self.assertIsNot(f.trie(), trie)
+        trie = f.trie()
+        f.set_output((1, 1), 0)
+        self.assertIs(f.trie(), trie)
+        self.assertEqual(f.score(a), expected + 1)
+
+        # Arcs beyond input_count(), and to a state removed by delete_state(), are followed as by next_state().
+        b = automata.CanonicalMooreMachine(3, 1)
+        b.set_arc(0, 0, 1)
+        b.set_arc(1, 3, 2)
+        b.set_output(2, 1)
+        self.assertEqual(FSMScorer.from_reference_dict({(0, 3): 1, (0,): 0, (): 1}).score(b), 2)
+        b.delete_state(2)
+        self.assertEqual(FSMScorer.from_reference_dict({(0, 3): 1, (0, 3, 0): 1, (0,): 0}).score(b), 3)
+
+    def test_score_population(self):
+        rng = np.random.default_rng(1)
+        rd = {tuple(rng.integers(3, size=rng.integers(8)).tolist()): int(rng.integers(2)) for _ in range(60)}
+        machines = []
+        for n in (1, 2, 5, 9, 5):
+            m = automata.CanonicalMooreMachine(n, 3)
+            for s in range(n):
+                for i in range(3):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(2)))
+            machines.append(m)
+        machines.append(automata.DenseCanonicalMooreMachine.from_automaton(machines[3]))
+
+        expected = [FSMScorer.from_reference_dict(rd).score(m) for m in machines]
+        f = FSMScorer.from_reference_dict(rd)
+        self.assertEqual(f.score_population(machines), expected)
+        self.assertEqual(len(f.cache), 5)
+        # A second call is answered from the cache.
+        self.assertEqual(f.score_population(machines[::-1]), expected[::-1])
+
+        # Deleting the highest state leaves arcs leading beyond state_count(), which are followed as score() does.
+        for m in machines[2], machines[5]:
+            m = m.clone()
+            m.delete_state(m.state_count() - 1)
+            self.assertEqual(FSMScorer.from_reference_dict(rd).score_population([m]), [FSMScorer.from_reference_dict(rd).score(m)])
+            target = automata.CanonicalMooreMachine.from_string("1 0 1 2\n0 2 2 1\n1 1 0 0")
+            self.assertEqual(AgreementScorer(m, 4).score(target), AgreementScorer(m.minimised(), 4).score(target))
+            self.assertEqual(AgreementScorer(target, 4).score(m), AgreementScorer(target, 4).score(m.minimised()))
+
+    def test_behavioural_cache_key(self):
+        f = FSMScorer.from_reference_dict({(): 0, (0,): 1, (0, 1): 0})
+        a = automata.CanonicalMooreMachine.from_string(
+            "0 1 0\n"
+            "1 1 0")
+        # The same behaviour, with the states renumbered and an unreachable state added.
+        b = automata.CanonicalMooreMachine.from_string(
+            "0 2 0\n"
+            "1 0 2\n"
+            "1 2 0")
+        self.assertEqual(f.score(a), f.score(b))
+        self.assertEqual(len(f.cache), 1)
+
+        # An equivalent but larger machine only shares the entry when keys are minimised.
+        c = automata.CanonicalMooreMachine.from_string(
+            "0 1 0\n"
+            "1 2 0\n"
+            "1 1 0")
+        f.score(c)
+        self.assertEqual(len(f.cache), 2)
+        f.reset()
+        f.minimise_keys = True
+        f.score(a)
+        f.score(c)
+        self.assertEqual(len(f.cache), 1)
+
+        # An arc on an input beyond input_count() is followed in scoring, so it is part of the key.
+        a = automata.CanonicalMooreMachine(input_count=2)
+        a.add_state()
+        a.set_output(1, 1)
+        b = a.clone()
+        b.set_arc(0, 2, 1)
+        self.assertNotEqual(automata.canonical_key(a), automata.canonical_key(b))
+        for first, second in ((a, b), (b, a)):
+            f = FSMScorer.from_reference_dict({(2,): 1, (0,): 0})
+            self.assertEqual((f.score(first), f.score(second)), (1, 2) if first is a else (2, 1))
+
+    def test_bounded_cache(self):
+        f = FSMScorer(scorecache.make_cache("lru", max_entries=2))
+        f.reference_dict = {(): 0, (1,): 1}
+        machines = [automata.CanonicalMooreMachine.from_string("0 0 %d\n1 1 1" % t) for t in (0, 1)]
+        machines.append(automata.CanonicalMooreMachine.from_string("1 0 0"))
+        scores = [f.score(m) for m in machines]
+        self.assertEqual(scores, [1, 2, 1])
+        self.assertEqual(f.score_population(machines), scores)
+        stats = f.cache_stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["misses"], 4)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["evictions"], 2)
+
+    def test_track_outputs(self):
+        rng = np.random.default_rng(2)
+        rd = {tuple(rng.integers(2, size=rng.integers(7)).tolist()): int(rng.integers(2)) for _ in range(40)}
+        machines = []
+        for n in (1, 3, 4, 6):
+            m = automata.CanonicalMooreMachine(n, 2)
+            for s in range(n):
+                for i in range(2):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(3)))
+            machines.append(m)
+
+        f = FSMScorer.from_reference_dict(rd)
+        f.track_outputs = True
+        f.score_population(machines[:2])
+        for m in machines[2:]:
+            f.score(m)
+        for _ in range(20):
+            k, v = f.ref_and_output(int(rng.integers(f.table_size())))
+            f.set_output(k, (v + 1 + int(rng.integers(2))) % 3)
+            self.assertEqual(len(f.cache), len(machines))
+            rd[k] = f.reference_dict[k]
+            self.assertEqual([f.score(m) for m in machines],
+                             [FSMScorer.from_reference_dict(rd).score(m) for m in machines])
+
+        # Without tracking, or for a new string, the cache is emptied.
+        f.set_output((1, 1, 1, 1, 1, 1, 1, 1), 0)
+        self.assertEqual(len(f.cache), 0)
+        f.track_outputs = False
+        f.score(machines[0])
+        f.set_output(k, 0)
+        self.assertEqual(len(f.cache), 0)
+
+    def test_index_runs(self):
+        rng = np.random.default_rng(3)
+        rd = {tuple(rng.integers(3, size=rng.integers(9)).tolist()): int(rng.integers(3)) for _ in range(200)}
+        f = FSMScorer.from_reference_dict(rd)
+        f.index_runs = True
+        for cls in (automata.CanonicalMooreMachine, automata.DenseCanonicalMooreMachine):
+            population = [cls(1, 3)]
+            for _ in range(150):
+                m = population[int(rng.integers(len(population)))]
+                # Sometimes mutate a clone of an unscored clone, and sometimes change a machine after scoring it.
+                for _ in range(int(rng.integers(1, 3))):
+                    m = m.clone()
+                    n = m.state_count()
+                    if rng.integers(2) == 1:
+                        m.add_state()
+                    m.set_arc(int(rng.integers(n)), int(rng.integers(3)), int(rng.integers(m.state_count())))
+                    m.set_output(int(rng.integers(m.state_count())), int(rng.integers(3)))
+                self.assertEqual(f.score(m), FSMScorer.from_reference_dict(rd).score(m))
+                if rng.integers(4) == 0:
+                    m.set_arc(0, int(rng.integers(3)), int(rng.integers(m.state_count())))
+                    self.assertEqual(f.score(m), FSMScorer.from_reference_dict(rd).score(m))
+                population.append(m)
+            self.assertGreater(len(f._runs), 0)
+
+            # Scoring a population uses the records too.
+            g = FSMScorer.from_reference_dict(rd)
+            g.index_runs = True
+            self.assertEqual(g.score_population(population[-20:]), [FSMScorer.from_reference_dict(rd).score(m) for m in population[-20:]])
+            self.assertGreater(len(g._runs), 0)
+
+        # A pickled copy scores the same, and starts without records.
+        f.track_outputs = True
+        f.score(automata.CanonicalMooreMachine.from_string("1 0 0 0"))
+        g = pickle.loads(pickle.dumps(f))
+        self.assertEqual(len(g._runs), 0)
+        self.assertEqual(g.reference_dict, f.reference_dict)
+        self.assertEqual(g.reference_dict.key_version, f.reference_dict.key_version)
+        self.assertEqual(g.score(m), f.score(m))
+        self.assertEqual([(k, v, v.bitmaps) for k, v in g.cache.items() if isinstance(v, TrackedScore)],
+                         [(k, v, v.bitmaps) for k, v in f.cache.items() if isinstance(v, TrackedScore)])
+
+        # Changing the reference strings forgets the records.
+        f.reference_dict[(2, 2, 2, 2, 2, 2, 2, 2, 2, 2)] = 1
+        f.trie()
+        self.assertEqual(len(f._runs), 0)
+
+    def test_agreement_scorer(self):
+        import itertools
+        from uniwitness import UniWitness
+
+        target = UniWitness(4)
+        strings = [w for length in range(7) for w in itertools.product(range(3), repeat=length)]
+        rng = np.random.default_rng(0)
+        for n in (1, 3, 6):
+            m = automata.CanonicalMooreMachine(n, int(rng.integers(2, 4)), 2)
+            for s in range(n):
+                for i in range(m.input_count()):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(2)))
+            # The same score as a reference dict of all the strings up to the length.
+            run = automata.MooreMachineRun(target)
+            reference = FSMScorer.from_function(lambda w: (run.reset(), run.multistep(w), run.output())[2], strings)
+            exact = AgreementScorer(target, 6)
+            self.assertEqual(exact.table_size(), reference.table_size())
+            self.assertEqual(exact.score(m), reference.score(m))
+            self.assertEqual(exact.score_population([m, target]), [reference.score(m), exact.table_size()])
+
+        # Long strings, with counts beyond 64 bits.
+        exact = AgreementScorer(target, 300)
+        self.assertEqual(exact.score(UniWitness(4).minimised()), exact.table_size())
+        agreements = exact.length_agreements(automata.CanonicalMooreMachine(1, 3))
+        self.assertEqual(agreements[:4], [1, 3, 9, 25])
+        self.assertEqual(agreements[300] + automata.CanonicalMooreMachine.count_strings_producing_output(target, 1, 300), 3 ** 300)
+
+    def test_balanced_reference_dict(self):
+        import countable
+        from uniwitness import UniWitness
+
+        def every_string(machine, n, input_count):
+            # The tables as the scorers used to build them, running every string in turn.
+            run = automata.CompiledRun(machine)
+            d = {}
+            positive = negative = 0
+            for s in countable.all_words_from_alphabet(range(input_count)):
+                result = run.run(s)
+                if (positive >= negative and result == 0) or (positive <= negative and result == 1):
+                    d[s] = result
+                    if result == 1:
+                        positive += 1
+                    else:
+                        negative += 1
+                    if positive + negative >= n:
+                        return d
+
+        for u in (2, 3, 5):
+            for n in (1, 8, 200):
+                d = balanced_reference_dict(UniWitness(u), n, 3)
+                self.assertEqual(list(d.items()), list(every_string(UniWitness(u), n, 3).items()))
+
+        # Symbol 2 self-loops, and output 2 is never taken.
+        m = automata.CanonicalMooreMachine.from_string(
+            "1 2 1\n"
+            "0 0 2\n"
+            "2 2 2")
+        self.assertEqual(list(balanced_reference_dict(m, 50, 3).items()), list(every_string(m, 50, 3).items()))
+
+        # Only the empty string has output 1, so once the counts are even again, no more than one other string can be taken.
+        m = automata.CanonicalMooreMachine.from_string(
+            "1 1 1\n"
+            "0 1 1")
+        self.assertEqual(balanced_reference_dict(m, 10, 2), {(): 1, (0,): 0, (1,): 0})
+
 
 
 if __name__ == '__main__':
@@ -129,43 +129,39 @@ def naive_minimisation(automaton):
 
 
 def Hopcroft_minimisation(Q, Sigma, delta, q0, F):
-  # Initialise the partition
-  P = {Q, frozenset(Q - F)}
-  W = {F}
-  
+  '''Return the partition of the states Q of a DFA into sets of equivalent states, following the pseudocode above.
+     (For Moore machines with any number of outputs, see automata.hopcroft_partition.)'''
+  # Initialise the partition, leaving out either side if it is empty
+  P = {Y for Y in (frozenset(F), frozenset(Q - F)) if len(Y) > 0}
+  W = {frozenset(F)} if len(F) > 0 else set()
+
   while len(W) > 0:
     A = W.pop()
-    print("outermost: ", A)
     for c in Sigma:
       # let X be the set of states for which a transition on c leads to a state in A
       X = frozenset({fstate for fstate in Q if delta[fstate][c] in A})
-      print ("outer: ",c, X)
       # for each set Y in P for which X ∩ Y is nonempty and Y \ X is nonempty do
-      for Y in P:
-        inter = frozenset(X & Y)
-        diff = frozenset(Y - X)
-        print("   inter: ", inter, "; diff: ", diff)
-        if inter != set() and diff != set():
-          # replace Y in P by the two sets X ∩ Y and Y \ X  
-          P = P - frozenset({Y}) | frozenset({inter, diff})
-          print("   new P: ",P)
+      for Y in list(P):
+        inter = X & Y
+        diff = Y - X
+        if len(inter) > 0 and len(diff) > 0:
+          # replace Y in P by the two sets X ∩ Y and Y \ X
+          P = (P - {Y}) | {inter, diff}
           # if Y is in W
           if Y in W:
             # replace Y in W by the same two sets
-            W = W - frozenset({Y}) & frozenset({inter, diff})
+            W = (W - {Y}) | {inter, diff}
           # else
           else:
             # if |X ∩ Y| <= |Y \ X|
             if len(inter) <= len(diff):
               # add X ∩ Y to W
-              W = W & frozenset({inter})
+              W = W | {inter}
             # else
             else:
               # add Y \ X to W
-              W = W & frozenset({diff})
-        print("inner: ", Y, W)
-  print("final: ", P)
-  return F
+              W = W | {diff}
+  return P
 
 
 # Unit testing code
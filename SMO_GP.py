@@ -5,6 +5,7 @@ SMO_GP - An implementation of the SMO-GP algorithm from "Computational Complexit
 Classes:
 
     Dominance - enumeration of the outcomes of comparing two sets of N-dimensional score vectors.
+    ParetoArchive - a population whose score vectors are kept in a NumPy array, to compare candidates with all of them at once.
     SMO_GP - a class implementing the SMO-GP algorithm, which over enough iterations approaches a population that is the Pareto front for the solution space.
     Test_SMO_GP - used for unit testing, via the standard unittest module.
 
@@ -14,9 +15,14 @@ Functions:
 '''
 
 import numpy as np
+import concurrent.futures
 import logging
+import pickle
+import time
 from enum import IntEnum, auto
 
+import telemetry
+
 class Dominance(IntEnum):
     '''Enum type that expresses whether either of two compared vectors dominates the other, or they are equal, or not comparable.'''
     NOT_COMPARABLE = auto()
@@ -43,22 +49,294 @@ def Default_Dominance_Compare(vector_a, vector_b):
             return Dominance.RIGHT
         else:
             return Dominance.EQUAL
-        
+
+
+def _score_array(scores):
+    '''Return the score vectors as the rows of a NumPy float array, or of an array of Python objects if some integer score is too large
+    for a float to hold exactly, as exact counts over all strings up to a length can be; those compare exactly, only more slowly.'''
+    try:
+        array = np.array(scores, dtype=float)
+        if not (np.abs(array) >= 2**53).any():
+            return array
+    except OverflowError:
+        pass
+    return np.array(scores, dtype=object)
+
+
+class ParetoArchive:
+    '''A population of pairs of individuals and score vectors, with the scores also held as the rows of a NumPy float array, so that
+    a candidate is compared with every member at once, by the same rule as Default_Dominance_Compare (see _score_array for huge scores).  Inserting a candidate has the
+    same outcome as SMO_GP's adjustment of the population with that comparator: it is dropped if a member dominates it, and otherwise
+    appended, after the members it weakly dominates (including any with equal scores) are dropped.'''
+
+    def __init__(self, population) -> None:
+        self._members = list(population)
+        if self._members:
+            self._scores = _score_array([scores for _, scores in self._members])
+        else:
+            # The number of objectives is not known until the first insertion.
+            self._scores = np.zeros((0, 0))
+
+    def __len__(self):
+        return len(self._members)
+
+    def members(self):
+        '''Return the list of pairs of individuals and score vectors, in order of insertion.  The list is replaced, not changed, by insertions.'''
+        return self._members
+
+    def best(self):
+        '''Return the tuple of the best score of any member in each objective.'''
+        return tuple(self._scores.max(axis=0).tolist()) if self._members else ()
+
+    def dominated_by(self, scores):
+        '''Return a boolean mask of the members that dominate the score vector: no worse in any objective, and better in at least one.'''
+        if not self._members:
+            return np.zeros(0, dtype=bool)
+        scores = _score_array(scores)
+        return (self._scores >= scores).all(axis=1) & (self._scores > scores).any(axis=1)
+
+    def dominates(self, scores):
+        '''Return a boolean mask of the members that the score vector weakly dominates: no better than it in any objective.'''
+        if not self._members:
+            return np.zeros(0, dtype=bool)
+        return (self._scores <= _score_array(scores)).all(axis=1)
+
+    def insert(self, candidate, scores):
+        '''Insert a candidate with its score vector; return whether it was kept.'''
+        return self.insert_many([candidate], [scores]) == 1
+
+    def insert_many(self, candidates, scores):
+        '''Insert the candidates with their score vectors, with the same outcome as inserting them one at a time, in order.
+        Return the number of candidates kept.
+        A candidate is dropped exactly when a member, or an earlier candidate, dominates it: whatever dominated it and has since
+        been dropped, was weakly dominated by something that then dominated the candidate too.  All of that is found with one
+        broadcast comparison; only the kept candidates are then compared with the rest, one by one, to drop what they dominate.'''
+        if len(candidates) == 0:
+            return 0
+        new = _score_array(scores).reshape(len(candidates), -1)
+        n = len(self._members)
+        # dominating[i, j] is true when row i of all the scores dominates candidate j
+        rows = np.concatenate((self._scores, new)) if n > 0 else new
+        dominating = (rows[:, np.newaxis, :] >= new[np.newaxis, :, :]).all(axis=2) \
+            & (rows[:, np.newaxis, :] > new[np.newaxis, :, :]).any(axis=2)
+        # Only earlier candidates count against a candidate.
+        dominating[n:] &= np.tri(len(candidates), k=-1, dtype=bool).T
+        accepted = np.flatnonzero(~dominating.any(axis=0))
+        if len(accepted) == 0:
+            return 0
+
+        keep = np.concatenate((np.ones(n, dtype=bool), np.zeros(len(candidates), dtype=bool)))
+        for j in accepted.tolist():
+            keep[:n + j] &= ~(rows[:n + j] <= new[j]).all(axis=1)
+            keep[n + j] = True
+        members = self._members + list(zip(candidates, scores))
+        self._members = [m for m, k in zip(members, keep.tolist()) if k]
+        self._scores = rows[keep]
+        return len(accepted)
+
+
+# The objectives of an SMO_GP run, as set in each worker process of its pool, and the number of dynamic changes they are from.
+_worker_objectives = None
+_worker_version = None
+
+def _set_worker_objectives(version, objectives):
+    global _worker_objectives, _worker_version
+    _worker_objectives = objectives
+    _worker_version = version
+
+def _score_in_worker(task):
+    '''Score a chunk of candidates on the objectives with the given indices; return the list of the columns of their scores, or None
+    if this worker's objectives are from before the task's version, and the task does not carry them pickled to renew them.'''
+    version, pickled_objectives, indices, candidates = task
+    if version != _worker_version:
+        if pickled_objectives is None:
+            return None
+        _set_worker_objectives(version, pickle.loads(pickled_objectives))
+    return [_score_column(_worker_objectives[k], candidates) for k in indices]
+
+
+def _population_scorer(objective):
+    '''Return the score_population method of the scorer whose score method the objective is, such as an FSMScorer's, or None.'''
+    owner = getattr(objective, "__self__", None)
+    if owner is not None and hasattr(owner, "score_population") and objective == getattr(owner, "score", None):
+        return owner.score_population
+    return None
+
+def _score_column(objective, candidates):
+    '''Return the list of the scores of the candidates on the objective, all at once if it is a scorer's score method.'''
+    population_scorer = _population_scorer(objective)
+    return population_scorer(candidates) if population_scorer is not None else [objective(c) for c in candidates]
+
 
 class SMO_GP:
     '''The SMO-GP algorithm, packaged as an iterator over generations.
     Each generation may add one mutant, which is added, and all individuals whose scores it dominates are deleted.
     Before the mutation is dont, the dynamic_change mutator is called in each generation - if it returns true, the environment has chaned and
-    the scores of the population are recomputed.'''
+    the scores of the population are recomputed.
+    With a batch_size above 1, each generation instead makes that many mutants of parents chosen from the same population, and adds them
+    one by one in the order they were made.  With workers, the mutants are scored in a pool of that many processes, each holding a copy
+    of the objectives; the copies are renewed after a dynamic change, as they are next used, so the pool is kept for the whole run.
+    The results are the same as without workers, for the same batch size.
+    With the default dominance comparator, the population is kept in a ParetoArchive, which has the same outcome, only faster.
+    Telemetry sinks (see the telemetry module) may be attached, to be sent a GenerationRecord for each generation; cache_hits is an
+    optional function returning the number of score cache hits so far, for those records.  Without sinks, no records are made.
+    A profiler (see profiling.PhaseProfiler) may be given, to be told the time taken by each phase: parent selection, mutation, each
+    objective (or the scoring in the pool, with workers), the update of the population, the dynamic change and the rescoring after it;
+    without one, nothing is timed.
+    An objective that is the score method of a scorer with a score_population method, such as FSMScorer, scores all the individuals
+    it is given at once through the latter, which gives the same scores.  With workers, it is called in this process with a function
+    to compute the scores of those not in its cache in the pool, so that its cache is looked up and filled here, as without workers.'''
 
     def __init__(self, initial_individuals, mutator, objectives, dominance_compare=Default_Dominance_Compare,
-                dynamic_change=None) -> None:
+                dynamic_change=None, batch_size=1, workers=0, cache_hits=None, profiler=None) -> None:
         self._mutator = mutator
         self._objectives = objectives
         self._dominance_compare = dominance_compare
         self._dynamic_change = dynamic_change
-        # Create the initial population as a list of pairs of individuals and tuples of their scores on objective fuctions
-        self._population = [(i, (*(obj(i) for obj in self._objectives),)) for i in initial_individuals]
+        self._batch_size = batch_size
+        self._workers = workers
+        self._pool = None
+        # The number of dynamic changes so far, which the workers' copies of the objectives are checked against, and the objectives
+        # as pickled to renew them, once per change.
+        self._objectives_version = 0
+        self._pickled_objectives = None
+        # The initial individuals are scored when the run starts, unless it is restored from a snapshot first, so that scoring them
+        # does not touch the objectives' caches of a resumed run.
+        self._initial_individuals = initial_individuals
+        self._population = None
+        self._archive = None
+        # The number of candidates made and scored, and the time spent on that
+        self.candidates = 0
+        self.candidate_time = 0.0
+        # The generations so far, and the number of score vectors computed, including for recomputations
+        self.generation = 0
+        self._resumed = False
+        self.evaluations = 0
+        self._cache_hits = cache_hits
+        self._sinks = []
+        self._telemetry_level = 0
+        self._profiler = profiler
+        self._objective_phases = ["objective %d (%s)" % (k, getattr(obj, "__name__", type(obj).__name__)) for k, obj in enumerate(objectives)]
+
+    def _start(self):
+        '''Create the initial population, as a list of pairs of individuals and tuples of their scores on the objective functions,
+        unless there already is one.'''
+        if self._population is None:
+            individuals = list(self._initial_individuals)
+            self._set_population(list(zip(individuals, self._score_locally(individuals))))
+            self.evaluations = len(self._population)
+
+    def _set_population(self, population):
+        self._population = population
+        if self._dominance_compare is Default_Dominance_Compare:
+            self._archive = ParetoArchive(self._population)
+
+    def state(self):
+        '''Return a picklable snapshot of the run: the population, the counts so far and the state of NumPy's global random generator.
+        Together with the state of the objectives, mutator and dynamic change, which belong to the caller, restore() continues from it
+        exactly as this run would continue.'''
+        self._start()
+        return {
+            "population": self._population,
+            "generation": self.generation,
+            "evaluations": self.evaluations,
+            "candidates": self.candidates,
+            "candidate_time": self.candidate_time,
+            "numpy_random": np.random.get_state(),
+        }
+
+    def restore(self, state):
+        '''Continue from a snapshot returned by state(), before populations() is called.  The first population it yields is the
+        snapshot's, as the generation it was taken at; the initial individuals are not scored.'''
+        self._set_population(state["population"])
+        self.generation = state["generation"]
+        self.evaluations = state["evaluations"]
+        self.candidates = state["candidates"]
+        self.candidate_time = state["candidate_time"]
+        np.random.set_state(state["numpy_random"])
+        # The snapshot's population was already reported to the telemetry sinks.
+        self._resumed = True
+
+    def add_telemetry_sink(self, sink, level=0):
+        '''Send a GenerationRecord for each generation from now on to the sink, by calling its emit().  The records give the level,
+        so that the runs of an experiment made of several in turn can be told apart.'''
+        self._sinks.append(sink)
+        self._telemetry_level = level
+
+    def _emit_telemetry(self):
+        if self._archive is not None:
+            best = self._archive.best()
+        else:
+            best = tuple(max(objective) for objective in zip(*(scores for _, scores in self._population)))
+        record = telemetry.GenerationRecord(self.generation, len(self._population), best, self.evaluations,
+                                            -1 if self._cache_hits is None else self._cache_hits(),
+                                            self._telemetry_level)
+        for sink in self._sinks:
+            sink.emit(record)
+
+    def throughput(self):
+        '''Return the number of candidates made and scored per second, per worker (counting the main process as the one worker without a pool).'''
+        if self.candidate_time == 0.0:
+            return 0.0
+        return self.candidates / self.candidate_time / max(self._workers, 1)
+
+    def _score_candidates(self, candidates):
+        '''Return the list of the score vectors of the candidates, computed in the pool of workers if there is one.'''
+        if self._workers > 0:
+            columns = [None] * len(self._objectives)
+            plain = [k for k, obj in enumerate(self._objectives) if _population_scorer(obj) is None]
+            if plain:
+                for k, column in zip(plain, self._map_in_pool(plain, candidates)):
+                    columns[k] = column
+            for k, obj in enumerate(self._objectives):
+                population_scorer = _population_scorer(obj)
+                if population_scorer is not None:
+                    columns[k] = population_scorer(candidates, lambda pending, k=k: self._map_in_pool([k], pending)[0])
+            if self._profiler is not None:
+                self._profiler.lap("scoring (pool)")
+            return list(zip(*columns))
+        return self._score_locally(candidates, self._profiler)
+
+    def _map_in_pool(self, indices, candidates):
+        '''Return the columns of the scores of the candidates on the objectives with the given indices, computed in the pool, in a
+        chunk for each worker.  The chunks that reach a worker with objectives from before the last dynamic change are sent again,
+        with the objectives.'''
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self._workers, initializer=_set_worker_objectives,
+                                                                initargs=(self._objectives_version, self._objectives))
+        size = max(1, -(-len(candidates) // self._workers))
+        chunks = [candidates[first:first + size] for first in range(0, len(candidates), size)]
+        results = list(self._pool.map(_score_in_worker, [(self._objectives_version, None, indices, chunk) for chunk in chunks]))
+        stale = [j for j, result in enumerate(results) if result is None]
+        if stale:
+            if self._pickled_objectives is None:
+                self._pickled_objectives = pickle.dumps(self._objectives)
+            tasks = [(self._objectives_version, self._pickled_objectives, indices, chunks[j]) for j in stale]
+            for j, result in zip(stale, self._pool.map(_score_in_worker, tasks)):
+                results[j] = result
+        return [[score for result in results for score in result[n]] for n in range(len(indices))]
+
+    def _score_locally(self, candidates, profiler=None):
+        '''Return the list of the score vectors of the candidates, computed in this process, one objective at a time; the profiler,
+        if given, is told the time taken by each.'''
+        columns = []
+        for phase, obj in zip(self._objective_phases, self._objectives):
+            if profiler is not None and _population_scorer(obj) is None:
+                column = []
+                for c in candidates:
+                    column.append(obj(c))
+                    profiler.lap(phase)
+                columns.append(column)
+            else:
+                columns.append(_score_column(obj, candidates))
+                if profiler is not None:
+                    profiler.lap(phase)
+        return list(zip(*columns))
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
 
     def populations(self):
@@ -85,32 +363,81 @@ class SMO_GP:
                 self._population = new_population
 
 
+        profiler = self._profiler
+
+        self._start()
         # Yield generation "zero"
-        logging.debug("Yielding population:\n" + str(self._population))
+        logging.debug("Yielding population:\n%s", self._population)
+        if self._sinks and not self._resumed:
+            self._emit_telemetry()
+        if profiler is not None:
+            profiler.generation(self.generation)
         yield self._population
 
-        while True:
-            # Call the dynamic change function if there is one.
-            while not(self._dynamic_change is None) and next(self._dynamic_change):
-                # Recompute the scores of the whole population, and eliminate weakly dominated individuals.
-                self._population = [(i[0], (*(obj(i[0]) for obj in self._objectives),)) for i in self._population]
-                logging.debug("Recomputed : " + str(self._population))
-
-            # Choose a random individual from the population, ignore its scores
-            #parent = random.choice(self._population)[0]
-            parent = self._population[np.random.choice(len(self._population))][0]
-            # Copy and mutate it into a new individual Y
-            # This assumes that the mutator function makes a deep copy if necessary
-            candidate = self._mutator(parent)
-            candidates_scores = *(obj(candidate) for obj in self._objectives),
-
-            logging.debug("Candidate :\n" + str(candidate))
-            logging.debug(candidates_scores)
-
-            adjust_population(candidate, candidates_scores)
-            
-            logging.debug("Yielding population:\n" + str(self._population))
-            yield self._population
+        try:
+            while True:
+                # Call the dynamic change function if there is one.
+                if profiler is not None:
+                    profiler.mark()
+                while not(self._dynamic_change is None) and next(self._dynamic_change):
+                    if profiler is not None:
+                        profiler.lap("dynamic_change")
+                    # Recompute the scores of the whole population, and eliminate weakly dominated individuals.
+                    individuals = [i for i, _ in self._population]
+                    self._set_population(list(zip(individuals, self._score_locally(individuals))))
+                    self.evaluations += len(self._population)
+                    logging.debug("Recomputed : %s", self._population)
+                    # The workers hold copies of the objectives from before the change, to be renewed as they are next used.
+                    self._objectives_version += 1
+                    self._pickled_objectives = None
+                    if profiler is not None:
+                        profiler.lap("rescoring")
+                if profiler is not None and self._dynamic_change is not None:
+                    profiler.lap("dynamic_change")
+
+                start = time.perf_counter()
+                candidates = []
+                for _ in range(self._batch_size):
+                    if profiler is not None:
+                        profiler.mark()
+                    # Choose a random individual from the population, ignore its scores
+                    #parent = random.choice(self._population)[0]
+                    parent = self._population[np.random.choice(len(self._population))][0]
+                    if profiler is not None:
+                        profiler.lap("selection")
+                    # Copy and mutate it into a new individual Y
+                    # This assumes that the mutator function makes a deep copy if necessary
+                    candidates.append(self._mutator(parent))
+                    if profiler is not None:
+                        profiler.lap("mutation")
+                scores = self._score_candidates(candidates)
+                self.candidates += len(candidates)
+                self.evaluations += len(candidates)
+                self.candidate_time += time.perf_counter() - start
+
+                if profiler is not None:
+                    profiler.mark()
+                for candidate, candidates_scores in zip(candidates, scores):
+                    logging.debug("Candidate :\n%s", candidate)
+                    logging.debug("%s", candidates_scores)
+
+                    if self._archive is None:
+                        adjust_population(candidate, candidates_scores)
+                if self._archive is not None:
+                    self._archive.insert_many(candidates, scores)
+                    self._population = self._archive.members()
+                if profiler is not None:
+                    profiler.lap("archive")
+
+                self.generation += 1
+                logging.debug("Yielding population:\n%s", self._population)
+                if self._sinks:
+                    self._emit_telemetry()
+                if profiler is not None:
+                    profiler.generation(self.generation)
+                yield self._population
+        finally:
+            self._close_pool()
 
 
 # Unit testing code.
@@ -119,6 +446,9 @@ class SMO_GP:
 
 import unittest as ut
 
+import profiling
+import scorecache
+
 
 class Test_SMO_GP(ut.TestCase):
     def test_SMO_GP(self):
@@ -157,6 +487,241 @@ class Test_SMO_GP(ut.TestCase):
                 break
         self.assertEqual(gen, [((100,100),(149,149))])
 
+    def test_SMO_GP_batches(self):
+        def run(workers):
+            np.random.seed(1)
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, _TEST_OBJECTIVES, batch_size=4, workers=workers)
+            for i, gen in enumerate(op.populations()):
+                if i >= 30:
+                    break
+            self.assertEqual(op.candidates, 120)
+            self.assertGreater(op.throughput(), 0.0)
+            return sorted(gen)
+
+        self.assertEqual(run(0), run(2))
+
+        # The workers' copies of the objectives are renewed after dynamic changes, in the same pool.
+        def run_changing(workers):
+            np.random.seed(5)
+            objective = _ShiftedObjective()
+            def changes():
+                while True:
+                    objective.shift += 1
+                    yield True
+                    yield False
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, (objective, _test_objective_1), dynamic_change=changes(), batch_size=4, workers=workers)
+            pools = set()
+            for i, gen in enumerate(op.populations()):
+                if i >= 20:
+                    break
+                if i > 0:
+                    pools.add(op._pool)
+            return sorted(gen), len(pools)
+
+        self.assertEqual(run_changing(2), (run_changing(0)[0], 1))
+
+    def test_population_scorer(self):
+        def run(objectives):
+            np.random.seed(3)
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, objectives, batch_size=4)
+            for i, gen in enumerate(op.populations()):
+                if i >= 20:
+                    break
+            return gen
+
+        scorer = _PopulationScorer()
+        self.assertIs(_population_scorer(scorer.score).__func__, _PopulationScorer.score_population)
+        self.assertIsNone(_population_scorer(_test_objective_0))
+        self.assertEqual(run((scorer.score, _test_objective_1)), run(_TEST_OBJECTIVES))
+        # One call for the initial individuals, and one for each batch.
+        self.assertEqual(scorer.calls, 21)
+
+    def test_telemetry(self):
+        class ListSink:
+            def __init__(self):
+                self.records = []
+            def emit(self, record):
+                self.records.append(record)
+
+        np.random.seed(0)
+        hits = [0]
+        op = SMO_GP({(0, 0, 0)}, _test_mutator, _TEST_OBJECTIVES, batch_size=2, cache_hits=lambda: hits[0])
+        sink = ListSink()
+        op.add_telemetry_sink(sink)
+        for i, gen in enumerate(op.populations()):
+            hits[0] += 1
+            if i >= 10:
+                break
+        self.assertEqual([r.generation for r in sink.records], list(range(11)))
+        self.assertEqual(sink.records[0], telemetry.GenerationRecord(0, 1, (0.0, 0.0), 1, 0))
+        last = sink.records[-1]
+        self.assertEqual((last.front_size, last.evaluations, last.cache_hits), (len(gen), 21, 10))
+        self.assertEqual(last.best_scores, tuple(float(max(s[k] for _, s in gen)) for k in range(2)))
+
+        # With workers, a scorer's cache is looked up and filled in this process, so the records are as without them; the level is
+        # given with the sink.
+        def run(workers):
+            np.random.seed(4)
+            objective = _CachedObjective()
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, (objective.score, _test_objective_1), batch_size=3, workers=workers,
+                        cache_hits=lambda: objective.cache.hits)
+            sink = ListSink()
+            op.add_telemetry_sink(sink, level=3)
+            for i, gen in enumerate(op.populations()):
+                if i >= 15:
+                    break
+            return sink.records, objective.cache.stats()
+
+        records, stats = run(2)
+        self.assertEqual((records, stats), run(0))
+        self.assertEqual(records[-1].level, 3)
+        self.assertGreater(records[-1].cache_hits, 0)
+
+    def test_restore(self):
+        class ListSink:
+            def __init__(self):
+                self.records = []
+            def emit(self, record):
+                self.records.append(record)
+
+        def start(objective, state=None):
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, (objective, _test_objective_1), cache_hits=lambda: objective.cache.hits)
+            if state is not None:
+                op.restore(state)
+            sink = ListSink()
+            op.add_telemetry_sink(sink)
+            return op, op.populations(), sink.records
+
+        def run_to(op, populations, generations):
+            for gen in populations:
+                if op.generation >= generations:
+                    return list(gen)
+
+        np.random.seed(2)
+        objective = _CachedObjective()
+        op, populations, records = start(objective)
+        run_to(op, populations, 20)
+        # A checkpoint holds the objective, with its cache, along with the snapshot.
+        checkpoint = pickle.dumps((op.state(), objective))
+        expected = run_to(op, populations, 50)
+        np.random.seed(99)
+        state, resumed_objective = pickle.loads(checkpoint)
+        op, populations, resumed_records = start(resumed_objective, state)
+        self.assertEqual(run_to(op, populations, 50), expected)
+        self.assertEqual(op.generation, 50)
+        # Resuming scores nothing again, so the telemetry and the cache agree with the run that went on.
+        self.assertEqual(resumed_records, records[21:])
+        self.assertEqual(resumed_objective.cache.stats(), objective.cache.stats())
+        self.assertEqual(list(resumed_objective.cache), list(objective.cache))
+
+    def test_profiler(self):
+        def changes():
+            while True:
+                yield False
+                yield True
+
+        def run(profiler):
+            np.random.seed(3)
+            op = SMO_GP({(0, 0, 0)}, _test_mutator, _TEST_OBJECTIVES, batch_size=2, dynamic_change=changes(), profiler=profiler)
+            for i, gen in enumerate(op.populations()):
+                if i >= 20:
+                    break
+            return list(gen)
+
+        # Profiling changes nothing but the timings.
+        profiler = profiling.PhaseProfiler()
+        self.assertEqual(run(profiler), run(None))
+        calls = {phase: calls for phase, calls, _ in profiler.phases()}
+        # Every generation after the first has a change, before the call that returns False.
+        self.assertEqual(calls, {"dynamic_change": 39, "rescoring": 19, "selection": 40, "mutation": 40,
+                                 "objective 0 (_test_objective_0)": 40, "objective 1 (_test_objective_1)": 40, "archive": 20})
+
+    def test_ParetoArchive(self):
+        rng = np.random.default_rng(0)
+        for objectives in (1, 2, 3, 5):
+            # Start from a population that is not a front, as initial populations need not be.
+            population = [(i, tuple(rng.integers(4, size=objectives).tolist())) for i in range(6)]
+            archive = ParetoArchive(population)
+            probe = tuple(rng.integers(4, size=objectives).tolist())
+            self.assertEqual(archive.dominated_by(probe).tolist(),
+                             [Default_Dominance_Compare(s, probe) == Dominance.LEFT for _, s in population])
+            self.assertEqual(archive.dominates(probe).tolist(),
+                             [Default_Dominance_Compare(s, probe) in (Dominance.EQUAL, Dominance.RIGHT) for _, s in population])
+
+            # Batches of candidates have the same outcome as SMO_GP's one-by-one adjustment.
+            for step in range(40):
+                batch = [(100 * step + k, tuple(rng.integers(6, size=objectives).tolist())) for k in range(int(rng.integers(1, 6)))]
+                for candidate, scores in batch:
+                    if not any(Default_Dominance_Compare(s, scores) == Dominance.LEFT for _, s in population):
+                        population = [(i, s) for i, s in population
+                                      if Default_Dominance_Compare(s, scores) not in (Dominance.EQUAL, Dominance.RIGHT)]
+                        population.append((candidate, scores))
+                archive.insert_many([c for c, _ in batch], [s for _, s in batch])
+                self.assertEqual(archive.members(), population)
+
+        # Integer scores beyond the precision, or the range, of floats still compare exactly.
+        archive = ParetoArchive([("a", (3 ** 400, -2))])
+        self.assertTrue(archive.insert("b", (3 ** 400 + 1, -2)))
+        self.assertFalse(archive.insert("c", (3 ** 400, -2)))
+        self.assertTrue(archive.insert("d", (3 ** 700, -3)))
+        self.assertEqual([m for m, _ in archive.members()], ["b", "d"])
+        self.assertEqual(archive.best(), (3 ** 700, -2))
+
+
+# Module-level, so that the workers of a pool can unpickle them.
+def _test_mutator(t):
+    return tuple(max(0, min(9, v + np.random.randint(-1, 3))) for v in t)
+
+def _test_objective_0(v):
+    return v[0]
+
+def _test_objective_1(v):
+    return v[1] - v[2]
+
+_TEST_OBJECTIVES = (_test_objective_0, _test_objective_1)
+
+class _PopulationScorer:
+    '''_test_objective_0 as the score method of a scorer that can score a population at once, counting the calls for that.'''
+    def __init__(self):
+        self.calls = 0
+
+    def score(self, v):
+        return _test_objective_0(v)
+
+    def score_population(self, vs, compute=None):
+        self.calls += 1
+        return (compute or (lambda vs: [self.score(v) for v in vs]))(vs)
+
+class _ShiftedObjective:
+    '''_test_objective_0 shifted round by a number that dynamic changes increase.'''
+    def __init__(self):
+        self.shift = 0
+
+    def __call__(self, v):
+        return (v[0] + self.shift) % 10
+
+class _CachedObjective:
+    '''_test_objective_0 behind a bounded LRU score cache, as FSMScorer keeps one, for the hits to be counted.  Its score method
+    also scores populations through the cache, as FSMScorer's does.'''
+    def __init__(self):
+        self.cache = scorecache.LRUScoreCache(max_entries=5)
+
+    def __call__(self, v):
+        score = self.cache.get(v)
+        if score is None:
+            score = self.cache[v] = _test_objective_0(v)
+        return score
+
+    def score(self, v):
+        return self(v)
+
+    def score_population(self, vs, compute=None):
+        scores = {v: self.cache.get(v) for v in dict.fromkeys(vs)}
+        pending = [v for v, score in scores.items() if score is None]
+        for v, score in zip(pending, (compute or (lambda vs: [_test_objective_0(v) for v in vs]))(pending)):
+            scores[v] = self.cache[v] = score
+        return [scores[v] for v in vs]
+
 
 
 
@@ -8,11 +8,20 @@ Classes:
     CanonicalSemiAutomaton - a FiniteSemiAutomaton that encodes its states and its inputs as integers, and its transition function as a sparse structure.
     MooreMachine - a FiniteSemiAutomaton with a starting state and a function mapping each state to an output.
     CanonicalMooreMachine - a MooreMachine that encodes states, inputs and outputs as integers, and always starts with state 0.
+    DenseCanonicalSemiAutomaton - a CanonicalSemiAutomaton with its transition function held in a dense NumPy table.
+    DenseCanonicalMooreMachine - a CanonicalMooreMachine with dense NumPy transition and output tables.
     MooreMachineRun - a MooreMachine in action, with functions to feed it input and retrieve its output.
+    CompiledRun - a snapshot of a CanonicalMooreMachine's tables as lists, for running it over many strings quickly.
+    WordSampler - draws strings of a given length and output uniformly at random from a CanonicalMooreMachine, by counting paths.
+    EditLog - the arcs and outputs changed in a clone since it was made from another machine.
 
 Functions:
 
-    None.
+    canonical_form - a packed encoding of the reachable part of a CanonicalMooreMachine, numbered in breadth-first order.
+    canonical_key - a hash of the canonical form, so that machines with the same behaviour have the same key.
+    equivalent - whether two CanonicalMooreMachines produce the same output on every string, by Hopcroft and Karp's union-find algorithm.
+    shortest_distinguishing_word - a shortest string on which two CanonicalMooreMachines produce different outputs.
+    hopcroft_partition - the coarsest partition of the states of a Moore machine into equivalent states, by Hopcroft's algorithm.
 '''
 
 __author__ = "Gabor 'Tony' Zoltai"
@@ -26,7 +35,14 @@ __status__ = "Prototype"
 
 
 
+import array
+import copy
+import hashlib
 import itertools
+import struct
+import weakref
+
+import numpy as np
 
 
 class SemiAutomaton(object):
@@ -54,24 +70,88 @@ class SemiAutomaton(object):
 class FiniteSemiAutomaton(SemiAutomaton):
     '''A subclass of SemiAutomaton with finite sets of states and inputs.'''
 
-    def path_between(self, from_state, to_state):
-        '''Return a sequence of inputs that starting from 'from_state' ends up at 'to_state', or None if this is not possible.  (Note - this is an exhaustive search.)'''
+    # The number of (source, state) pairs all_pairs_distances() aims to search from at once.
+    DISTANCE_BLOCK_ENTRIES = 1 << 22
 
-        def path_extension_to(path, visited_states, from_state, to_state):
-            # return the first path found between the two states that a depth-first recursive search encounters
-            if from_state == to_state:
-                return (path, visited_states)
-            else:
-                for i, s in ((input, self.next_state(from_state, input)) for input in self.inputs()):
-                    if s not in visited_states:
-                        r = path_extension_to(path + [i], visited_states | {from_state}, s, to_state)
-                        if r != None:
-                            return r
-                else:
-                    # if we get here, no paths to to_state were found from the one-step successors of from_state
-                    return None
+    def transition_array(self):
+        '''Return the transition function as a new NumPy int32 array, with a row for each state and a column for each input, and the
+        states and inputs numbered by their positions in states() and inputs().'''
+        states = list(self.states())
+        number = {s: k for k, s in enumerate(states)}
+        return np.array([[number[self.next_state(s, i)] for i in self.inputs()] for s in states], dtype=np.int32).reshape(len(states), -1)
 
-        return path_extension_to([], set(), from_state, to_state)
+    def arc_rows(self, width=None):
+        '''Return the transition function as a list of rows, numbered as in transition_array(); with a width, each row is cut, or
+        widened with self-loops, to that many inputs.'''
+        return _fit_rows(self.transition_array().tolist(), width)
+
+    def path_between(self, from_state, to_state):
+        '''Return a shortest sequence of inputs that starting from 'from_state' ends up at 'to_state', with the set of states it passes
+        through before 'to_state', or None if this is not possible.  (Note - this is a breadth-first search through next_state(),
+        which stops as soon as 'to_state' is found, and does not follow transitions to anything that is not one of the states.)'''
+        if from_state == to_state:
+            return ([], set())
+        states = self.states()
+        inputs = list(self.inputs())
+        next_state = self.next_state
+
+        # The state each state was discovered from, and the input leading from it.
+        predecessor = {from_state: (None, None)}
+        order = [from_state]
+        # The loop also visits the states appended to 'order' as they are discovered.
+        for s in order:
+            for i in inputs:
+                t = next_state(s, i)
+                if t not in predecessor and t in states:
+                    predecessor[t] = (s, i)
+                    if t == to_state:
+                        return self._path_to(to_state, predecessor)
+                    order.append(t)
+        return None
+
+    @staticmethod
+    def _path_to(goal, predecessor):
+        '''Follow the predecessors back from the goal to the start, and return the path as path_between does.'''
+        path = []
+        passed = set()
+        s, i = predecessor[goal]
+        while s is not None:
+            path.append(i)
+            passed.add(s)
+            s, i = predecessor[s]
+        path.reverse()
+        return (path, passed)
+
+    def all_pairs_distances(self):
+        '''Return the matrix of the lengths of the shortest paths from each state (row) to each state (column), or -1 where there is
+        no path, with the states numbered as in transition_array().  A breadth-first search is run from every source, level by level
+        on blocks of sources at once, over the integer transition array.  The matrix is int16 for fewer than 2**15 states, so that
+        10**4 states take 200MB.'''
+        table = self.transition_array().astype(np.int64)
+        n = table.shape[0]
+        distances = np.full((n, n), -1, dtype=np.int16 if n < 2**15 else np.int32)
+        # Enough sources per block to keep the frontiers to a few million entries.
+        block = max(1, self.DISTANCE_BLOCK_ENTRIES // max(n, 1))
+        # Scratch space to find the first occurrence of each position reached, in linear time rather than by sorting.
+        first_seen = np.empty(min(block, n) * n, dtype=np.int64)
+        for first in range(0, n, block):
+            rows = distances[first:first + block]
+            b = len(rows)
+            flat = rows.reshape(-1)
+            # The frontier holds positions in the block: the source's row times n, plus the state reached.
+            frontier = np.arange(b, dtype=np.int64) * n + np.arange(first, first + b)
+            flat[frontier] = 0
+            level = 0
+            while len(frontier):
+                level += 1
+                row, state = np.divmod(frontier, n)
+                reached = (table[state] + (row * n)[:, np.newaxis]).reshape(-1)
+                reached = reached[flat[reached] < 0]
+                order = np.arange(len(reached))
+                first_seen[reached[::-1]] = order[::-1]
+                frontier = reached[first_seen[reached] == order]
+                flat[frontier] = level
+        return distances
 
 
     def reachable(self, from_state, to_state):
@@ -90,17 +170,67 @@ class FiniteSemiAutomaton(SemiAutomaton):
 class CanonicalSemiAutomaton(FiniteSemiAutomaton):
     '''A kind of Machine where states and inputs are represented by integers, and transition arcs must be explicitly given.'''
 
+    # The attributes holding storage that clone() shares between machines until one of them modifies it.
+    _copy_on_write = ("_transition_table",)
+
     def __init__(self, state_count=1, input_count=1) -> None:
         # super().__init__(states=range(state_count), input_alphabet=range(alphabet_count), transition_function = self._canonical_table_transition)
         self._state_count = state_count
         self._input_count = input_count
         self._transition_table = {}
+        # The names of the attributes in _copy_on_write whose storage may still be shared with a clone.
+        self._shared = set()
+        # The number of changes made to the machine so far, and if it is a clone, the log of its changes since cloning.
+        self._modifications = 0
+        self._edits = None
+
+    def __getstate__(self):
+        # The edit log refers to the machine cloned from by a weak reference, which cannot be copied or pickled.
+        state = self.__dict__.copy()
+        state["_edits"] = None
+        return state
+
+    def clone(self):
+        '''Return a copy of the machine that shares its storage with this one, until either of them modifies it.
+        Much faster than deepcopy, as only the storage that is actually changed afterwards is ever copied.
+        The copy logs the arcs and outputs changed in it, so that results computed for this machine can be updated (see EditLog).'''
+        r = copy.copy(self)
+        self._shared = set(self._copy_on_write)
+        r._shared = set(self._copy_on_write)
+        r._edits = EditLog(self)
+        return r
+
+    def modifications(self):
+        '''Return the number of changes made to the machine so far; this tells whether it has changed since a result was computed for it.'''
+        return self._modifications
+
+    def edit_log(self):
+        '''Return the EditLog of the changes since the machine was cloned, or None if it is not a clone.'''
+        return self._edits
+
+    def _arc_edited(self, from_state, on_input):
+        '''Count a change to the arc from 'from_state' on 'on_input', and log it if the machine is a clone.'''
+        self._modifications += 1
+        if self._edits is not None:
+            self._edits.arcs.add((from_state, on_input))
+
+    def _own(self, name):
+        '''Make the storage held in the named attribute private to this machine, copying it if it may be shared with a clone.'''
+        if name in self._shared:
+            setattr(self, name, getattr(self, name).copy())
+            self._shared.discard(name)
     
     def states(self):
         return range(self._state_count)
     
     def inputs(self):
         return range(self._input_count)
+
+    def state_count(self):
+        return self._state_count
+
+    def input_count(self):
+        return self._input_count
     
     def next_state(self, state, input):
         '''Implement a transition function based on an internal dictionary of dictionaries, sparse at both levels, with missing entries being self-loops.'''
@@ -118,6 +248,8 @@ class CanonicalSemiAutomaton(FiniteSemiAutomaton):
         if greater_state >= self.state_count():
             self.add_state(greater_state - self.state_count() + 1)
 
+        self._own("_transition_table")
+        self._arc_edited(from_state, on_input)
         if from_state == to_state:
             # making a self-loop, which is not encoded in the sparse dict
             if (from_state, on_input) in self._transition_table:
@@ -128,6 +260,7 @@ class CanonicalSemiAutomaton(FiniteSemiAutomaton):
     def add_state(self, number_of_states=1):
         '''Add new states , not connected to any others, and looping back to itself on any symbol.'''
         self._state_count += number_of_states
+        self._modifications += 1
     
     def delete_state(self, state):
         '''Delete the given state; make it equivalent to the current highest state, then discard that state.'''
@@ -144,6 +277,79 @@ class CanonicalSemiAutomaton(FiniteSemiAutomaton):
 
         # finally, reduce the number of states by 1
         self._state_count -= 1
+        self._modifications += 1
+
+    def reachable_states(self, from_state=0):
+        '''Return the list of the states reachable from the given state, in breadth-first order of discovery, following every
+        stored arc, as next_state() does (see arc_rows).'''
+        table = self.arc_rows()
+        seen = [False] * max(len(table), from_state + 1)
+        seen[from_state] = True
+        order = [from_state]
+        # The loop also visits the states appended to 'order' as they are discovered.
+        for s in order:
+            for t in table[s]:
+                if not seen[t]:
+                    seen[t] = True
+                    order.append(t)
+        return order
+
+    def compact(self):
+        '''Drop the states unreachable from state 0, and renumber the rest in their original order; return the number of states dropped.
+        A state beyond state_count() that an arc still leads to is reachable, and becomes one of the machine's states.
+        Renumbering breaks the relation to the machine cloned from, so a compacted clone no longer has an edit log.'''
+        keep = sorted(self.reachable_states())
+        dropped = self._state_count - sum(1 for s in keep if s < self._state_count)
+        if keep != list(range(self._state_count)):
+            self._renumber(keep)
+            self._state_count = len(keep)
+            self._modifications += 1
+            self._edits = None
+        return dropped
+
+    def _renumber(self, keep):
+        '''Rebuild the storage to hold only the states in the ascending list 'keep', numbered by their positions in it.'''
+        number = {s: k for k, s in enumerate(keep)}
+        self._transition_table = {(number[s], i): number[t] for (s, i), t in self._transition_table.items() if s in number}
+        self._shared.discard("_transition_table")
+
+    def _arc_extent(self):
+        '''Return the numbers of states and inputs spanned by the stored arcs, at least state_count() and input_count().'''
+        states, inputs = self._state_count, self._input_count
+        for (s, i), t in self._transition_table.items():
+            states = max(states, s + 1, t + 1)
+            inputs = max(inputs, i + 1)
+        return states, inputs
+
+    def arc_rows(self, width=None):
+        '''Return the transition function as a list of rows, like transition_array().tolist(), but spanning every stored arc.  Arcs on
+        inputs beyond input_count(), and arcs that delete_state() left leading to the state it removed, are followed by next_state()
+        but left out of transition_array(); here the rows are widened for such inputs, and rows added for such states.  With a
+        width, each row is then cut, or widened with self-loops, to that many inputs.'''
+        rows = self._stored_array().tolist()
+        states, inputs = self._arc_extent()
+        if states > self._state_count or inputs > self._input_count:
+            for s, row in enumerate(rows):
+                row.extend(self.next_state(s, i) for i in range(self._input_count, inputs))
+            rows.extend([self.next_state(s, i) for i in range(inputs)] for s in range(self._state_count, states))
+        return _fit_rows(rows, width)
+
+    def transition_array(self):
+        '''Return the transition function as a new NumPy int32 array, with a row for each state and a column for each input.  Raises
+        ValueError if an arc leads to a state beyond state_count(), as delete_state() can leave; arc_rows() has rows for those.'''
+        table = self._stored_array()
+        if table.size and table.max() >= self._state_count:
+            raise ValueError(f"an arc leads to state {table.max()}, beyond the {self._state_count} states; use arc_rows()")
+        return table
+
+    def _stored_array(self):
+        '''Return the stored arcs of the states and inputs within state_count() and input_count(), as transition_array() does, but
+        without checking where they lead.'''
+        table = np.repeat(np.arange(self._state_count, dtype=np.int32)[:, np.newaxis], self._input_count, axis=1)
+        for (s, i), t in self._transition_table.items():
+            if s < self._state_count and i < self._input_count:
+                table[s, i] = t
+        return table
 
     def __repr__(self) -> str:
         '''Representation as a string.'''
@@ -179,8 +385,120 @@ class MooreMachine(FiniteSemiAutomaton):
         '''Return the set of outputs from all states.  (Note - runs in proportional time to number of states.)'''
         return {self.output(s) for s in self.states()}
 
+    def arc_outputs(self):
+        '''Return the outputs of the states as a list, by the rows of arc_rows().'''
+        return [self.output(s) for s in self.states()]
+
+    def _suffix_layers(self, o):
+        '''Return the transition table of the machine trimmed for output o, a function giving for each length r the list, by trimmed
+        state, of whether some string of length r leads from that state to one with output o, and whether there are infinitely many
+        strings producing o.  The trimmed machine keeps the states reachable from the starting state from which a state with output
+        o can be reached, numbered in breadth-first order from the starting state as 0, with -1 for the arcs leaving them; it has no
+        states if no string produces o, and infinitely many strings produce o exactly when it has a cycle.  The layers are computed
+        as they are first asked for, each from the one before, and each list has an extra False at the end, for the arcs to -1.'''
+        rows = self.arc_rows(len(self.inputs()))
+        outputs = self.arc_outputs()
+        start = list(self.states()).index(self.starting_state())
+        order = [start]
+        predecessors = {start: []}
+        for s in order:
+            for t in rows[s]:
+                if t not in predecessors:
+                    predecessors[t] = []
+                    order.append(t)
+                predecessors[t].append(s)
+        # Search backwards from the reachable states with output o for those that lead to them.
+        live = [s for s in order if outputs[s] == o]
+        alive = set(live)
+        for t in live:
+            for s in predecessors[t]:
+                if s not in alive:
+                    alive.add(s)
+                    live.append(s)
+        kept = [s for s in order if s in alive]
+        number = {s: k for k, s in enumerate(kept)}
+        table = [[number.get(t, -1) for t in rows[s]] for s in kept]
+
+        # The trimmed machine has a cycle if taking away the states no arc enters, as long as there are any, leaves some.
+        entering = [0] * len(table)
+        for row in table:
+            for t in row:
+                if t >= 0:
+                    entering[t] += 1
+        sources = [s for s, e in enumerate(entering) if e == 0]
+        for s in sources:
+            for t in table[s]:
+                if t >= 0:
+                    entering[t] -= 1
+                    if entering[t] == 0:
+                        sources.append(t)
+        infinite = len(sources) < len(table)
+
+        successors = np.array(table, dtype=np.int64).reshape(len(table), len(self.inputs()))
+        layers = [[outputs[s] == o for s in kept] + [False]]
+
+        def layer_at(r):
+            while len(layers) <= r:
+                layer = np.array(layers[-1], dtype=bool)
+                layers.append(layer[successors].any(axis=1).tolist() + [False])
+            return layers[r]
+
+        return table, layer_at, infinite
+
     def strings_producing_output(self, o):
-        '''Generates all the strings that result in a given output.  Can be used to generate the language of a DFA.'''
+        '''Generates all the strings that result in a given output, in length-lexicographic order by the order of inputs(); stops if there
+        are finitely many.  Can be used to generate the language of a DFA.  The strings of each length are found by a depth-first search
+        from the starting state that only follows inputs to states with some suffix of the remaining length to an output o state, so
+        each step leads to strings to yield, and memory is bounded by the length, not by the number of strings.  Only the states
+        reachable from the starting state that lead to an output o state are searched (see _suffix_layers).'''
+        table, layer_at, infinite = self._suffix_layers(o)
+        inputs = list(self.inputs())
+        m = len(inputs)
+        length = 0
+        # Without a cycle, a path through the trimmed machine is shorter than its number of states.
+        while infinite or length < len(table):
+            if layer_at(length)[0]:
+                path = [0]
+                choices = [0]
+                word = []
+                while path:
+                    depth = len(word)
+                    if depth == length:
+                        yield tuple(word)
+                    else:
+                        q = path[-1]
+                        layer = layer_at(length - depth - 1)
+                        c = choices[-1]
+                        while c < m and not layer[table[q][c]]:
+                            c += 1
+                        if c < m:
+                            choices[-1] = c + 1
+                            path.append(table[q][c])
+                            choices.append(0)
+                            word.append(inputs[c])
+                            continue
+                    path.pop()
+                    choices.pop()
+                    if word:
+                        word.pop()
+            length += 1
+
+    def count_strings_producing_output(self, o, length):
+        '''Return the number of strings of the given length that result in a given output, by counting for every state at once the
+        strings of each length up to it that lead to an output o state; no strings are made.'''
+        rows = self.arc_rows(len(self.inputs()))
+        table = np.array(rows, dtype=np.int64).reshape(len(rows), -1)
+        states = list(self.states())
+        # Python integers, if the counts could overflow 64 bits.
+        dtype = np.int64 if self.input_count() ** length < 2**63 else object
+        counts = np.array([o == output for output in self.arc_outputs()], dtype=dtype)
+        for _ in range(length):
+            counts = counts[table].sum(axis=1, dtype=dtype)
+        return int(counts[states.index(self.starting_state())])
+
+    def naive_strings_producing_output(self, o):
+        '''Generates all the strings that result in a given output, keeping every string of the current length.  (Note - kept as a baseline for
+        benchmarking; use strings_producing_output().)'''
 
         # maintain a list of all the strings of a given length paired with the set of states from which they reach
         #   a state of the given output
@@ -252,6 +570,13 @@ class MooreMachine(FiniteSemiAutomaton):
 class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
     '''The canonical version of the Moore Machine has integers for outputs, and state 0 is always the starting state.'''
 
+    _copy_on_write = ("_transition_table", "_output_map")
+
+    # The packed binary record of a machine (see to_bytes): a header of the magic bytes and the state, input and output counts as
+    # little-endian 32-bit integers, then the transition table by rows and the outputs, both as little-endian int32 arrays.
+    RECORD_MAGIC = b"FSMM"
+    RECORD_HEADER = struct.Struct("<4sIII")
+
     def __init__(self, state_count=1, input_count=1, output_count=2) -> None:
         super().__init__(state_count, input_count)
         self._starting_state = 0
@@ -277,6 +602,32 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
         '''Return the set of outputs of the Moore Machine.'''
         return set(range(self.output_count()))
 
+    def output_array(self):
+        '''Return the outputs of the states as a new NumPy int32 array.'''
+        outputs = np.zeros(self._state_count, dtype=np.int32)
+        for s, o in self._output_map.items():
+            if s < self._state_count:
+                outputs[s] = o
+        return outputs
+
+    def arc_outputs(self):
+        '''Return the outputs of the states as a list, by the rows of arc_rows(): output_array(), then the outputs of the states beyond
+        state_count() that arcs still lead to.'''
+        outputs = self.output_array().tolist()
+        outputs.extend(self.output(s) for s in range(self._state_count, self._arc_extent()[0]))
+        return outputs
+
+    def _renumber(self, keep):
+        super()._renumber(keep)
+        self._output_map = {k: self._output_map[s] for k, s in enumerate(keep) if s in self._output_map}
+        self._shared.discard("_output_map")
+
+    def _output_edited(self, state):
+        '''Count a change to the output of the state, and log it if the machine is a clone.'''
+        self._modifications += 1
+        if self._edits is not None:
+            self._edits.states.add(state)
+
     def output(self, state):
         '''Return the output for a given state.'''
         # This is overridden, because deepcopy operations would go wrong if we assigned a lambda to _output_function.
@@ -284,6 +635,8 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
 
     def set_output(self, state, output):
         '''Return the output for the specific state.'''
+        self._own("_output_map")
+        self._output_edited(state)
         if output == 0:
             if state in self._output_map:
                 del self._output_map[state]
@@ -320,22 +673,79 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
         '''Initialise from a multiline string.  Each line stands for a state (starting with 0), and contains an output value and next states, starting from input 0.'''
         return cls.from_strings(s.splitlines())
 
+    @classmethod
+    def from_arrays(cls, transitions, outputs, output_count=2):
+        '''Initialise from a transition table, with a row for each state and a column for each input, and an array of the outputs of the states.'''
+        transitions = np.asarray(transitions)
+        outputs = np.asarray(outputs)
+        state_count, input_count = transitions.shape
+        mm = cls(state_count, input_count, max(output_count, int(outputs.max(initial=0)) + 1))
+        mm._set_arrays(transitions, outputs)
+        return mm
+
+    def _set_arrays(self, transitions, outputs):
+        '''Set all arcs and outputs of a newly constructed machine at once, from arrays of the right shapes.'''
+        arcs = transitions != np.arange(len(transitions))[:, np.newaxis]
+        sources, inputs = np.nonzero(arcs)
+        self._transition_table = dict(zip(zip(sources.tolist(), inputs.tolist()), transitions[arcs].tolist()))
+        states = np.flatnonzero(outputs)
+        self._output_map = dict(zip(states.tolist(), outputs[states].tolist()))
+
+    def to_bytes(self):
+        '''Return the machine packed in a binary record: a header with the state, input and output counts (see RECORD_HEADER),
+        the transition table as int32 by rows, then the outputs as int32.  Far more compact, and faster to read back, than text.  The
+        states beyond state_count() that arcs still lead to (see arc_rows) are recorded as states of their own.'''
+        rows = self.arc_rows(self._input_count)
+        header = self.RECORD_HEADER.pack(self.RECORD_MAGIC, len(rows), self._input_count, self._output_count)
+        return (header + np.array(rows, dtype="<i4").reshape(len(rows), self._input_count).tobytes()
+                + np.array(self.arc_outputs(), dtype="<i4").tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Initialise from a binary record made by to_bytes, in any object supporting the buffer protocol, such as a slice of a memory map.'''
+        magic, state_count, input_count, output_count = cls.RECORD_HEADER.unpack_from(data)
+        if magic != cls.RECORD_MAGIC:
+            raise ValueError("Not a Moore machine record")
+        offset = cls.RECORD_HEADER.size
+        transitions = np.frombuffer(data, dtype="<i4", count=state_count * input_count, offset=offset)
+        outputs = np.frombuffer(data, dtype="<i4", count=state_count, offset=offset + 4 * state_count * input_count)
+        return cls.from_arrays(transitions.reshape(state_count, input_count), outputs, output_count)
+
+    @classmethod
+    def record_size(cls, data):
+        '''Return the length in bytes of the binary record at the start of data.'''
+        _, state_count, input_count, _ = cls.RECORD_HEADER.unpack_from(data)
+        return cls.RECORD_HEADER.size + 4 * state_count * (input_count + 1)
+
     def minimised(self):
-        '''Returns a newly constructed CanonicalMooreMachine that is the minimal equivalent of self.'''
+        '''Returns a newly constructed CanonicalMooreMachine that is the minimal equivalent of self, using Hopcroft's partition refinement.'''
+        # Over every stored arc, so that the states an arc leads to beyond state_count() are kept (see arc_rows).
+        rows = self.arc_rows()
+        outputs = self.arc_outputs()
+        blocks, block_count = hopcroft_partition(rows, outputs)
+
+        r = CanonicalMooreMachine(block_count, self.input_count(), self.output_count())
+        processed = [False] * block_count
+        for state, new_state in enumerate(blocks):
+            if not processed[new_state]:
+                r.set_output(new_state, outputs[state])
+                for symbol, next_state in enumerate(rows[state]):
+                    r.set_arc(new_state, symbol, blocks[next_state])
+                processed[new_state] = True
+        return r
+
+    def naive_minimised(self):
+        '''Returns a newly constructed CanonicalMooreMachine equivalent to self, by naive repeated refinement of groups of states.  (Note - kept as a baseline for benchmarking; use minimised().)'''
         # Compile a map of the states according to their outputs as the initial potential 
         Map = [self.output(q) for q in self.states()]
-        print("Map", Map)
         next_mapping = len(self.outputs_used())
-        print("next mapping", next_mapping)
 
         # Iterate until we find no more splitting of groups
         Split = True
         while Split:
             Split = False
-            print("looking for splits")
             # Go through the groups of states according to the current map
             for group in [[s for s in self.states() if Map[s] == m] for m in set(Map)]:
-                print("now processing group", group)
                 # Compile the signatures of the states in the group, i.e. what groups they transition to by symbol
                 Subgroups = dict()
                 for state in group:
@@ -348,8 +758,6 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
                     else:
                         Subgroups[signature] = {state}
 
-                    print("state", state, "with signature", signature, "is grouped in", Subgroups[signature])
-                
                 # If the group has split into more than one, mark the splitting states
                 Splits = list(Subgroups.values())[1:]
                 if len(Splits) > 0:
@@ -358,10 +766,6 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
                         for state in newgroup:
                             Map[state] = next_mapping
                         next_mapping += 1
-                print("Map", Map)
-
-
-                print("===")
 
         r = CanonicalMooreMachine(next_mapping, self.input_count(), self.output_count())
         processed = set()
@@ -372,7 +776,6 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
                     r.set_arc(new_state, symbol, Map[self.next_state(state, symbol)])
                 processed.add(new_state)
 
-        print(r)
         return r
 
 
@@ -433,12 +836,486 @@ class CanonicalMooreMachine(CanonicalSemiAutomaton, MooreMachine):
 
 
 
-class MooreMachineRun(object):
-    '''A Moore Machine in action.'''
+def _fit_rows(rows, width):
+    '''Cut the rows of a transition table, or widen them with self-loops, in place, to 'width' inputs, unless it is None; return them.'''
+    if width is not None:
+        for s, row in enumerate(rows):
+            if len(row) > width:
+                del row[width:]
+            else:
+                row.extend([s] * (width - len(row)))
+    return rows
+
+
+def canonical_form(machine, minimise=False):
+    '''Return a packed bytes encoding of the behaviour of a CanonicalMooreMachine: the input count, then for each state reachable
+    from state 0, in breadth-first order of discovery, its output and its next states by input, renumbered in that same order.
+    The inputs are those spanned by the stored arcs (see arc_rows), as scoring follows arcs beyond input_count() too.
+    Machines that differ only in unreachable states or in the numbering of states have the same canonical form; if 'minimise'
+    is true, so do all equivalent machines.'''
+    if minimise:
+        machine = machine.minimised()
+    next_state = machine.next_state
+    output = machine.output
+    input_count = machine._arc_extent()[1]
+
+    number = {0: 0}
+    order = [0]
+    packed = [input_count]
+    # The loop also visits the states appended to 'order' as they are discovered.
+    for s in order:
+        packed.append(output(s))
+        for c in range(input_count):
+            t = next_state(s, c)
+            if t not in number:
+                number[t] = len(order)
+                order.append(t)
+            packed.append(number[t])
+    return array.array("q", packed).tobytes()
+
+
+def canonical_key(machine, minimise=False):
+    '''Return a 16-byte hash of the canonical form of a CanonicalMooreMachine, for use as a dictionary key.'''
+    return hashlib.blake2b(canonical_form(machine, minimise), digest_size=16).digest()
+
+
+def _product_tables(a, b):
+    '''Return the transition tables and outputs of two CanonicalMooreMachines as lists, over the larger of their input alphabets;
+    inputs beyond a machine's own alphabet are self-loops.  The tables span every state an arc leads to (see arc_rows).'''
+    input_count = max(a.input_count(), b.input_count())
+    return a.arc_rows(input_count), a.arc_outputs(), b.arc_rows(input_count), b.arc_outputs(), input_count
+
+
+def equivalent(a, b):
+    '''Return whether two CanonicalMooreMachines produce the same output on every string.  Hopcroft and Karp's algorithm: explore the
+    product of the machines from the pair of starting states, merging the states of each pair reached in a union-find structure, and
+    only following a pair further if its states were not yet merged; near-linear in the numbers of states.'''
+    table_a, outputs_a, table_b, outputs_b, input_count = _product_tables(a, b)
+    # The states of b are numbered after those of a.
+    offset = len(table_a)
+    parent = list(range(offset + len(table_b)))
+
+    def find(s):
+        while parent[s] != s:
+            parent[s] = parent[parent[s]]
+            s = parent[s]
+        return s
+
+    parent[0] = offset
+    pairs = [(0, 0)]
+    # The loop also visits the pairs appended as they are merged.
+    for p, q in pairs:
+        if outputs_a[p] != outputs_b[q]:
+            return False
+        row_a = table_a[p]
+        row_b = table_b[q]
+        for c in range(input_count):
+            r = find(row_a[c])
+            s = find(offset + row_b[c])
+            if r != s:
+                parent[r] = s
+                pairs.append((row_a[c], row_b[c]))
+    return True
+
+
+def shortest_distinguishing_word(a, b):
+    '''Return a shortest string, as a tuple of inputs, on which two CanonicalMooreMachines produce different outputs, or None if they
+    are equivalent.  A breadth-first search of the pairs of states reachable in the product of the machines; unlike equivalent(),
+    it cannot skip pairs by merging, since a skipped pair may lie on the shortest path.'''
+    table_a, outputs_a, table_b, outputs_b, input_count = _product_tables(a, b)
+    width = len(table_b)
+    # The pair each pair was reached from, and the input on which; pairs are encoded as p * width + q.
+    predecessor = {0: (None, None)}
+    pairs = [0]
+    for pair in pairs:
+        p, q = divmod(pair, width)
+        if outputs_a[p] != outputs_b[q]:
+            word = []
+            while predecessor[pair][0] is not None:
+                pair, c = predecessor[pair]
+                word.append(c)
+            return tuple(reversed(word))
+        for c in range(input_count):
+            reached = table_a[p][c] * width + table_b[q][c]
+            if reached not in predecessor:
+                predecessor[reached] = (pair, c)
+                pairs.append(reached)
+    return None
+
+
+def hopcroft_partition(table, outputs):
+    '''Return the coarsest partition of states that respects outputs and transitions, by Hopcroft's algorithm, in O(m n log n) time.
+    'table' is a list of rows, one per state, of next states by input; 'outputs' is a list of the outputs of the states.
+    Returns a pair of a list mapping each state to its block, and the number of blocks.  Blocks are numbered in order of their
+    lowest state, so state 0 is always in block 0.'''
+    n = len(outputs)
+    input_count = len(table[0]) if n > 0 else 0
+
+    # Inverse transition lists: inverse[c][t] holds the states that move to t on input c.
+    inverse = [[[] for _ in range(n)] for _ in range(input_count)]
+    for q, row in enumerate(table):
+        for c, t in enumerate(row):
+            inverse[c][t].append(q)
+
+    # The partition is kept with the states of each block contiguous in 'elements', from first[b] up to end[b].
+    # While a splitter is processed, the marked states of block b are moved to its front, and counted in marked[b].
+    groups = dict()
+    for q, o in enumerate(outputs):
+        groups.setdefault(o, []).append(q)
+    elements = []
+    first = []
+    end = []
+    block_of = [0] * n
+    for b, members in enumerate(groups.values()):
+        first.append(len(elements))
+        elements.extend(members)
+        end.append(len(elements))
+        for q in members:
+            block_of[q] = b
+    location = [0] * n
+    for i, q in enumerate(elements):
+        location[q] = i
+    marked = [0] * len(first)
+
+    # Start with every initial block but the largest as a splitter.
+    largest = max(range(len(first)), key=lambda b: end[b] - first[b], default=None)
+    worklist = [b for b in range(len(first)) if b != largest]
+    in_worklist = [b != largest for b in range(len(first))]
+
+    while worklist:
+        a = worklist.pop()
+        in_worklist[a] = False
+        splitter = elements[first[a]:end[a]]
+        for c in range(input_count):
+            predecessors = inverse[c]
+            touched = []
+            for t in splitter:
+                for q in predecessors[t]:
+                    b = block_of[q]
+                    m = first[b] + marked[b]
+                    i = location[q]
+                    if i >= m:
+                        # Mark q by swapping it to the end of the marked front of its block.
+                        other = elements[m]
+                        elements[m] = q
+                        location[q] = m
+                        elements[i] = other
+                        location[other] = i
+                        if marked[b] == 0:
+                            touched.append(b)
+                        marked[b] += 1
+
+            for b in touched:
+                m = marked[b]
+                marked[b] = 0
+                if first[b] + m == end[b]:
+                    # Every state of the block was marked; no split.
+                    continue
+                # The marked front becomes a new block.
+                nb = len(first)
+                first.append(first[b])
+                end.append(first[b] + m)
+                marked.append(0)
+                first[b] += m
+                for i in range(first[nb], end[nb]):
+                    block_of[elements[i]] = nb
+                if in_worklist[b] or m <= end[b] - first[b]:
+                    worklist.append(nb)
+                    in_worklist.append(True)
+                else:
+                    worklist.append(b)
+                    in_worklist[b] = True
+                    in_worklist.append(False)
+
+    # Renumber the blocks in order of their lowest state.
+    numbering = [-1] * len(first)
+    count = 0
+    for q in range(n):
+        if numbering[block_of[q]] < 0:
+            numbering[block_of[q]] = count
+            count += 1
+    return [numbering[b] for b in block_of], count
+
+
+class DenseCanonicalSemiAutomaton(CanonicalSemiAutomaton):
+    '''A CanonicalSemiAutomaton whose transition function is held in a dense NumPy int32 table, one row per state and one column per input.
+    The capacity of the table grows by doubling, so adding states or arcs one at a time costs amortised constant time.  Unused rows and columns hold self-loops.'''
+
+    _copy_on_write = ("_table",)
+
+    def __init__(self, state_count=1, input_count=1) -> None:
+        super().__init__(state_count, input_count)
+        self._table = self._self_loop_rows(0, max(state_count, 1), max(input_count, 1))
+
+    @staticmethod
+    def _self_loop_rows(first_state, end_state, columns):
+        '''Return a block of table rows for states first_state up to (excluding) end_state, with every arc being a self-loop.'''
+        return np.repeat(np.arange(first_state, end_state, dtype=np.int32)[:, np.newaxis], columns, axis=1)
+
+    def _reserve(self, states, inputs):
+        '''Make sure the table has room for the given numbers of states and inputs, doubling its dimensions as often as needed.'''
+        rows, columns = self._table.shape
+        if states <= rows and inputs <= columns:
+            return
+        new_rows = rows
+        while new_rows < states:
+            new_rows *= 2
+        new_columns = columns
+        while new_columns < inputs:
+            new_columns *= 2
+        table = self._self_loop_rows(0, new_rows, new_columns)
+        table[:rows, :columns] = self._table
+        self._table = table
+        self._shared.discard("_table")
+
+    def next_state(self, state, input):
+        '''Look the transition up in the dense table; anything outside the table is a self-loop.'''
+        try:
+            return self._table.item(state, input)
+        except IndexError:
+            return state
+
+    def set_arc(self, from_state, on_input, to_state):
+        '''Set the arc from 'from_state' on 'on_input' to go to 'to_state'.'''
+        greater_state = max(from_state, to_state)
+        if greater_state >= self.state_count():
+            self.add_state(greater_state - self.state_count() + 1)
+        self._reserve(self._state_count, on_input + 1)
+        self._own("_table")
+        self._arc_edited(from_state, on_input)
+        self._table[from_state, on_input] = to_state
+
+    def add_state(self, number_of_states=1):
+        '''Add new states, not connected to any others, and looping back to itself on any symbol.'''
+        super().add_state(number_of_states)
+        self._reserve(self._state_count, self._input_count)
+
+    def _stored_array(self):
+        self._reserve(self._state_count, self._input_count)
+        return self._table[:self._state_count, :self._input_count].copy()
+
+    def _arc_extent(self):
+        # Arcs are only stored within the table, and its entries that are not self-loops are the stored arcs.
+        arcs = self._table != np.arange(self._table.shape[0], dtype=np.int32)[:, np.newaxis]
+        if not arcs.any():
+            return self._state_count, self._input_count
+        sources, inputs = np.nonzero(arcs)
+        return (max(self._state_count, int(sources.max()) + 1, int(self._table[arcs].max()) + 1),
+                max(self._input_count, int(inputs.max()) + 1))
+
+    def _renumber(self, keep):
+        # The arcs of kept states only lead to kept states, as reachable_states() follows every column, so every entry has a new number.
+        number = np.zeros(self._table.shape[0], dtype=np.int32)
+        number[keep] = np.arange(len(keep), dtype=np.int32)
+        self._table = number[self._table[keep]]
+        self._shared.discard("_table")
+
+    @classmethod
+    def from_automaton(cls, automaton):
+        '''Construct a dense copy of any CanonicalSemiAutomaton.'''
+        r = cls(automaton.state_count(), automaton.input_count())
+        for s in automaton.states():
+            for i in automaton.inputs():
+                r.set_arc(s, i, automaton.next_state(s, i))
+        return r
+
+
+class DenseCanonicalMooreMachine(DenseCanonicalSemiAutomaton, CanonicalMooreMachine):
+    '''A CanonicalMooreMachine backed by dense NumPy tables: the int32 transition table of DenseCanonicalSemiAutomaton, and an int32 array of outputs.'''
+
+    _copy_on_write = ("_table", "_output_array")
+
+    def __init__(self, state_count=1, input_count=1, output_count=2) -> None:
+        super().__init__(state_count, input_count)
+        self._output_count = output_count
+        self._output_array = np.zeros(self._table.shape[0], dtype=np.int32)
+
+    def _reserve(self, states, inputs):
+        super()._reserve(states, inputs)
+        # Keep the output array as long as the transition table, so both grow together.
+        rows = self._table.shape[0]
+        if len(self._output_array) < rows:
+            outputs = np.zeros(rows, dtype=np.int32)
+            outputs[:len(self._output_array)] = self._output_array
+            self._output_array = outputs
+            self._shared.discard("_output_array")
+
+    def _renumber(self, keep):
+        super()._renumber(keep)
+        self._output_array = self._output_array[keep]
+        self._shared.discard("_output_array")
+
+    def output(self, state):
+        '''Return the output for a given state.'''
+        try:
+            return self._output_array.item(state)
+        except IndexError:
+            return 0
+
+    def output_array(self):
+        self._reserve(self._state_count, 1)
+        return self._output_array[:self._state_count].copy()
+
+    def set_output(self, state, output):
+        '''Set the output of the given state.'''
+        self._reserve(state + 1, 1)
+        self._own("_output_array")
+        self._output_edited(state)
+        self._output_array[state] = output
+        if output >= self._output_count:
+            self._output_count = output + 1
+
+    def _set_arrays(self, transitions, outputs):
+        state_count, input_count = transitions.shape
+        self._reserve(state_count, input_count)
+        self._table[:state_count, :input_count] = transitions
+        self._output_array[:state_count] = outputs
+
+    @classmethod
+    def from_automaton(cls, automaton):
+        '''Construct a dense copy of any CanonicalMooreMachine.'''
+        r = super().from_automaton(automaton)
+        for s in automaton.states():
+            r.set_output(s, automaton.output(s))
+        r._output_count = max(r._output_count, automaton.output_count())
+        return r
+
+
+class EditLog(object):
+    '''The arcs, as pairs of state and input, and the states whose outputs have been set in a clone since it was made from its origin,
+    with the number of modifications the origin had then.  A result computed for the origin with that many modifications can be
+    updated for the clone by redoing only what depends on the logged arcs and states.  If the origin was itself a clone, 'previous'
+    is its own log, so that a clone of an unscored clone can still be related to an earlier machine; the chain is kept short.
+    Changes made to the origin after cloning may also show up through 'previous', which only errs on the side of redoing more.'''
+
+    __slots__ = ("origin", "modifications", "arcs", "states", "previous", "depth")
+
+    # The longest chain of logs kept through 'previous'.
+    MAX_DEPTH = 8
+
+    def __init__(self, origin) -> None:
+        self.origin = weakref.ref(origin)
+        self.modifications = origin.modifications()
+        self.arcs = set()
+        self.states = set()
+        self.previous = origin.edit_log()
+        if self.previous is not None and self.previous.depth >= self.MAX_DEPTH:
+            self.previous = None
+        self.depth = 1 if self.previous is None else self.previous.depth + 1
+
+
+class CompiledRun(object):
+    '''A CanonicalMooreMachine compiled for running: a snapshot of its transition table as a list of rows, and of its outputs as a list,
+    so that run() and run_many() take each step with two list lookups in a tight loop rather than a call to next_state().  The
+    snapshot is taken again whenever the machine has changed since, as told by its modifications().  It spans every stored arc, as
+    arc_rows() does, so that it agrees with next_state(); symbols beyond those self-loop, and the rows are widened for them as they
+    are met.'''
 
     def __init__(self, machine) -> None:
+        self._machine = machine
+        self._modifications = None
+        self._rows = []
+        self._outputs = []
+
+    def _check(self):
+        '''Take the snapshot again if the machine has changed since it was taken.'''
+        if self._machine.modifications() != self._modifications:
+            self._rows = self._machine.arc_rows()
+            self._outputs = self._machine.arc_outputs()
+            self._modifications = self._machine.modifications()
+
+    def _widen(self, width):
+        '''Extend the rows to at least 'width' inputs with self-loops, in place, so that references to them stay valid.'''
+        for s, row in enumerate(self._rows):
+            if len(row) < width:
+                row.extend([s] * (width - len(row)))
+
+    def rows(self, width=0):
+        '''Return the transition table as a list of rows, one per state, each with at least 'width' entries.'''
+        self._check()
+        self._widen(width)
+        return self._rows
+
+    def outputs(self):
+        '''Return the outputs of the states as a list.'''
+        self._check()
+        return self._outputs
+
+    def next_state(self, state, input):
+        '''Return the state reached from 'state' on the one input.'''
+        self._check()
+        try:
+            return self._rows[state][input]
+        except IndexError:
+            if input < 0:
+                raise
+            if state >= len(self._rows):
+                # a state no arc leads to, and with no arcs of its own
+                return self._machine.next_state(state, input)
+            self._widen(input + 1)
+            return self._rows[state][input]
+
+    def final_state(self, word, state=None):
+        '''Return the state reached by feeding the iterable 'word' to the machine, from 'state', by default its starting state.'''
+        self._check()
+        s = self._machine.starting_state() if state is None else state
+        rows = self._rows
+        symbols = iter(word)
+        while True:
+            try:
+                for c in symbols:
+                    s = rows[s][c]
+                return s
+            except IndexError:
+                # a symbol beyond the rows: widen them, take the step, and carry on with the rest of the word
+                if c < 0:
+                    raise
+                if s >= len(rows):
+                    s = self._machine.next_state(s, c)
+                else:
+                    self._widen(c + 1)
+                    s = rows[s][c]
+
+    def run(self, word, state=None):
+        '''Return the output of the machine after it is fed 'word', from 'state', by default its starting state.'''
+        return self._output(self.final_state(word, state))
+
+    def _output(self, state):
+        '''Return the output of the state, which may be beyond the snapshot if a run started there.'''
+        return self._outputs[state] if state < len(self._outputs) else self._machine.output(state)
+
+    def run_many(self, words, state=None):
+        '''Return the list of the outputs of the machine after it is fed each of the sequences in 'words', each from 'state', by
+        default its starting state.'''
+        self._check()
+        start = self._machine.starting_state() if state is None else state
+        rows = self._rows
+        outputs = self._outputs
+        results = []
+        append = results.append
+        for word in words:
+            s = start
+            try:
+                for c in word:
+                    s = rows[s][c]
+            except IndexError:
+                s = self.final_state(word, start)
+            append(outputs[s] if s < len(outputs) else self._machine.output(s))
+        return results
+
+
+class MooreMachineRun(object):
+    '''A Moore Machine in action.  By default a CanonicalMooreMachine is run through a CompiledRun of it, and any other machine one
+    next_state() call at a time; compiled=False runs a CanonicalMooreMachine that way too, and compiled=True requires one.'''
+
+    def __init__(self, machine, compiled=None) -> None:
         '''Initialise the running machine, and put it in its starting state.'''
         self._machine = machine
+        if compiled is None:
+            compiled = isinstance(machine, CanonicalMooreMachine)
+        elif compiled and not isinstance(machine, CanonicalMooreMachine):
+            raise TypeError("Only a CanonicalMooreMachine can be compiled")
+        self._compiled = CompiledRun(machine) if compiled else None
         self.reset()
     
     def reset(self):
@@ -460,12 +1337,18 @@ class MooreMachineRun(object):
 
     def step(self, input):
         '''Feeds the input to the running machine, moving it forward by one step.'''
-        self.move_to(self._machine.next_state(self.state(), input))
+        if self._compiled is not None:
+            self._current_state = self._compiled.next_state(self._current_state, input)
+        else:
+            self.move_to(self._machine.next_state(self.state(), input))
     
     def multistep(self, inputs):
         '''Runs the machine from its current state through the iterable providing inputs.  Note - if inputs is an endless iterable, this will not halt.'''
-        for i in inputs:
-            self.step(i)
+        if self._compiled is not None:
+            self._current_state = self._compiled.final_state(inputs, self._current_state)
+        else:
+            for i in inputs:
+                self.step(i)
     
     def transducer(self, inputs, state=None):
         '''Iterator that yields the outputs of the running machine as it consumes the input iterable.  Note - will reset the machine unless the current state is explicitly specified.'''
@@ -474,6 +1357,101 @@ class MooreMachineRun(object):
             self.step(i)
             yield self.output()
 
+class WordSampler(object):
+    '''Draws strings uniformly at random from those of a given length, up to max_length, that give a given output on a
+    CanonicalMooreMachine, over range(input_count), by default its inputs; symbols beyond its inputs self-loop.  The numbers of
+    strings of each length leading from each state to each output are counted once; the strings of a length and output are then
+    numbered in lexicographic order, and drawing a number below their count picks one exactly uniformly.  It is spelled out in
+    O(length * input_count) steps, by going to the first symbol whose count of continuations exceeds the number, less the counts
+    of the symbols passed.  The counts are Python integers when they could overflow 64 bits.'''
+
+    def __init__(self, machine, max_length, input_count=None) -> None:
+        self.max_length = max_length
+        self.input_count = machine.input_count() if input_count is None else input_count
+        compiled = CompiledRun(machine)
+        rows = compiled.rows(self.input_count)
+        # The rows span every state an arc leads to, which can be more than state_count() (see arc_rows).
+        self._table = np.array([row[:self.input_count] for row in rows], dtype=np.int64).reshape(len(rows), self.input_count)
+        outputs = np.array(compiled.outputs(), dtype=np.int64)
+        self._start = machine.starting_state()
+        dtype = np.int64 if self.input_count ** max_length < 2**63 else object
+        # counts[k, s, o]: the number of strings of length k leading from state s to a state with output o.
+        counts = np.zeros((max_length + 1, len(rows), machine.output_count()), dtype=dtype)
+        counts[0, np.arange(len(rows)), outputs] = 1
+        for k in range(max_length):
+            counts[k + 1] = counts[k][self._table].sum(axis=1) if self.input_count else 0
+        self._counts = counts
+        self._rows = self._table.tolist()
+
+    def count(self, length, output):
+        '''Return the number of strings of the length that give the output.'''
+        return int(self._counts[length, self._start, output])
+
+    def _check(self, length, output):
+        if not 0 <= length <= self.max_length:
+            raise ValueError("length %d is beyond the sampler's maximum of %d" % (length, self.max_length))
+        if self.count(length, output) == 0:
+            raise ValueError("no string of length %d gives output %d" % (length, output))
+
+    @staticmethod
+    def _below(rng, n):
+        '''Return a uniform random integer from 0 up to, but excluding, n, which may be beyond 64 bits.'''
+        if n < 2**63:
+            return int(rng.integers(n))
+        bits = n.bit_length()
+        size = (bits + 7) // 8
+        while True:
+            x = int.from_bytes(rng.bytes(size), "little") >> (8 * size - bits)
+            if x < n:
+                return x
+
+    def sample(self, length, output, rng=None):
+        '''Return a string of the length that gives the output, as a tuple, drawn uniformly from all of them with the NumPy
+        Generator rng, by default a new one.'''
+        self._check(length, output)
+        rng = np.random.default_rng() if rng is None else rng
+        x = self._below(rng, self.count(length, output))
+        rows = self._rows
+        counts = self._counts
+        s = self._start
+        word = []
+        for r in range(length - 1, -1, -1):
+            row = rows[s]
+            remaining = counts[r, :, output]
+            for c in range(self.input_count):
+                n = int(remaining[row[c]])
+                if x < n:
+                    break
+                x -= n
+            word.append(c)
+            s = row[c]
+        return tuple(word)
+
+    def sample_many(self, length, output, count, rng=None):
+        '''Return a NumPy array of count strings of the length that give the output, one to a row, each drawn uniformly and
+        independently with the NumPy Generator rng, by default a new one.  The strings are spelled out together, a symbol at a time.'''
+        self._check(length, output)
+        rng = np.random.default_rng() if rng is None else rng
+        total = self.count(length, output)
+        if total < 2**63:
+            x = rng.integers(total, size=count)
+        else:
+            x = np.array([self._below(rng, total) for _ in range(count)], dtype=object)
+        states = np.full(count, self._start, dtype=np.int64)
+        words = np.zeros((count, length), dtype=np.int64)
+        for j in range(length):
+            remaining = self._counts[length - j - 1, :, output]
+            chosen = np.zeros(count, dtype=bool)
+            for c in range(self.input_count):
+                n = remaining[self._table[states, c]]
+                take = ~chosen & (x < n)
+                words[take, j] = c
+                x = np.where(chosen | take, x, x - n)
+                chosen |= take
+            states = self._table[states, words[:, j]]
+        return words
+
+
 # Unit testing code.
 # Create a subclass of unittest.Testcase, with each test being a method named beginning with "test_".
 # At the end, as the "main" executable code of the module, check if the name of the cu
@@ -493,13 +1471,50 @@ class TestSemiAutomata(ut.TestCase):
         fsa = FiniteSemiAutomaton(states=range(6), input_alphabet=[2, 4], transition_function=lambda s, i: (s + i) % 6)
 
         self.assertFalse(fsa.reachable(4, 1))
-        self.assertEqual(fsa.path_between(1, 5), ([2, 2], {1, 3}))
+        self.assertEqual(fsa.path_between(1, 5), ([4], {1}))
+        self.assertEqual(fsa.path_between(1, 1), ([], set()))
+        self.assertEqual(fsa.path_between(0, 4), ([4], {0}))
+        self.assertEqual(fsa.path_between(0, 2), ([2], {0}))
+        self.assertEqual(fsa.all_pairs_distances()[1].tolist(), [-1, 0, -1, 1, -1, 1])
 
         fsa = FiniteSemiAutomaton(states=range(7), input_alphabet=[2, 1], transition_function=lambda s, i: (s + i) % 6)
         self.assertFalse(fsa.path_between(0, 6), None)
         self.assertTrue(fsa.reachable(6, 1))
         self.assertEqual(fsa.state_count(), 7)
 
+        # Transitions to anything that is not a state are not followed.
+        fsa = FiniteSemiAutomaton(states={"a", "b"}, input_alphabet=[0], transition_function=lambda s, i: s + "!")
+        self.assertIsNone(fsa.path_between("a", "b"))
+        fsa = FiniteSemiAutomaton(states=range(4), input_alphabet=[1, 2], transition_function=lambda s, i: s * 2 + i)
+        self.assertEqual(fsa.path_between(0, 3), ([1, 1], {0, 1}))
+        self.assertIsNone(fsa.path_between(3, 0))
+
+        # A long chain, beyond the recursion limit of a depth-first search.
+        n = 5000
+        csa = CanonicalSemiAutomaton(n, 2)
+        for s in range(n - 1):
+            csa.set_arc(s, 1, s + 1)
+        path, passed = csa.path_between(0, n - 1)
+        self.assertEqual(path, [1] * (n - 1))
+        self.assertEqual(passed, set(range(n - 1)))
+        self.assertIsNone(csa.path_between(3, 2))
+
+    def test_all_pairs_distances(self):
+        rng = np.random.default_rng(0)
+        for n in (1, 7, 60):
+            csa = CanonicalSemiAutomaton(n, 3)
+            for s in range(n):
+                for i in range(3):
+                    csa.set_arc(s, i, int(rng.integers(n)) if rng.random() < 0.7 else s)
+            distances = csa.all_pairs_distances()
+            # Small blocks of sources give the same answer.
+            csa.DISTANCE_BLOCK_ENTRIES = 50
+            self.assertTrue(np.array_equal(csa.all_pairs_distances(), distances))
+            for s in range(n):
+                for t in range(n):
+                    path = csa.path_between(s, t)
+                    self.assertEqual(distances[s, t], -1 if path is None else len(path[0]))
+
     def test_CanonicalSemiAutomaton(self):
         csa = CanonicalSemiAutomaton(1,3)
 
@@ -551,6 +1566,108 @@ class TestSemiAutomata(ut.TestCase):
 
         mr.reset()
         self.assertEqual(mr.output(), 65)
+        with self.assertRaises(TypeError):
+            MooreMachineRun(mm, compiled=True)
+
+    def test_CompiledRun(self):
+        rng = np.random.default_rng(0)
+        words = [tuple(rng.integers(3, size=k).tolist()) for k in range(12) for _ in range(5)]
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            m = cls(6, 2, 3)
+            for s in range(6):
+                for i in range(2):
+                    m.set_arc(s, i, int(rng.integers(6)))
+                m.set_output(s, int(rng.integers(3)))
+            def slow(w, state=0):
+                for c in w:
+                    state = m.next_state(state, c)
+                return m.output(state)
+
+            # Symbol 2 is beyond the machine's inputs, and self-loops.
+            c = CompiledRun(m)
+            self.assertEqual(c.run_many(words), [slow(w) for w in words])
+            self.assertEqual([c.run(iter(w), 3) for w in words], [slow(w, 3) for w in words])
+            self.assertEqual(len(c.rows()[0]), 3)
+
+            # Changes to the machine are seen by the next run.
+            m.set_arc(0, 1, 5)
+            m.set_output(5, 2)
+            m.add_state()
+            m.set_arc(6, 0, 1)
+            self.assertEqual(c.run_many(words, 6), [slow(w, 6) for w in words])
+            self.assertEqual(c.next_state(4, 7), 4)
+
+            mr = MooreMachineRun(m)
+            mr.multistep(words[-1])
+            mr.step(1)
+            self.assertEqual(mr.output(), slow(words[-1] + (1,)))
+
+        # Arcs on inputs beyond input_count(), and to a state removed by delete_state(), are followed as by next_state().
+        words = [tuple(rng.integers(5, size=k).tolist()) for k in range(10) for _ in range(20)]
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            m = cls(3, 1, 2)
+            m.set_arc(0, 0, 1)
+            m.set_arc(1, 3, 2)
+            m.set_output(2, 1)
+            n = cls(5, 2, 2)
+            for s in range(5):
+                n.set_arc(s, 0, (s + 1) % 5)
+                n.set_arc(s, 1, 4)
+                n.set_output(s, s % 2)
+            n.delete_state(4)
+            for machine in (m, n):
+                def slow(w, state=0):
+                    for c in w:
+                        state = machine.next_state(state, c)
+                    return machine.output(state)
+                c = CompiledRun(machine)
+                self.assertEqual(c.run_many(words), [slow(w) for w in words])
+                self.assertEqual(c.next_state(9, 0), machine.next_state(9, 0))
+                for mr in (MooreMachineRun(machine), MooreMachineRun(machine, compiled=False)):
+                    for w in words:
+                        mr.reset()
+                        mr.multistep(w)
+                        self.assertEqual(mr.output(), slow(w))
+
+    def test_WordSampler(self):
+        m = CanonicalMooreMachine.from_string(
+            "0 1 2\n"
+            "1 1 0\n"
+            "2 2 1")
+        run = CompiledRun(m)
+        sampler = WordSampler(m, 6, 3)
+
+        class Counting(object):
+            # Draws 0, 1, 2... in turn, so that the samples go through the numbering of the strings.
+            def __init__(self):
+                self.next = 0
+            def integers(self, n, size=None):
+                if size is None:
+                    self.next += 1
+                    return self.next - 1
+                return np.arange(size)
+
+        for length in range(7):
+            for o in range(3):
+                strings = [w for w in itertools.product(range(3), repeat=length) if run.run(w) == o]
+                self.assertEqual(sampler.count(length, o), len(strings))
+                if strings:
+                    rng = Counting()
+                    self.assertEqual([sampler.sample(length, o, rng) for _ in strings], strings)
+                    self.assertEqual(list(map(tuple, sampler.sample_many(length, o, len(strings), Counting()).tolist())), strings)
+        with self.assertRaises(ValueError):
+            sampler.sample(7, 1)
+
+        # Counts beyond 64 bits.
+        sampler = WordSampler(m, 60, 3)
+        self.assertIsInstance(sampler.count(60, 1), int)
+        self.assertGreater(sampler.count(60, 1), 2**63)
+        rng = np.random.default_rng(0)
+        self.assertEqual(run.run(sampler.sample(60, 1, rng)), 1)
+        words = sampler.sample_many(60, 2, 50, rng)
+        self.assertEqual(words.shape, (50, 60))
+        self.assertEqual(run.run_many(map(tuple, words.tolist())), [2] * 50)
+        self.assertEqual(run.run_many(map(tuple, WordSampler(m, 8, 3).sample_many(8, 0, 1000, rng).tolist())), [0] * 1000)
 
     def test_generate_language(self):
         mm = CanonicalMooreMachine.from_string(
@@ -565,6 +1682,45 @@ class TestSemiAutomata(ut.TestCase):
                 self.assertEqual(s, (0, 0, 0, 0, 0))
                 break
 
+        # The same strings as the baseline, in length-lexicographic order, as counted.
+        rng = np.random.default_rng(0)
+        for n in (1, 4, 9):
+            m = CanonicalMooreMachine(n, 3, 3)
+            for s in range(n):
+                for i in range(3):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(3)))
+            for o in range(3):
+                strings = list(itertools.islice(m.strings_producing_output(o), 300))
+                self.assertEqual(strings, sorted(strings, key=lambda s: (len(s), s)))
+                # Only the lengths completed within the first 300 strings can be compared.
+                complete = [s for s in strings if len(s) < len(strings[-1])]
+                self.assertEqual(sorted(complete), sorted(itertools.islice(m.naive_strings_producing_output(o), len(complete))))
+                for length in range(4):
+                    self.assertEqual(m.count_strings_producing_output(o, length), sum(1 for s in strings if len(s) == length))
+        self.assertEqual(m.count_strings_producing_output(0, 100) + m.count_strings_producing_output(1, 100)
+                         + m.count_strings_producing_output(2, 100), 3 ** 100)
+
+        # Finite languages come to an end.
+        m = CanonicalMooreMachine.from_string("0 1 2\n1 3 3\n1 3 3\n0 3 3")
+        self.assertEqual(list(m.strings_producing_output(1)), [(0,), (1,)])
+        self.assertEqual(list(CanonicalMooreMachine().strings_producing_output(1)), [])
+        self.assertEqual(list(itertools.islice(CanonicalMooreMachine(1, 2).strings_producing_output(0), 4)), [(), (0,), (1,), (0, 0)])
+
+        # Only the states reachable from the start count: disjoint cycles of prime lengths do not make the search wait for their lcm.
+        primes = (2, 3, 5, 7, 11, 13, 17, 19)
+        m = CanonicalMooreMachine(sum(primes), 1)
+        first = 0
+        for p in primes:
+            for k in range(p):
+                m.set_arc(first + k, 0, first + (k + 1) % p)
+            m.set_output(first + p - 1, 1)
+            first += p
+        self.assertEqual(list(itertools.islice(m.strings_producing_output(1), 3)), [(0,), (0, 0, 0), (0, 0, 0, 0, 0)])
+        # A cycle that cannot be reached, or cannot lead to the output, leaves the language finite.
+        m = CanonicalMooreMachine.from_string("0 1 2\n1 2 2\n0 2 2\n0 4 4\n1 3 3")
+        self.assertEqual(list(m.strings_producing_output(1)), [(0,)])
+
 
     def test_CanonicalMooreMachine(self):
         cmm = CanonicalMooreMachine.from_string(("1 2 1\n"
@@ -582,6 +1738,38 @@ class TestSemiAutomata(ut.TestCase):
         cmm.set_output(2, 1)
         self.assertEqual(cmm.output(2), 1)
 
+    def test_DenseCanonicalMooreMachine(self):
+        text = ("1 2 1\n"
+         "0 0 2\n"
+         "0 2 2\n"
+         "0 8 8")
+        cmm = CanonicalMooreMachine.from_string(text)
+        dense = DenseCanonicalMooreMachine.from_string(text)
+        self.assertEqual(dense.state_count(), 9)
+        self.assertEqual(dense.input_count(), 2)
+        self.assertEqual(str(dense), str(cmm))
+        self.assertEqual(str(DenseCanonicalMooreMachine.from_automaton(cmm)), str(cmm))
+
+        # Unset arcs and states beyond the table are self-loops, with output 0.
+        self.assertEqual(dense.next_state(7, 1), 7)
+        self.assertEqual(dense.next_state(20, 0), 20)
+        self.assertEqual(dense.output(20), 0)
+
+        # Grow well past the initial capacity, mirroring every change on the sparse version.
+        for s in range(9, 40):
+            for m in (cmm, dense):
+                m.set_arc(s - 1, s % 2, s)
+                m.set_output(s, s % 3)
+        self.assertEqual(str(dense), str(cmm))
+        self.assertEqual(dense.output_count(), 3)
+
+        for m in (cmm, dense):
+            m.delete_state(3)
+        self.assertEqual(str(dense), str(cmm))
+
+        cmmr = MooreMachineRun(dense)
+        self.assertEqual(list(cmmr.transducer([1, 0, 1, 0, 0, 1, 0, 1])), [0, 1, 0, 1, 0, 0, 0, 0])
+
     def test_minimise(self):
         cmm = CanonicalMooreMachine.from_string(
         ("0 1 2 3\n"
@@ -592,6 +1780,165 @@ class TestSemiAutomata(ut.TestCase):
          "0 6 6 5\n"
          "1 5 5 6"))
         cmm2 = cmm.minimised()
+        self.assertEqual(cmm2.state_count(), 4)
+        self.assertEqual(str(cmm2), str(CanonicalMooreMachine.from_string(
+        ("0 1 1 1\n"
+         "1 1 1 1\n"
+         "0 3 3 2\n"
+         "1 2 2 3"))))
+
+        # Random machines with only a few distinct behaviours: minimised machines agree with the originals, and cannot be minimised further.
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            n = int(rng.integers(1, 40))
+            m = CanonicalMooreMachine(n, 2, 3)
+            for s in range(n):
+                for i in range(2):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(2)) * int(rng.integers(3)))
+            minimal = m.minimised()
+            self.assertEqual(minimal.minimised().state_count(), minimal.state_count())
+            self.assertLessEqual(minimal.state_count(), m.state_count())
+            original_run = MooreMachineRun(m)
+            minimal_run = MooreMachineRun(minimal)
+            word = rng.integers(2, size=200).tolist()
+            self.assertEqual(list(original_run.transducer(word)), list(minimal_run.transducer(word)))
+
+    def test_clone(self):
+        text = ("1 2 1\n"
+         "0 0 2\n"
+         "0 2 2")
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            parent = cls.from_string(text)
+            child = parent.clone()
+            self.assertIs(child._transition_table, parent._transition_table)
+            grandchild = child.clone()
+            child.set_arc(0, 1, 0)
+            child.set_output(1, 1)
+            grandchild.add_state()
+            grandchild.set_arc(3, 0, 1)
+            parent.set_output(2, 1)
+            self.assertEqual(str(parent), str(cls.from_string("1 2 1\n0 0 2\n1 2 2")))
+            self.assertEqual(str(child), str(cls.from_string("1 2 0\n1 0 2\n0 2 2")))
+            self.assertEqual(str(grandchild), str(cls.from_string("1 2 1\n0 0 2\n0 2 2\n0 1 3")))
+            self.assertEqual(type(child), cls)
+
+            # The clones log their changes relative to the machine they were cloned from.
+            log = grandchild.edit_log()
+            self.assertIs(log.origin(), child)
+            self.assertEqual(log.arcs, {(3, 0)})
+            self.assertIs(log.previous, child.edit_log())
+            self.assertEqual((log.previous.arcs, log.previous.states), ({(0, 1)}, {1}))
+            self.assertIsNone(parent.edit_log())
+            self.assertIsNone(copy.deepcopy(grandchild).edit_log())
+
+    def test_compact(self):
+        text = ("1 4 0\n"
+         "0 1 1\n"
+         "1 2 3\n"
+         "0 3 3\n"
+         "2 0 5\n"
+         "1 5 5")
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            m = cls.from_string(text)
+            self.assertEqual(m.reachable_states(), [0, 4, 5])
+            self.assertEqual(m.reachable_states(2), [2, 3])
+            child = m.clone()
+            self.assertEqual(child.compact(), 3)
+            self.assertEqual(str(child), str(cls.from_string("1 1 0\n2 0 2\n1 2 2")))
+            self.assertIsNone(child.edit_log())
+            self.assertEqual(m.state_count(), 6)
+            self.assertEqual(canonical_form(child), canonical_form(m))
+            self.assertEqual(child.compact(), 0)
+            child.set_arc(2, 1, 3)
+            self.assertEqual(child.state_count(), 4)
+            self.assertEqual(child.next_state(3, 0), 3)
+
+            # Arcs on inputs beyond input_count() are followed too, and so kept.
+            m = cls(4, 1)
+            m.set_arc(0, 0, 1)
+            m.set_arc(1, 3, 2)
+            m.set_output(2, 1)
+            self.assertEqual(m.reachable_states(), [0, 1, 2])
+            self.assertEqual(m.compact(), 1)
+            self.assertEqual((m.next_state(0, 0), m.next_state(1, 3), m.output(2)), (1, 2, 1))
+
+    def test_delete_highest_state(self):
+        # Deleting the highest state leaves the arcs into it in place, leading beyond state_count().
+        text = ("0 1 0\n"
+         "0 2 1\n"
+         "1 2 2")
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            m = cls.from_string(text)
+            m.delete_state(2)
+            self.assertEqual((m.state_count(), m.next_state(1, 0), m.output(2)), (2, 2, 1))
+            with self.assertRaises(ValueError):
+                m.transition_array()
+            self.assertEqual(m.arc_rows(), [[1, 0], [2, 1], [2, 2]])
+            self.assertEqual(m.arc_outputs(), [0, 0, 1])
+            whole = cls.from_string(text)
+            self.assertTrue(equivalent(m, whole))
+            self.assertTrue(equivalent(m.minimised(), whole))
+            self.assertEqual(m.minimised().state_count(), 3)
+            self.assertEqual(list(itertools.islice(m.strings_producing_output(1), 3)), [(0, 0), (0, 0, 0), (0, 0, 1)])
+            self.assertEqual(m.count_strings_producing_output(1, 3), 4)
+            self.assertEqual(WordSampler(m, 3).count(3, 1), 4)
+            self.assertTrue(equivalent(CanonicalMooreMachine.from_bytes(m.to_bytes()), whole))
+
+    def test_equivalence(self):
+        rng = np.random.default_rng(1)
+        for _ in range(40):
+            n = int(rng.integers(1, 12))
+            a = CanonicalMooreMachine(n, 2, 2)
+            for s in range(n):
+                for i in range(2):
+                    a.set_arc(s, i, int(rng.integers(n)))
+                a.set_output(s, int(rng.integers(2)))
+            minimal = a.minimised()
+            self.assertTrue(equivalent(a, minimal))
+            self.assertIsNone(shortest_distinguishing_word(a, minimal))
+            self.assertTrue(equivalent(a, DenseCanonicalMooreMachine.from_automaton(a)))
+
+            b = a.clone()
+            b.set_output(int(rng.integers(n)), int(rng.integers(2)))
+            word = shortest_distinguishing_word(a, b)
+            self.assertEqual(equivalent(a, b), word is None)
+            self.assertEqual(canonical_form(a, True) == canonical_form(b, True), word is None)
+            if word is not None:
+                # The word distinguishes the machines, and no shorter word does.
+                run_a, run_b = MooreMachineRun(a), MooreMachineRun(b)
+                self.assertNotEqual(list(run_a.transducer(word))[-1:] or [a.output(0)], list(run_b.transducer(word))[-1:] or [b.output(0)])
+                for length in range(len(word)):
+                    for shorter in itertools.product(range(2), repeat=length):
+                        self.assertEqual(list(run_a.transducer(shorter)), list(run_b.transducer(shorter)))
+
+        # Inputs beyond a machine's alphabet are self-loops.
+        a = CanonicalMooreMachine.from_string("0 1\n1 0")
+        b = CanonicalMooreMachine.from_string("0 1 0\n1 0 1")
+        self.assertTrue(equivalent(a, b))
+        b.set_arc(1, 1, 0)
+        self.assertEqual(shortest_distinguishing_word(a, b), (0, 1))
+
+    def test_binary_record(self):
+        text = ("1 2 1\n"
+         "0 0 2\n"
+         "3 2 2")
+        for cls in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+            m = cls.from_string(text)
+            m.add_state()
+            data = m.to_bytes()
+            self.assertEqual(len(data), CanonicalMooreMachine.record_size(data))
+            self.assertEqual(len(data), 16 + 4 * 4 * 3)
+            for target in (CanonicalMooreMachine, DenseCanonicalMooreMachine):
+                r = target.from_bytes(data)
+                self.assertEqual(type(r), target)
+                self.assertEqual(str(r), str(m))
+                self.assertEqual(r.output_count(), 4)
+                self.assertEqual(r.to_bytes(), data)
+            self.assertEqual(CanonicalMooreMachine.from_bytes(data)._transition_table, m._transition_table if cls is CanonicalMooreMachine else
+                             CanonicalMooreMachine.from_string(text)._transition_table)
+        with self.assertRaises(ValueError):
+            CanonicalMooreMachine.from_bytes(b"XXXX" + data[4:])
 
 
 
@@ -0,0 +1,10 @@
+'''
+benchmarks - timing scripts for the automata and evolution code.  Run each one as a module from the top of the repository, e.g.
+
+    python -m benchmarks.dense_backend
+
+benchmarks.suite times the whole pipeline and keeps JSON baselines, to check a change for regressions:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --baseline before.json
+'''
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+cloning - Compare the throughput of copying and mutating CanonicalMooreMachines with copy.deepcopy and with the copy-on-write clone().
+
+Functions:
+    mutate - change one arc and one output of a machine, as the complexophile mutators of the experiments do.
+    mutants_per_second - time copying and mutating a machine repeatedly.
+'''
+
+import copy
+import optparse
+import time
+
+import numpy
+
+import automata
+from benchmarks.dense_backend import random_machine
+
+
+def mutate(machine, rng):
+    '''Point one random arc of the machine to a random state, and set the output of a random state to a random value.'''
+    n = machine.state_count()
+    machine.set_arc(int(rng.integers(n)), int(rng.integers(machine.input_count())), int(rng.integers(n)))
+    machine.set_output(int(rng.integers(n)), int(rng.integers(machine.output_count())))
+
+
+def mutants_per_second(machine, make_copy, count, rng):
+    '''Copy the machine with make_copy and mutate the copy, count times; return the number of mutants per second.'''
+    start = time.perf_counter()
+    for _ in range(count):
+        mutate(make_copy(machine), rng)
+    return count / (time.perf_counter() - start)
+
+
+def main(options, args):
+    print(f"{'class':>28} {'states':>8} {'deepcopy/s':>12} {'clone/s':>12} {'ratio':>7}")
+    for cls in (automata.CanonicalMooreMachine, automata.DenseCanonicalMooreMachine):
+        for n in (10, 100, 1000, 10000):
+            m = random_machine(cls, n, options.INPUTS, numpy.random.default_rng(options.SEED))
+            deep_rate = mutants_per_second(m, copy.deepcopy, options.COUNT, numpy.random.default_rng(options.SEED))
+            clone_rate = mutants_per_second(m, cls.clone, options.COUNT, numpy.random.default_rng(options.SEED))
+            print(f"{cls.__name__:>28} {n:>8} {deep_rate:>12,.0f} {clone_rate:>12,.0f} {clone_rate / deep_rate:>7.2f}")
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(("Usage: python -m benchmarks.cloning [OPTION]...\n"
+                                    "Time copying and mutating random CanonicalMooreMachines, with deepcopy and with clone()."))
+    parser.add_option("-n", "--count", type="int", action="store", dest="COUNT", default=200,
+                    help="number of mutants to make of each machine (default: %default)")
+    parser.add_option("-a", "--alphabet", type="int", action="store", dest="INPUTS", default=2,
+                    help="size of the input alphabet (default: %default)")
+    parser.add_option("-s", "--seed", type="int", action="store", dest="SEED", default=0,
+                    help="seed for the random machines and mutations (default: %default)")
+
+    (options, args) = parser.parse_args()
+
+    main(options, args)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+dense_backend - Compare the steps per second of the sparse (dict) and dense (NumPy) CanonicalMooreMachine backends.
+
+Functions:
+    random_machine - build a random CanonicalMooreMachine of a given size, in a given class.
+    steps_per_second - time a number of transitions through a machine.
+'''
+
+import optparse
+import time
+
+import numpy
+
+import automata
+
+
+def random_machine(cls, state_count, input_count, rng):
+    '''Return a machine of class cls with random arcs and binary outputs, drawn from the NumPy generator rng.'''
+    m = cls(state_count, input_count)
+    targets = rng.integers(state_count, size=(state_count, input_count))
+    outputs = rng.integers(2, size=state_count)
+    for s in range(state_count):
+        for i in range(input_count):
+            m.set_arc(s, i, int(targets[s, i]))
+        m.set_output(s, int(outputs[s]))
+    return m
+
+
+def steps_per_second(machine, word):
+    '''Run the word through next_state and output, and return the number of transitions per second.'''
+    next_state = machine.next_state
+    output = machine.output
+    state = 0
+    start = time.perf_counter()
+    for symbol in word:
+        state = next_state(state, symbol)
+        output(state)
+    return len(word) / (time.perf_counter() - start)
+
+
+def main(options, args):
+    rng = numpy.random.default_rng(options.SEED)
+    word = rng.integers(options.INPUTS, size=options.STEPS).tolist()
+
+    print(f"{'states':>8} {'dict steps/s':>14} {'dense steps/s':>14} {'ratio':>7}")
+    for n in (10, 100, 1000):
+        sparse = random_machine(automata.CanonicalMooreMachine, n, options.INPUTS, numpy.random.default_rng(options.SEED))
+        dense = automata.DenseCanonicalMooreMachine.from_automaton(sparse)
+        sparse_rate = steps_per_second(sparse, word)
+        dense_rate = steps_per_second(dense, word)
+        print(f"{n:>8} {sparse_rate:>14,.0f} {dense_rate:>14,.0f} {dense_rate / sparse_rate:>7.2f}")
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(("Usage: python -m benchmarks.dense_backend [OPTION]...\n"
+                                    "Time state transitions on the dict and NumPy backends of CanonicalMooreMachine."))
+    parser.add_option("-n", "--steps", type="int", action="store", dest="STEPS", default=1000000,
+                    help="number of transitions to time per machine (default: %default)")
+    parser.add_option("-a", "--alphabet", type="int", action="store", dest="INPUTS", default=3,
+                    help="size of the input alphabet (default: %default)")
+    parser.add_option("-s", "--seed", type="int", action="store", dest="SEED", default=0,
+                    help="seed for the random machines and input word (default: %default)")
+
+    (options, args) = parser.parse_args()
+
+    main(options, args)
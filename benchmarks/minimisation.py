@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+minimisation - Compare the time taken by Hopcroft's minimisation (CanonicalMooreMachine.minimised) and the naive
+                repeated refinement (CanonicalMooreMachine.naive_minimised) on random machines of up to 100,000 states.
+
+Functions:
+    redundant_machine - build a random machine with many equivalent states, so that there is something to minimise.
+'''
+
+import optparse
+import time
+
+import numpy
+
+import automata
+
+
+def redundant_machine(state_count, input_count, rng):
+    '''Return a random machine of state_count states whose states are copies of about a tenth as many distinct ones.'''
+    core = max(1, state_count // 10)
+    targets = rng.integers(core, size=(state_count, input_count))
+    # Each state copies the behaviour of state (s % core), but moves to a random copy of each target.
+    copies = rng.integers(state_count // core, size=(state_count, input_count)) * core
+    outputs = rng.integers(2, size=core)
+    m = automata.CanonicalMooreMachine(state_count, input_count)
+    for s in range(state_count):
+        for i in range(input_count):
+            m.set_arc(s, i, min(int(targets[s % core, i] + copies[s, i]), state_count - 1))
+        m.set_output(s, int(outputs[s % core]))
+    return m
+
+
+def main(options, args):
+    rng = numpy.random.default_rng(options.SEED)
+
+    print(f"{'states':>8} {'minimal':>8} {'hopcroft s':>11} {'naive s':>11}")
+    for n in (10, 100, 1000, 10000, 100000):
+        m = redundant_machine(n, options.INPUTS, rng)
+        start = time.perf_counter()
+        minimal = m.minimised()
+        hopcroft_time = time.perf_counter() - start
+        if n <= options.NAIVE_LIMIT:
+            start = time.perf_counter()
+            m.naive_minimised()
+            naive_time = f"{time.perf_counter() - start:>11.4f}"
+        else:
+            naive_time = f"{'-':>11}"
+        print(f"{n:>8} {minimal.state_count():>8} {hopcroft_time:>11.4f} {naive_time}")
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(("Usage: python -m benchmarks.minimisation [OPTION]...\n"
+                                    "Time Hopcroft's and the naive minimisation of random CanonicalMooreMachines."))
+    parser.add_option("-a", "--alphabet", type="int", action="store", dest="INPUTS", default=3,
+                    help="size of the input alphabet (default: %default)")
+    parser.add_option("-N", "--naive-limit", type="int", action="store", dest="NAIVE_LIMIT", default=10000,
+                    help="largest machine to minimise with the naive method, which is quadratic or worse (default: %default)")
+    parser.add_option("-s", "--seed", type="int", action="store", dest="SEED", default=0,
+                    help="seed for the random machines (default: %default)")
+
+    (options, args) = parser.parse_args()
+
+    main(options, args)
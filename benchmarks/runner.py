@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+'''
+runner - Compare the steps per second of running many strings through a CanonicalMooreMachine with MooreMachineRun, one next_state()
+         call at a time as it used to, and through the CompiledRun it now uses by default; and with CompiledRun.run_many.
+
+Functions:
+    random_words - draw a list of random strings over an alphabet.
+    run_steps_per_second - time running the strings through MooreMachineRun's reset, multistep and output.
+    compiled_steps_per_second - time running the strings through CompiledRun.run_many, including the compilation.
+'''
+
+import optparse
+import time
+
+import numpy
+
+import automata
+from benchmarks.dense_backend import random_machine
+
+
+def random_words(count, max_length, input_count, rng):
+    '''Return a list of count random tuples of symbols below input_count, of lengths up to max_length.'''
+    lengths = rng.integers(max_length + 1, size=count)
+    return [tuple(rng.integers(input_count, size=k).tolist()) for k in lengths.tolist()]
+
+
+def run_steps_per_second(machine, words, compiled):
+    '''Run each word from the starting state through a MooreMachineRun, compiled or not (see its constructor), take its output,
+    and return the number of transitions per second, including the compilation.'''
+    start = time.perf_counter()
+    run = automata.MooreMachineRun(machine, compiled)
+    results = []
+    for word in words:
+        run.reset()
+        run.multistep(word)
+        results.append(run.output())
+    return sum(map(len, words)) / (time.perf_counter() - start), results
+
+
+def compiled_steps_per_second(machine, words):
+    '''Compile the machine and run the words with run_many, and return the number of transitions per second.'''
+    start = time.perf_counter()
+    results = automata.CompiledRun(machine).run_many(words)
+    return sum(map(len, words)) / (time.perf_counter() - start), results
+
+
+def main(options, args):
+    rng = numpy.random.default_rng(options.SEED)
+    words = random_words(options.COUNT, options.LENGTH, options.INPUTS, rng)
+
+    print(f"{'class':>28} {'states':>8} {'stepwise steps/s':>17} {'compiled steps/s':>17} {'run_many steps/s':>17} {'ratio':>7}")
+    for cls in (automata.CanonicalMooreMachine, automata.DenseCanonicalMooreMachine):
+        for n in (10, 100, 1000):
+            m = random_machine(cls, n, options.INPUTS, numpy.random.default_rng(options.SEED))
+            stepwise_rate, stepwise_results = run_steps_per_second(m, words, compiled=False)
+            compiled_rate, compiled_results = run_steps_per_second(m, words, compiled=True)
+            many_rate, many_results = compiled_steps_per_second(m, words)
+            assert compiled_results == stepwise_results and many_results == stepwise_results
+            print(f"{cls.__name__:>28} {n:>8} {stepwise_rate:>17,.0f} {compiled_rate:>17,.0f} {many_rate:>17,.0f} {compiled_rate / stepwise_rate:>7.2f}")
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(("Usage: python -m benchmarks.runner [OPTION]...\n"
+                                    "Time running many strings through random CanonicalMooreMachines with MooreMachineRun, step by step and compiled, and with CompiledRun.run_many."))
+    parser.add_option("-n", "--count", type="int", action="store", dest="COUNT", default=20000,
+                    help="number of strings to run through each machine (default: %default)")
+    parser.add_option("-l", "--length", type="int", action="store", dest="LENGTH", default=40,
+                    help="greatest length of the strings (default: %default)")
+    parser.add_option("-a", "--alphabet", type="int", action="store", dest="INPUTS", default=3,
+                    help="size of the input alphabet (default: %default)")
+    parser.add_option("-s", "--seed", type="int", action="store", dest="SEED", default=0,
+                    help="seed for the random machines and strings (default: %default)")
+
+    (options, args) = parser.parse_args()
+
+    main(options, args)
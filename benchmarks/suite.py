@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+'''
+suite - Time the whole evolution pipeline on fixed targets with fixed seeds, write the results to a JSON baseline, and report
+        regressions against an earlier baseline, so that a change to automata, FSMScorer or SMO_GP can be checked for speed.
+
+The targets are UniWitness(3) to UniWitness(10) and the Naidoo reference languages.  For each, the suite times:
+
+    next_state - transitions per second through next_state, on one long random string.
+    multistep - transitions per second through MooreMachineRun.multistep, on many short random strings.
+    score_cold - machines per second scored by an FSMScorer with an empty cache, on a balanced table for the target.
+    score_warm - machines per second scored again, from the cache.
+    mutator - mutants per second made by the complexophile mutator of experiment 5, repeated by a Poisson number of times.
+    minimised - machines per second minimised, among mutants grown from the target.
+    generations - SMO-GP generations per second, evolving machines towards the target from a one-state machine.
+
+Every result is a rate, so higher is better; each is the best of a number of repeats, each call starting from the same seed.
+
+Functions:
+    targets - the named target machines.
+    best_rate - time a function over repeats and return its best rate.
+    grown - mutants grown from a machine, to score and minimise.
+    run_suite - run every benchmark on every target, and return the results by name.
+    compare - the results that are slower than in a baseline by more than a tolerance.
+'''
+
+import itertools
+import json
+import optparse
+import platform
+import sys
+import time
+
+import numpy
+
+import automata
+import FSMScorer
+import NaidooRefLanguages
+import SMO_GP
+from experiment_5 import complexophile_mutator, complexity_scorer, poisson_repeat
+from uniwitness import UniWitness
+
+
+def targets():
+    '''Return a list of pairs of names and target CanonicalMooreMachines.'''
+    r = [("U%d" % n, UniWitness(n)) for n in range(3, 11)]
+    for name in ("L1", "L2", "L3", "L4", "L5", "L6", "L7", "L8", "L9", "LX"):
+        r.append(("Naidoo-" + name, automata.CanonicalMooreMachine.from_string(getattr(NaidooRefLanguages, name))))
+    return r
+
+
+def best_rate(f, amount, repeat, seed, min_time=0.0):
+    '''Time calls of f(), reseeding NumPy's global generator with seed before each, and return amount per call divided by the
+    shortest time per call among repeat repeats.  Each repeat makes enough calls to take at least min_time seconds, as found by
+    the first call, so that short benchmarks are not lost in the noise of the clock and the scheduler.'''
+    numpy.random.seed(seed)
+    start = time.perf_counter()
+    f()
+    calls = max(1, int(min_time / max(time.perf_counter() - start, 1e-9)))
+    best = None
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(calls):
+            numpy.random.seed(seed)
+            start = time.perf_counter()
+            f()
+            elapsed += time.perf_counter() - start
+        best = elapsed / calls if best is None else min(best, elapsed / calls)
+    return amount / max(best, 1e-9)
+
+
+def grown(machine, count, size):
+    '''Return count mutants of the machine, each mutated 'size' times with the complexophile mutator, from NumPy's global generator.'''
+    mutants = []
+    for _ in range(count):
+        m = machine
+        for _ in range(size):
+            m = complexophile_mutator(m)
+        mutants.append(m)
+    return mutants
+
+
+def run_suite(options):
+    '''Run the benchmarks on the targets, and return a dict from names, as 'target/benchmark', to rates.'''
+    results = {}
+    for name, target in targets():
+        k = target.input_count()
+        rng = numpy.random.default_rng(options.SEED)
+        word = rng.integers(k, size=options.STEPS).tolist()
+        words = [tuple(rng.integers(k, size=int(n)).tolist()) for n in rng.integers(1, 21, size=options.STEPS // 10)]
+
+        def next_state():
+            step = target.next_state
+            s = target.starting_state()
+            for symbol in word:
+                s = step(s, symbol)
+
+        def multistep():
+            run = automata.MooreMachineRun(target)
+            for w in words:
+                run.reset()
+                run.multistep(w)
+
+        numpy.random.seed(options.SEED)
+        population = grown(target, options.POPULATION, 5)
+        reference = FSMScorer.balanced_reference_dict(target, options.TABLE_SIZE, k)
+        scorer = FSMScorer.FSMScorer.from_reference_dict(reference)
+
+        def score_cold():
+            scorer.reference_dict = reference
+            for m in population:
+                scorer.score(m)
+
+        def score_warm():
+            for m in population:
+                scorer.score(m)
+
+        mutation = poisson_repeat(complexophile_mutator, 1.0)
+
+        def mutator():
+            for _ in range(options.POPULATION):
+                mutation(target)
+
+        def minimised():
+            for m in population:
+                m.minimised()
+
+        def generations():
+            evolution_scorer = FSMScorer.FSMScorer.from_reference_dict(reference)
+            smo_gp = SMO_GP.SMO_GP(initial_individuals={automata.CanonicalMooreMachine(input_count=k)},
+                                   mutator=mutation,
+                                   objectives=(evolution_scorer.score, complexity_scorer))
+            for _ in itertools.islice(smo_gp.populations(), options.GENERATIONS):
+                pass
+
+        runs = (("next_state", next_state, len(word)),
+                ("multistep", multistep, sum(map(len, words))),
+                ("score_cold", score_cold, len(population)),
+                ("score_warm", score_warm, len(population)),
+                ("mutator", mutator, options.POPULATION),
+                ("minimised", minimised, len(population)),
+                ("generations", generations, options.GENERATIONS))
+        for benchmark, f, amount in runs:
+            if options.ONLY and benchmark not in options.ONLY.split(","):
+                continue
+            results[name + "/" + benchmark] = best_rate(f, amount, options.REPEAT, options.SEED, options.MIN_TIME)
+            print(f"{name + '/' + benchmark:>28} {results[name + '/' + benchmark]:>16,.1f}", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''Return a list of triples of the names, baseline rates and rates of the results slower than the baseline by more than the
+    fraction tolerance; results missing from either are left out.'''
+    return [(name, baseline[name], rate) for name, rate in results.items()
+            if name in baseline and rate < baseline[name] * (1 - tolerance)]
+
+
+def main(options, args):
+    results = run_suite(options)
+
+    if options.OUTPUT:
+        with open(options.OUTPUT, "w") as f:
+            json.dump({"python": platform.python_version(), "numpy": numpy.__version__, "seed": options.SEED,
+                       "options": vars(options), "results": results}, f, indent=1, sort_keys=True)
+
+    if options.BASELINE:
+        with open(options.BASELINE) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, options.TOLERANCE)
+        print(f"\n{len(regressions)} of {len(set(results) & set(baseline))} results slower than the baseline by more than {options.TOLERANCE:.0%}")
+        for name, old, new in regressions:
+            print(f"{name:>28} {old:>16,.1f} {new:>16,.1f} {new / old - 1:>8.1%}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(("Usage: python -m benchmarks.suite [OPTION]...\n"
+                                    "Time the automata, scoring and SMO-GP pipeline on UniWitness and Naidoo targets, optionally writing\n"
+                                    "the rates to a JSON baseline and comparing them with an earlier one; exits with status 1 on regressions."))
+    parser.add_option("-o", "--output", action="store", dest="OUTPUT", default="",
+                    help="if given, write the results to the JSON file OUTPUT, to serve as a baseline")
+    parser.add_option("-b", "--baseline", action="store", dest="BASELINE", default="",
+                    help="if given, report the results slower than in the JSON file BASELINE")
+    parser.add_option("-t", "--tolerance", type="float", action="store", dest="TOLERANCE", default=0.1,
+                    help="fraction by which a result may be slower than the baseline before it is reported (default: %default)")
+    parser.add_option("--only", action="store", dest="ONLY", default="",
+                    help="if given, run only the comma-separated benchmarks in ONLY, e.g. score_cold,generations")
+    parser.add_option("-r", "--repeat", type="int", action="store", dest="REPEAT", default=3,
+                    help="number of times to repeat each benchmark, keeping the best (default: %default)")
+    parser.add_option("-m", "--min-time", type="float", action="store", dest="MIN_TIME", default=0.2,
+                    help="least number of seconds each repeat of a benchmark takes, calling it as many times as needed (default: %default)")
+    parser.add_option("-n", "--steps", type="int", action="store", dest="STEPS", default=100000,
+                    help="number of transitions to time through next_state, and a tenth as many strings for multistep (default: %default)")
+    parser.add_option("-p", "--population", type="int", action="store", dest="POPULATION", default=200,
+                    help="number of machines to score, mutate and minimise (default: %default)")
+    parser.add_option("-d", "--dict", type="int", action="store", dest="TABLE_SIZE", default=200,
+                    help="number of strings in the balanced scoring table (default: %default)")
+    parser.add_option("-g", "--generations", type="int", action="store", dest="GENERATIONS", default=300,
+                    help="number of SMO-GP generations to time (default: %default)")
+    parser.add_option("-s", "--seed", type="int", action="store", dest="SEED", default=0,
+                    help="seed for the random strings, machines and mutations (default: %default)")
+
+    (options, args) = parser.parse_args()
+
+    main(options, args)
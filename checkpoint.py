@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+'''
+checkpoint - Periodic checkpoints of long evolution runs, written atomically to a compact binary file, so that runs can be resumed.
+
+Classes:
+
+    Checkpointer - decides when a checkpoint is due, by generations or by wall-clock time, and writes it.
+
+Functions:
+
+    save - write a picklable state atomically to a checkpoint file.
+    load - read the state back from a checkpoint file.
+    add_options - add the checkpoint options to an optparse parser, for the experiment CLIs.
+    from_options - construct a Checkpointer from the options parsed by a parser prepared with add_options, or None if checkpoints are off.
+    resume_state - the state to resume from, as specified by the options, or None to start afresh.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import logging
+import optparse
+import os
+import pickle
+import tempfile
+import time
+import zlib
+
+
+# The first bytes of a checkpoint file; the rest is a zlib-compressed pickle of the state.
+MAGIC = b"FSMC\x01"
+
+
+def save(path, state):
+    '''Write the state to the file at path, replacing it atomically: the file holds either the previous checkpoint or this one, never a part.'''
+    data = MAGIC + zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load(path):
+    '''Return the state saved in the checkpoint file at path.'''
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a checkpoint file: " + str(path))
+    return pickle.loads(zlib.decompress(data[len(MAGIC):]))
+
+
+class Checkpointer(object):
+    '''Writes checkpoints to a file when due: every 'generations' generations, or every 'seconds' seconds of wall-clock time,
+    whichever comes first (zero disables either).'''
+
+    def __init__(self, path, generations=0, seconds=0.0) -> None:
+        self.path = path
+        self.generations = generations
+        self.seconds = seconds
+        self._last_generation = None
+        self._last_time = time.monotonic()
+
+    def due(self, generation):
+        '''Whether a checkpoint is due at the given generation.  The first generation asked about starts the count, as does one
+        before the last, when a new run starts.'''
+        if self._last_generation is None or generation < self._last_generation:
+            self._last_generation = generation
+        return (self.generations > 0 and generation - self._last_generation >= self.generations) \
+            or (self.seconds > 0 and time.monotonic() - self._last_time >= self.seconds)
+
+    def save(self, generation, state):
+        '''Write a checkpoint of the state, as of the given generation.'''
+        save(self.path, state)
+        self._last_generation = generation
+        self._last_time = time.monotonic()
+        logging.info("Checkpoint written at generation %d", generation)
+
+
+def add_options(parser):
+    '''Add options for checkpoints to an optparse parser.'''
+    group = optparse.OptionGroup(parser, "Checkpoint options")
+    group.add_option("--checkpoint", action="store", dest="CHECKPOINT", default="",
+                    help="if given, periodically save the state of the run to the file CHECKPOINT")
+    group.add_option("--checkpoint-generations", type="int", action="store", dest="CHECKPOINT_GENERATIONS", default=1000,
+                    help="if not zero, save a checkpoint every CHECKPOINT_GENERATIONS generations (default: %default)")
+    group.add_option("--checkpoint-seconds", type="float", action="store", dest="CHECKPOINT_SECONDS", default=0.0,
+                    help="if not zero, save a checkpoint every CHECKPOINT_SECONDS seconds (default: %default)")
+    group.add_option("--resume", action="store_true", dest="RESUME", default=False,
+                    help="continue from the checkpoint file, if it exists, exactly as the run would have continued; the other options must be as they were")
+    parser.add_option_group(group)
+
+
+def from_options(options):
+    '''Return a new Checkpointer as specified by the options added by add_options, or None if no checkpoint file was given.'''
+    if not options.CHECKPOINT:
+        return None
+    return Checkpointer(options.CHECKPOINT, options.CHECKPOINT_GENERATIONS, options.CHECKPOINT_SECONDS)
+
+
+def resume_state(options):
+    '''Return the state saved in the checkpoint file if --resume was given and the file exists, otherwise None.'''
+    if options.RESUME and options.CHECKPOINT and os.path.exists(options.CHECKPOINT):
+        logging.info("Resuming from checkpoint " + options.CHECKPOINT)
+        return load(options.CHECKPOINT)
+    return None
+
+
+# Unit testing code.
+
+import unittest as ut
+
+class TestCheckpoint(ut.TestCase):
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.ckpt")
+            state = {"generation": 7, "population": [((0, 1), (3, -1))] * 100}
+            save(path, state)
+            self.assertEqual(load(path), state)
+            save(path, {"generation": 8})
+            self.assertEqual(load(path), {"generation": 8})
+            self.assertEqual(os.listdir(directory), ["run.ckpt"])
+
+            c = Checkpointer(path, generations=10)
+            self.assertFalse(c.due(5))
+            self.assertFalse(c.due(14))
+            self.assertTrue(c.due(15))
+            c.save(15, {"generation": 15})
+            self.assertFalse(c.due(16))
+            self.assertEqual(load(path)["generation"], 15)
+            self.assertFalse(c.due(0))
+            self.assertTrue(c.due(10))
+
+    def test_options(self):
+        parser = optparse.OptionParser()
+        add_options(parser)
+        options, _ = parser.parse_args(["--resume"])
+        self.assertIsNone(from_options(options))
+        self.assertIsNone(resume_state(options))
+
+
+if __name__ == '__main__':
+    ut.main()
@@ -33,23 +33,28 @@ INPUT_ALPHABET_SIZE = 3 # The Universal Witness languages use a three-symbol alp
 
 
 
-from copy import deepcopy
 
 import numpy
 from numpy.random import poisson
 import logging
 import optparse
+import sys
 
 import automata
 import FSMScorer
 import SMO_GP
+import scorecache
+import telemetry
+import checkpoint
+import machinearchive
+import profiling
+import experiments
 from uniwitness import UniWitness
-import countable
 
 def complexophile_mutator(mm_parent: automata.CanonicalMooreMachine):
 
-    # First, make a copy of the given parent object
-    m = deepcopy(mm_parent)
+    # First, make a copy of the given parent object; it shares storage with the parent until modified
+    m = mm_parent.clone()
 
     # Pick a random source state for an arc, an input label
     source_state = numpy.random.choice(m.state_count())
@@ -117,27 +122,7 @@ class E7Scorer(FSMScorer.FSMScorer):
         self.reset()
 
     def compute_dict(self):
-        d = dict()
-
-        mr = automata.MooreMachineRun(self.cmm)
-        positive = 0
-        negative = 0
-
-        for s in countable.all_words_from_alphabet(range(INPUT_ALPHABET_SIZE)):
-            mr.reset()
-            mr.multistep(s)
-            result = mr.output()
-            #print(s, "result: ", result, "pos: ", positive, "neg: ", negative)
-            if (positive >= negative and result == 0) \
-            or (positive <= negative and result == 1):
-                d[s] = result
-                if result == 1:
-                    positive += 1
-                else:
-                    negative += 1
-                if positive + negative >= self.dictsize:
-                    break
-        self.reference_dict = d
+        self.reference_dict = FSMScorer.balanced_reference_dict(self.cmm, self.dictsize, INPUT_ALPHABET_SIZE)
 
 def create_scorer(table_size, u):
 
@@ -185,26 +170,61 @@ def main(options, args):
 
     output_generation = [(primitive, [0, 0])]
 
-    for u in range(options.UNIWITNESS, options.LASTUNIWITNESS + 1):
-        fitness_scorer = create_scorer(options.DICTSIZE, u)
-        logging.info("Target: U(" + str(u) + "); Longest scoring string: " + str(max([len(s) for s in fitness_scorer.reference_dict.keys()])))
+    # Continue a checkpointed run from the U(n) level and the scorer as they were
+    checkpointer = checkpoint.from_options(options)
+    resumed = checkpoint.resume_state(options)
+    sink = telemetry.from_options(options, resumed)
+    profiler = profiling.from_options(options)
+
+    for u in range(options.UNIWITNESS if resumed is None else resumed["u"], options.LASTUNIWITNESS + 1):
+        target = UniWitness(u)
+        if options.EXACT_LENGTH > 0:
+            fitness_scorer = FSMScorer.AgreementScorer(target, options.EXACT_LENGTH)
+        else:
+            fitness_scorer = create_scorer(options.DICTSIZE, u)
+        fitness_scorer.cache = scorecache.from_options(options)
+        fitness_scorer.index_runs = options.INDEX_RUNS
+        if resumed is not None:
+            fitness_scorer = resumed["scorer"]
+        logging.info("Target: U(" + str(u) + "); Longest scoring string: " + str(options.EXACT_LENGTH if options.EXACT_LENGTH > 0 else max([len(s) for s in fitness_scorer.reference_dict.keys()])))
 
         # Run the SMO-GP algorithm for N cycles
+        mutation = poisson_repeat(complexophile_mutator, 1.0)
+        mutation = experiments.mutator_from_options(options, mutation)
         change = 0
-        for i, g in enumerate(SMO_GP.SMO_GP(
+        smo_gp = SMO_GP.SMO_GP(
                         initial_individuals={primitive},
-                        mutator=poisson_repeat(complexophile_mutator, 1.0),
-                        objectives=(fitness_scorer.score, complexity_scorer),
-                        dynamic_change=None
-                    ).populations()):
-
+                        mutator=mutation,
+                        objectives=(fitness_scorer.score, experiments.complexity_from_options(options, complexity_scorer)),
+                        dynamic_change=None,
+                        batch_size=options.BATCH,
+                        workers=options.WORKERS,
+                        cache_hits=lambda: fitness_scorer.cache.hits,
+                        profiler=profiler
+                    )
+        if resumed is not None:
+            smo_gp.restore(resumed["smo_gp"])
+            resumed = None
+        if sink is not None:
+            smo_gp.add_telemetry_sink(sink, level=u)
+        for i, g in enumerate(smo_gp.populations(), smo_gp.generation):
+
+            if checkpointer is not None and checkpointer.due(i):
+                checkpointer.save(i, {"smo_gp": smo_gp.state(), "scorer": fitness_scorer, "u": u, "telemetry": telemetry.offset(sink)})
             output_generation = g
             top_score = max([score[0] for _, score in g])
+            if options.CACHE_STATS > 0 and i % options.CACHE_STATS == 0:
+                logging.info(scorecache.format_stats(fitness_scorer.cache_stats()))
             if options.INFOGENS >0 and i % options.INFOGENS == 0:
                 logging.info("Generation " + str(i) + "; Top score " + str(top_score))
+                logging.info("%.1f candidates per second per worker", smo_gp.throughput())
             if i >= options.GENERATIONS or (options.CHANGEUP > 0 and top_score >= options.CHANGEUP):
                 logging.info("Generation " + str(i) + "; Changing up; max score is " + str(top_score))
                 break
+            if options.STOP_EXACT and experiments.exact_solution(g, target) is not None:
+                logging.info("Generation %d; Changing up; exact solution found", i)
+                break
+        logging.info("%d candidates, %.1f per second per worker", smo_gp.candidates, smo_gp.throughput())
 
     # Print the scoring dictionary
     #logging.debug("Scoring table:")
@@ -217,6 +237,15 @@ def main(options, args):
     for individual, scores in output_generation:
         logging.info("The following automaton scored %d with %d states:\n%s", scores[0], -scores[1] ,str(individual))
         print(-scores[1], scores[0], sep=",")
+    if options.ARCHIVE:
+        machinearchive.write_archive(options.ARCHIVE, (individual for individual, _ in output_generation))
+
+    if sink is not None:
+        sink.close()
+    if profiler is not None:
+        profiler.close()
+        if options.PROFILE:
+            print(profiler.report(), file=sys.stderr)
 
     logging.info("End of run")
 
@@ -270,6 +299,15 @@ if __name__ == "__main__":
     parser.add_option("-C", "--Changeup", type="int", action="store", dest="CHANGEUP", default=0,
                     help="the score to achieve against the dictionary before changing up to the next higher Universal Witness language")
 
+    parser.add_option("--exact-length", type="int", action="store", dest="EXACT_LENGTH", default=0,
+                    help="if not zero, score on all strings up to length EXACT_LENGTH, counted exactly, instead of on a sample table of DICTSIZE strings")
+    experiments.add_options(parser, exact_target=True)
+    scorecache.add_options(parser)
+    telemetry.add_options(parser)
+    checkpoint.add_options(parser)
+    machinearchive.add_options(parser)
+    profiling.add_options(parser)
+
     (options, args) = parser.parse_args()
 
     if hasattr(options, "SELFTEST") and options.SELFTEST:
@@ -4,7 +4,7 @@
 experiment_1 - Compute the Pareto front on best prediction and smallest size in states, for FSM solution evolving to recognise a randomised small language.
 
 Classes:
-    None.
+    DynamicChange - iterator making the periodic changes to the fitness scorer, which can be saved in a checkpoint.
 
 Functions:
     dict_score - given a dictionary of keys and values to be computed from them, runs a given function on each key, and counts the values that the function gets right.
@@ -30,24 +30,30 @@ def dict_score(dictionary, function):
     '''dict_score - compute how well a function does in computing the values from the keys of a dictionary.'''
     sum(1 for k, v in dictionary.items() if function(k) == v)
 
-from copy import deepcopy
 import itertools
 import random
 import numpy
 from numpy.random import poisson
 import logging
 import optparse
+import sys
 
 import countable
 import automata
 import FSMScorer
 import SMO_GP
+import scorecache
+import telemetry
+import checkpoint
+import machinearchive
+import profiling
+import experiments
 
 
 def mutator(mm_parent: automata.CanonicalMooreMachine):
 
-    # First, make a copy of the given parent object
-    m = deepcopy(mm_parent)
+    # First, make a copy of the given parent object; it shares storage with the parent until modified
+    m = mm_parent.clone()
 
     source_state = random.randrange(m.state_count())
     input = random.randrange(m.input_count())
@@ -91,23 +97,32 @@ def complexity_scorer(moore_machine: automata.MooreMachine):
     '''Returns an integer score for the complexity of a given Moore machine.  The lower the number of states, the higher the score.'''
     return -moore_machine.state_count()
 
-def dynamic_change(fitness_scorer, change_per_gen):
-    '''Generator to periodically change the given fitness scorer, depending on the number of changes per generation (float).'''
-    change = 0
-    while True:
-        change += change_per_gen
+class DynamicChange(object):
+    '''Iterator to periodically change the given fitness scorer, depending on the number of changes per generation (float).
+    Unlike a generator, it can be saved in a checkpoint.'''
+
+    def __init__(self, fitness_scorer, change_per_gen) -> None:
+        self.fitness_scorer = fitness_scorer
+        self.change_per_gen = change_per_gen
+        self.change = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.change += self.change_per_gen
         recalc = False
-        while change >= 1:
+        while self.change >= 1:
             recalc = True
-            change -= 1
-            n = numpy.random.randint(fitness_scorer.table_size())
-            k, v = fitness_scorer.ref_and_output(n)
+            self.change -= 1
+            n = numpy.random.randint(self.fitness_scorer.table_size())
+            k, v = self.fitness_scorer.ref_and_output(n)
             if v == 1:
                 v = 0
             else:
                 v = 1
-            fitness_scorer.set_output(k, v)
-        yield recalc
+            self.fitness_scorer.set_output(k, v)
+        return recalc
 
 
 def main(options, args):
@@ -125,18 +140,50 @@ def main(options, args):
     primitive = automata.CanonicalMooreMachine(input_count=2)
 
     fitness_scorer = create_scorer(options.MAX_STRING_LENGTH)
+    fitness_scorer.cache = scorecache.from_options(options)
+    fitness_scorer.index_runs = options.INDEX_RUNS
+    fitness_scorer.track_outputs = options.TRACK_OUTPUTS
 
     change_per_gen = options.CHANGE / 100 * fitness_scorer.table_size()
 
+    # Continue a checkpointed run with the scorer and its changes as they were
+    checkpointer = checkpoint.from_options(options)
+    resumed = checkpoint.resume_state(options)
+    if resumed is None:
+        dynamic_change = DynamicChange(fitness_scorer, change_per_gen)
+    else:
+        fitness_scorer = resumed["scorer"]
+        dynamic_change = resumed["dynamic_change"]
+
     # Run the SMO-GP algorithm for N cycles
+    mutation = repeated_application(mutator, 1 + poisson(1,1)[0])
+    mutation = experiments.mutator_from_options(options, mutation)
     change = 0
-    for i, g in enumerate(SMO_GP.SMO_GP(
+    profiler = profiling.from_options(options)
+    smo_gp = SMO_GP.SMO_GP(
                     initial_individuals={primitive},
-                    mutator=repeated_application(mutator, 1 + poisson(1,1)[0]),
-                    objectives=(fitness_scorer.score, complexity_scorer),
-                    dynamic_change=dynamic_change(fitness_scorer, change_per_gen)
-                ).populations()):
-
+                    mutator=mutation,
+                    objectives=(fitness_scorer.score, experiments.complexity_from_options(options, complexity_scorer)),
+                    dynamic_change=dynamic_change,
+                    batch_size=options.BATCH,
+                    workers=options.WORKERS,
+                    cache_hits=lambda: fitness_scorer.cache.hits,
+                    profiler=profiler
+                )
+    if resumed is not None:
+        smo_gp.restore(resumed["smo_gp"])
+        random.setstate(resumed["random"])
+    sink = telemetry.from_options(options, resumed)
+    if sink is not None:
+        smo_gp.add_telemetry_sink(sink)
+    for i, g in enumerate(smo_gp.populations(), smo_gp.generation):
+
+        if checkpointer is not None and checkpointer.due(i):
+            checkpointer.save(i, {"smo_gp": smo_gp.state(), "scorer": fitness_scorer, "dynamic_change": dynamic_change,
+                                  "random": random.getstate(), "telemetry": telemetry.offset(sink)})
+
+        if options.CACHE_STATS > 0 and i % options.CACHE_STATS == 0:
+            logging.info(scorecache.format_stats(fitness_scorer.cache_stats()))
         if options.INFOGENS >0 and i % options.INFOGENS == 0:
             logging.info("Generation " + str(i))
         if i >= options.GENERATIONS:
@@ -146,6 +193,15 @@ def main(options, args):
     for individual, scores in g:
         logging.info("The following automaton scored %d with %d states:\n%s", scores[0], -scores[1] ,str(individual))
         print(-scores[1], scores[0], sep=",")
+    if options.ARCHIVE:
+        machinearchive.write_archive(options.ARCHIVE, (individual for individual, _ in g))
+
+    if sink is not None:
+        sink.close()
+    if profiler is not None:
+        profiler.close()
+        if options.PROFILE:
+            print(profiler.report(), file=sys.stderr)
 
     logging.info("End of run")
 
@@ -168,6 +224,15 @@ if __name__ == "__main__":
                     help="set the maximum length of strings in the randomised language (default: %default)")
     parser.add_option("-c", "--change", type = "float", action="store", dest="CHANGE", default=0.0,
                     help="percentage of fitness reference table to change per generation (default: %default)")
+    parser.add_option("--track-outputs", action="store_true", dest="TRACK_OUTPUTS", default=False,
+                    help="keep the outputs of scored machines, so that changes to the reference table update the cached scores instead of discarding them")
+
+    experiments.add_options(parser)
+    scorecache.add_options(parser)
+    telemetry.add_options(parser)
+    checkpoint.add_options(parser)
+    machinearchive.add_options(parser)
+    profiling.add_options(parser)
 
     (options, args) = parser.parse_args()
 
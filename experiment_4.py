@@ -7,7 +7,7 @@ experiment_4 - Compute a quasi-Pareto front on best prediction and smallest size
                 of which the active subset is applied in selection.
 
 Classes:
-    None.
+    DynamicChange - iterator making the periodic changes to the fitness scorer, which can be saved in a checkpoint.
 
 Functions:
     mutator - mutation operator for Moore Machines.  May add a new state, and will set a random transition arc, and will change the ouput of a random state to a random value.
@@ -31,24 +31,30 @@ INPUT_ALPHABET_SIZE = 2
 
 # from experiment_3 import *
 
-from copy import deepcopy
 import itertools
 import random
 import numpy
 from numpy.random import poisson
 import logging
 import optparse
+import sys
 
 import NaidooRefLanguages
 import countable
 import automata
 import FSMScorer
 import SMO_GP
+import scorecache
+import telemetry
+import checkpoint
+import machinearchive
+import profiling
+import experiments
 
 def complexophile_mutator(mm_parent: automata.CanonicalMooreMachine):
 
-    # First, make a copy of the given parent object
-    m = deepcopy(mm_parent)
+    # First, make a copy of the given parent object; it shares storage with the parent until modified
+    m = mm_parent.clone()
 
     # Pick a random source state for an arc, an input label
     source_state = numpy.random.choice(m.state_count())
@@ -102,30 +108,22 @@ class E4Scorer(FSMScorer.FSMScorer):
     def __init__(self, n, cmm) -> None:
         '''Create an FSMScorer of n strings that are branches of a binary tree from the empty string, being positive or negative examples of the language of the Canonical Moore Machine cmm.'''
         super().__init__()
-        self.keylist = [()]
-        self.mr = automata.MooreMachineRun(cmm)
-        self.mr.multistep(self.keylist[0])
-        self.reference_dict = {self.keylist[0]: self.mr.output()}
+        self.compiled = automata.CompiledRun(cmm)
+        self.reference_dict = {(): self.compiled.run(())}
         for _ in range(n-1):
             self.extend()
     
     def extend(self):
         while True:
-            parent = self.keylist[numpy.random.choice(len(self.keylist))]
+            parent = self.reference_dict.key_at(numpy.random.choice(len(self.reference_dict)))
             child = parent + (numpy.random.choice(2),)
-            if not(child in self.keylist):
+            if not(child in self.reference_dict):
                 break
-        self.keylist.append(child)
 
-        self.mr.reset()
-        self.mr.multistep(child)
-        self.reference_dict[child] = self.mr.output()
+        self.reference_dict[child] = self.compiled.run(child)
 
     def reduce(self):
-        index = numpy.random.choice(len(self.keylist))
-        key = self.keylist[index]
-        self.keylist.pop(index)
-        self.reference_dict.pop(key)
+        self.reference_dict.remove_at(numpy.random.choice(len(self.reference_dict)))
 
 def create_scorer(table_size, cmm):
 
@@ -137,23 +135,34 @@ def complexity_scorer(moore_machine: automata.MooreMachine):
     '''Returns an integer score for the complexity of a given Moore machine.  The lower the number of states, the higher the score.'''
     return -moore_machine.state_count()
 
-def dynamic_change(fitness_scorer: E4Scorer, change_per_gen):
-    '''Generator to periodically change the given fitness scorer, depending on the number of changes per generation (float).'''
+class DynamicChange(object):
+    '''Iterator to periodically change the given fitness scorer, depending on the number of changes per generation (float).
+    Each change yields True; once the changes due in a generation are made, it yields False.  Unlike a generator, it can be
+    saved in a checkpoint.'''
 
-    change = 0
-    while True:
-        change += change_per_gen
-        # recalc = False
-        while change >= 1:
-            #recalc = True
-            change -= 1
+    def __init__(self, fitness_scorer: E4Scorer, change_per_gen) -> None:
+        self.fitness_scorer = fitness_scorer
+        self.change_per_gen = change_per_gen
+        self.change = 0
+        # Whether the next call starts a generation's changes, rather than continuing them
+        self._starting = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._starting:
+            self.change += self.change_per_gen
+        if self.change >= 1:
+            self.change -= 1
 
-            fitness_scorer.reduce()
-            fitness_scorer.extend()
-            yield True
+            self.fitness_scorer.reduce()
+            self.fitness_scorer.extend()
+            self._starting = False
+            return True
 
-        #yield recalc
-        yield False
+        self._starting = True
+        return False
 
 def main(options, args):
 
@@ -169,36 +178,80 @@ def main(options, args):
     # Setup
     primitive = automata.CanonicalMooreMachine(input_count=2)
 
-    fitness_scorer = create_scorer(options.DICTSIZE, automata.CanonicalMooreMachine.from_string(NaidooRefLanguages.LX))
-    logging.info("Longest scoring string: " + str(max([len(s) for s in fitness_scorer.keylist])))
+    target = automata.CanonicalMooreMachine.from_string(NaidooRefLanguages.LX)
+    fitness_scorer = create_scorer(options.DICTSIZE, target)
+    fitness_scorer.cache = scorecache.from_options(options)
+    fitness_scorer.index_runs = options.INDEX_RUNS
+    logging.info("Longest scoring string: " + str(max([len(s) for s in fitness_scorer.reference_dict])))
 
     change_per_gen = options.CHANGE / 100 * fitness_scorer.table_size()
 
+    # Continue a checkpointed run with the scorer and its changes as they were
+    checkpointer = checkpoint.from_options(options)
+    resumed = checkpoint.resume_state(options)
+    if resumed is None:
+        dynamic_change = DynamicChange(fitness_scorer, change_per_gen)
+    else:
+        fitness_scorer = resumed["scorer"]
+        dynamic_change = resumed["dynamic_change"]
+
     # Run the SMO-GP algorithm for N cycles
+    mutation = poisson_repeat(complexophile_mutator, 1.0)
+    mutation = experiments.mutator_from_options(options, mutation)
     change = 0
-    for i, g in enumerate(SMO_GP.SMO_GP(
+    profiler = profiling.from_options(options)
+    smo_gp = SMO_GP.SMO_GP(
                     initial_individuals={primitive},
-                    mutator=poisson_repeat(complexophile_mutator, 1.0),
-                    objectives=(fitness_scorer.score, complexity_scorer),
-                    dynamic_change=dynamic_change(fitness_scorer, change_per_gen)
-                ).populations()):
-
+                    mutator=mutation,
+                    objectives=(fitness_scorer.score, experiments.complexity_from_options(options, complexity_scorer)),
+                    dynamic_change=dynamic_change,
+                    batch_size=options.BATCH,
+                    workers=options.WORKERS,
+                    cache_hits=lambda: fitness_scorer.cache.hits,
+                    profiler=profiler
+                )
+    if resumed is not None:
+        smo_gp.restore(resumed["smo_gp"])
+        random.setstate(resumed["random"])
+    sink = telemetry.from_options(options, resumed)
+    if sink is not None:
+        smo_gp.add_telemetry_sink(sink)
+    for i, g in enumerate(smo_gp.populations(), smo_gp.generation):
+
+        if checkpointer is not None and checkpointer.due(i):
+            checkpointer.save(i, {"smo_gp": smo_gp.state(), "scorer": fitness_scorer, "dynamic_change": dynamic_change,
+                                  "random": random.getstate(), "telemetry": telemetry.offset(sink)})
+
+        if options.CACHE_STATS > 0 and i % options.CACHE_STATS == 0:
+            logging.info(scorecache.format_stats(fitness_scorer.cache_stats()))
         if options.INFOGENS >0 and i % options.INFOGENS == 0:
             logging.info("Generation " + str(i))
         if i >= options.GENERATIONS:
             break
+        if options.STOP_EXACT and experiments.exact_solution(g, target) is not None:
+            logging.info("Generation %d; exact solution found", i)
+            break
 
     # Print the scoring dictionary
     logging.debug("Scoring table:")
-    longest = max([len(s) for s in fitness_scorer.keylist])
+    longest = max([len(s) for s in fitness_scorer.reference_dict])
     for length in range(longest + 1):
-        for s in [ x for x in fitness_scorer.keylist if len(x) == length]:
+        for s in [ x for x in fitness_scorer.reference_dict if len(x) == length]:
                 logging.debug("%s %s", s, fitness_scorer.reference_dict[s])
 
     # Print the resulting estimate of the Pareto front
     for individual, scores in g:
         logging.info("The following automaton scored %d with %d states:\n%s", scores[0], -scores[1] ,str(individual))
         print(-scores[1], scores[0], sep=",")
+    if options.ARCHIVE:
+        machinearchive.write_archive(options.ARCHIVE, (individual for individual, _ in g))
+
+    if sink is not None:
+        sink.close()
+    if profiler is not None:
+        profiler.close()
+        if options.PROFILE:
+            print(profiler.report(), file=sys.stderr)
 
     logging.info("End of run")
 
@@ -218,7 +271,7 @@ def myAssertEqual(a,b):
 
 def selfTest():
         e = E3Scorer(15)
-        myAssertEqual(15, len(e.keylist))
+        myAssertEqual(15, len(e.reference_dict))
         myAssertEqual(15, len(e.reference_dict.keys()))
         e.reduce()
         e.reduce()
@@ -245,6 +298,13 @@ if __name__ == "__main__":
     parser.add_option("-t", "--test", action="store_true", dest="SELFTEST",
                     help="executes a self test")
 
+    experiments.add_options(parser, exact_target=True)
+    scorecache.add_options(parser)
+    telemetry.add_options(parser)
+    checkpoint.add_options(parser)
+    machinearchive.add_options(parser)
+    profiling.add_options(parser)
+
     (options, args) = parser.parse_args()
 
     if hasattr(options, "SELFTEST") and options.SELFTEST:
@@ -29,23 +29,28 @@ INPUT_ALPHABET_SIZE = 3 # The Universal Witness languages use a three-symbol alp
 
 
 
-from copy import deepcopy
 
 import numpy
 from numpy.random import poisson
 import logging
 import optparse
+import sys
 
 import automata
 import FSMScorer
 import SMO_GP
+import scorecache
+import telemetry
+import checkpoint
+import machinearchive
+import profiling
+import experiments
 from uniwitness import UniWitness
-import countable
 
 def complexophile_mutator(mm_parent: automata.CanonicalMooreMachine):
 
-    # First, make a copy of the given parent object
-    m = deepcopy(mm_parent)
+    # First, make a copy of the given parent object; it shares storage with the parent until modified
+    m = mm_parent.clone()
 
     # Pick a random source state for an arc, an input label
     source_state = numpy.random.choice(m.state_count())
@@ -102,26 +107,7 @@ class E5Scorer(FSMScorer.FSMScorer):
             mostly negative examples, simple FSMs that just reject everything would be inappropriately favoured.'''
         super().__init__()
 
-        d = dict()
-        mr = automata.MooreMachineRun(cmm)
-        positive = 0
-        negative = 0
-
-        for s in countable.all_words_from_alphabet(range(3)):
-            mr.reset()
-            mr.multistep(s)
-            result = mr.output()
-            #print(s, "result: ", result, "pos: ", positive, "neg: ", negative)
-            if (positive >= negative and result == 0) \
-            or (positive <= negative and result == 1):
-                d[s] = result
-                if result == 1:
-                    positive += 1
-                else:
-                    negative += 1
-                if positive + negative >= n:
-                    break
-        self.reference_dict = d
+        self.reference_dict = FSMScorer.balanced_reference_dict(cmm, n, INPUT_ALPHABET_SIZE)
 
 def create_scorer(table_size, cmm):
 
@@ -166,36 +152,80 @@ def main(options, args):
     else:
         primitive  = UniWitness(options.BEGINNING)
 
-    fitness_scorer = create_scorer(options.DICTSIZE, UniWitness(options.UNIWITNESS))
-    logging.info("Longest scoring string: " + str(max([len(s) for s in fitness_scorer.reference_dict.keys()])))
+    target = UniWitness(options.UNIWITNESS)
+    if options.EXACT_LENGTH > 0:
+        fitness_scorer = FSMScorer.AgreementScorer(target, options.EXACT_LENGTH)
+        logging.info("Maximal score: " + str(fitness_scorer.table_size()))
+    else:
+        fitness_scorer = create_scorer(options.DICTSIZE, target)
+    fitness_scorer.cache = scorecache.from_options(options)
+    fitness_scorer.index_runs = options.INDEX_RUNS
+    logging.info("Longest scoring string: " + str(options.EXACT_LENGTH if options.EXACT_LENGTH > 0 else max([len(s) for s in fitness_scorer.reference_dict.keys()])))
 
     change_per_gen = options.CHANGE / 100 * fitness_scorer.table_size()
 
+    # Continue a checkpointed run with the scorer as it was
+    checkpointer = checkpoint.from_options(options)
+    resumed = checkpoint.resume_state(options)
+    if resumed is not None:
+        fitness_scorer = resumed["scorer"]
+
     # Run the SMO-GP algorithm for N cycles
+    mutation = poisson_repeat(complexophile_mutator, 1.0)
+    mutation = experiments.mutator_from_options(options, mutation)
     change = 0
-    for i, g in enumerate(SMO_GP.SMO_GP(
+    profiler = profiling.from_options(options)
+    smo_gp = SMO_GP.SMO_GP(
                     initial_individuals={primitive},
-                    mutator=poisson_repeat(complexophile_mutator, 1.0),
-                    objectives=(fitness_scorer.score, complexity_scorer),
-                    dynamic_change=None
-                ).populations()):
-
+                    mutator=mutation,
+                    objectives=(fitness_scorer.score, experiments.complexity_from_options(options, complexity_scorer)),
+                    dynamic_change=None,
+                    batch_size=options.BATCH,
+                    workers=options.WORKERS,
+                    cache_hits=lambda: fitness_scorer.cache.hits,
+                    profiler=profiler
+                )
+    if resumed is not None:
+        smo_gp.restore(resumed["smo_gp"])
+    sink = telemetry.from_options(options, resumed)
+    if sink is not None:
+        smo_gp.add_telemetry_sink(sink)
+    for i, g in enumerate(smo_gp.populations(), smo_gp.generation):
+
+        if checkpointer is not None and checkpointer.due(i):
+            checkpointer.save(i, {"smo_gp": smo_gp.state(), "scorer": fitness_scorer, "telemetry": telemetry.offset(sink)})
+
+        if options.CACHE_STATS > 0 and i % options.CACHE_STATS == 0:
+            logging.info(scorecache.format_stats(fitness_scorer.cache_stats()))
         if options.INFOGENS >0 and i % options.INFOGENS == 0:
             logging.info("Generation " + str(i))
         if i >= options.GENERATIONS:
             break
+        if options.STOP_EXACT and experiments.exact_solution(g, target) is not None:
+            logging.info("Generation %d; exact solution found", i)
+            break
 
     # Print the scoring dictionary
-    logging.debug("Scoring table:")
-    longest = max([len(s) for s in fitness_scorer.reference_dict.keys()])
-    for length in range(longest + 1):
-        for s in [ x for x in fitness_scorer.reference_dict.keys() if len(x) == length]:
-                logging.debug("%s %s", s, fitness_scorer.reference_dict[s])
+    if options.EXACT_LENGTH <= 0:
+        logging.debug("Scoring table:")
+        longest = max([len(s) for s in fitness_scorer.reference_dict.keys()])
+        for length in range(longest + 1):
+            for s in [ x for x in fitness_scorer.reference_dict.keys() if len(x) == length]:
+                    logging.debug("%s %s", s, fitness_scorer.reference_dict[s])
 
     # Print the resulting estimate of the Pareto front
     for individual, scores in g:
         logging.info("The following automaton scored %d with %d states:\n%s", scores[0], -scores[1] ,str(individual))
         print(-scores[1], scores[0], sep=",")
+    if options.ARCHIVE:
+        machinearchive.write_archive(options.ARCHIVE, (individual for individual, _ in g))
+
+    if sink is not None:
+        sink.close()
+    if profiler is not None:
+        profiler.close()
+        if options.PROFILE:
+            print(profiler.report(), file=sys.stderr)
 
     logging.info("End of run")
 
@@ -245,6 +275,15 @@ if __name__ == "__main__":
     parser.add_option("-b", "--beginning", type="int", action="store", dest="BEGINNING", default=0,
                     help="sets the initial population to the given parameter's corresponding Universal Witness automaton (>=3)")
 
+    parser.add_option("--exact-length", type="int", action="store", dest="EXACT_LENGTH", default=0,
+                    help="if not zero, score on all strings up to length EXACT_LENGTH, counted exactly, instead of on a sample table of DICTSIZE strings")
+    experiments.add_options(parser, exact_target=True)
+    scorecache.add_options(parser)
+    telemetry.add_options(parser)
+    checkpoint.add_options(parser)
+    machinearchive.add_options(parser)
+    profiling.add_options(parser)
+
     (options, args) = parser.parse_args()
 
     if hasattr(options, "SELFTEST") and options.SELFTEST:
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+experiments - Helpers and options shared by the experiment drivers, for the ways of running an evolution that they all offer.
+
+Functions:
+
+    compacted - wrap a mutation operator to drop the unreachable states of the mutants.
+    reachable_complexity_scorer - complexity objective counting only the reachable states.
+    exact_solution - find a member of the population equivalent to the target machine.
+    add_options - add the shared options to an optparse parser, for the experiment CLIs.
+    mutator_from_options - the mutation operator of an experiment, compacted if the options say so.
+    complexity_from_options - the complexity objective of an experiment, or the reachable one if the options say so.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import optparse
+
+import automata
+
+
+def compacted(f):
+    '''Return a function that applies the mutator f, then drops the states of the mutant that are unreachable from state 0.'''
+    def fun(x):
+        m = f(x)
+        m.compact()
+        return m
+
+    return fun
+
+def reachable_complexity_scorer(moore_machine: automata.CanonicalMooreMachine):
+    '''Returns an integer score for the complexity of a given Moore machine, counting only the states reachable from its starting state.'''
+    return -len(moore_machine.reachable_states())
+
+def exact_solution(population, target):
+    '''Return the first individual of the population that is equivalent to the target machine, or None.'''
+    return next((individual for individual, _ in population if automata.equivalent(individual, target)), None)
+
+
+def add_options(parser, exact_target=False):
+    '''Add the options shared by the experiments to an optparse parser; with exact_target, for an experiment evolving towards a
+    target machine, also the option to stop when it is found.'''
+    group = optparse.OptionGroup(parser, "Evolution options")
+    group.add_option("-k", "--batch", type="int", action="store", dest="BATCH", default=1,
+                    help="the number of mutants to make and score in each generation (default: %default)")
+    group.add_option("-w", "--workers", type="int", action="store", dest="WORKERS", default=0,
+                    help="if not zero, score the mutants in a pool of WORKERS processes; results are the same for the same seed and batch size (default: %default)")
+    group.add_option("--index-runs", action="store_true", dest="INDEX_RUNS", default=False,
+                    help="keep the runs of scored machines over the reference strings, so that their mutants only rerun the strings a mutation can affect")
+    group.add_option("--compact", action="store_true", dest="COMPACT", default=False,
+                    help="drop the states of mutants that are unreachable from the starting state, renumbering the rest")
+    group.add_option("--count-reachable", action="store_true", dest="COUNT_REACHABLE", default=False,
+                    help="score complexity by the number of states reachable from the starting state, rather than all states")
+    if exact_target:
+        group.add_option("--stop-exact", action="store_true", dest="STOP_EXACT", default=False,
+                        help="stop as soon as a member of the front is equivalent to the target machine, or with several targets in turn, change up to the next")
+    parser.add_option_group(group)
+
+
+def mutator_from_options(options, mutator):
+    '''Return the mutator, or if --compact was given, the mutator compacting its mutants.'''
+    return compacted(mutator) if options.COMPACT else mutator
+
+
+def complexity_from_options(options, complexity_scorer):
+    '''Return the complexity objective: the given one, or if --count-reachable was given, reachable_complexity_scorer.'''
+    return reachable_complexity_scorer if options.COUNT_REACHABLE else complexity_scorer
+
+
+# Unit testing code.
+
+import unittest as ut
+
+class TestExperiments(ut.TestCase):
+
+    def test_options(self):
+        parser = optparse.OptionParser()
+        add_options(parser)
+        options, _ = parser.parse_args(["--index-runs"])
+        self.assertTrue(options.INDEX_RUNS)
+        self.assertEqual((options.BATCH, options.WORKERS), (1, 0))
+        self.assertIs(complexity_from_options(options, len), len)
+        options, _ = parser.parse_args(["--compact", "--count-reachable"])
+        self.assertIs(complexity_from_options(options, len), reachable_complexity_scorer)
+
+        m = automata.CanonicalMooreMachine.from_string("0 2\n1 1\n1 2")
+        self.assertEqual(reachable_complexity_scorer(m), -2)
+        mutant = mutator_from_options(options, lambda x: x.clone())(m)
+        self.assertEqual((mutant.state_count(), m.state_count()), (2, 3))
+        self.assertFalse(hasattr(options, "STOP_EXACT"))
+
+    def test_exact_solution(self):
+        target = automata.CanonicalMooreMachine.from_string("0 1\n1 0")
+        population = [(automata.CanonicalMooreMachine(), (0, -1)), (automata.CanonicalMooreMachine.from_string("0 1\n1 2\n0 1"), (3, -3))]
+        self.assertIsNone(exact_solution(population[:1], target))
+        self.assertIs(exact_solution(population, target), population[1][0])
+        parser = optparse.OptionParser()
+        add_options(parser, exact_target=True)
+        self.assertTrue(parser.parse_args(["--stop-exact"])[0].STOP_EXACT)
+
+
+if __name__ == '__main__':
+    ut.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+'''
+machinearchive - Archive files of many CanonicalMooreMachines in their packed binary records, with an index of their offsets,
+                 so that analysis tools can memory-map an archive and read any one machine without loading the rest.
+
+The file starts with the MAGIC bytes, padded to 8 bytes, then the number of machines and the offset of the index as little-endian
+64-bit integers.  The records made by CanonicalMooreMachine.to_bytes follow, one after the other, and then the index: the
+offsets of the records, and of the end of the last, as little-endian 64-bit integers.
+
+Classes:
+
+    ArchiveWriter - writes machines to a new archive file, one at a time.
+    Archive - an archive file opened with numpy.memmap, giving random access to its machines.
+
+Functions:
+
+    write_archive - write an iterable of machines to a new archive file.
+    add_options - add the archive option to an optparse parser, for the experiment CLIs.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import optparse
+import struct
+
+import numpy as np
+
+import automata
+
+
+MAGIC = b"FSMA\x01\x00\x00\x00"
+HEADER = struct.Struct("<8sqq")
+
+
+class ArchiveWriter(object):
+    '''Writes machines to a new archive file; the index is written by close().'''
+
+    def __init__(self, path) -> None:
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, 0, 0))
+        self._offsets = [HEADER.size]
+
+    def add(self, machine):
+        '''Append the record of a CanonicalMooreMachine.'''
+        data = machine.to_bytes()
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        '''Write the index and the header, and close the file.'''
+        if self._file is not None:
+            index_offset = self._offsets[-1]
+            self._file.write(np.array(self._offsets, dtype="<i8").tobytes())
+            self._file.seek(0)
+            self._file.write(HEADER.pack(MAGIC, len(self._offsets) - 1, index_offset))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_archive(path, machines):
+    '''Write the machines to a new archive file at path, and return how many were written.'''
+    count = 0
+    with ArchiveWriter(path) as writer:
+        for m in machines:
+            writer.add(m)
+            count += 1
+    return count
+
+
+class Archive(object):
+    '''An archive file, memory-mapped read-only.  The machines are read from their records on demand, as instances of
+    machine_class (any CanonicalMooreMachine class); arrays() gives their tables without copying them out of the map.'''
+
+    def __init__(self, path, machine_class=automata.CanonicalMooreMachine) -> None:
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, count, index_offset = HEADER.unpack_from(self._data)
+        if magic != MAGIC:
+            raise ValueError("Not a machine archive: " + str(path))
+        self._index = self._data[index_offset:index_offset + 8 * (count + 1)].view("<i8")
+        self._machine_class = machine_class
+
+    def __len__(self):
+        return len(self._index) - 1
+
+    def record(self, k):
+        '''Return the binary record of the k-th machine, as a view into the map.'''
+        if not -len(self) <= k < len(self):
+            raise IndexError("machine archive index out of range")
+        k %= len(self)
+        return self._data[self._index[k]:self._index[k + 1]]
+
+    def __getitem__(self, k):
+        return self._machine_class.from_bytes(self.record(k))
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def arrays(self, k):
+        '''Return the transition table and the outputs of the k-th machine, as read-only int32 views into the map.'''
+        record = self.record(k)
+        _, state_count, input_count, _ = automata.CanonicalMooreMachine.RECORD_HEADER.unpack_from(record)
+        body = record[automata.CanonicalMooreMachine.RECORD_HEADER.size:].view("<i4")
+        return body[:state_count * input_count].reshape(state_count, input_count), body[state_count * input_count:]
+
+
+def add_options(parser):
+    '''Add the option to write the final population to an archive file to an optparse parser.'''
+    group = optparse.OptionGroup(parser, "Archive options")
+    group.add_option("--archive", action="store", dest="ARCHIVE", default="",
+                    help="if given, write the machines of the final Pareto front to the binary archive file ARCHIVE")
+    parser.add_option_group(group)
+
+
+# Unit testing code.
+
+import os
+import tempfile
+import unittest as ut
+
+class TestMachineArchive(ut.TestCase):
+
+    def test_archive(self):
+        rng = np.random.default_rng(0)
+        machines = []
+        for n in (1, 5, 30, 2):
+            m = automata.CanonicalMooreMachine(n, 2, 3)
+            for s in range(n):
+                for i in range(2):
+                    m.set_arc(s, i, int(rng.integers(n)))
+                m.set_output(s, int(rng.integers(3)))
+            machines.append(m)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "front.fsma")
+            self.assertEqual(write_archive(path, machines), 4)
+            archive = Archive(path)
+            self.assertEqual(len(archive), 4)
+            self.assertEqual([str(m) for m in archive], [str(m) for m in machines])
+            self.assertEqual(str(archive[-2]), str(machines[2]))
+            transitions, outputs = archive.arrays(2)
+            self.assertTrue(np.array_equal(transitions, machines[2].transition_array()))
+            self.assertTrue(np.array_equal(outputs, machines[2].output_array()))
+            with self.assertRaises(IndexError):
+                archive[4]
+            dense = Archive(path, automata.DenseCanonicalMooreMachine)
+            self.assertIsInstance(dense[1], automata.DenseCanonicalMooreMachine)
+            self.assertEqual(str(dense[1]), str(machines[1]))
+            del archive, dense, transitions, outputs
+
+            path = os.path.join(directory, "empty.fsma")
+            write_archive(path, [])
+            self.assertEqual(len(Archive(path)), 0)
+
+
+if __name__ == '__main__':
+    ut.main()
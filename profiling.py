@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+'''
+profiling - Per-phase timings of an evolution run, to tell which part of it is slow, and cProfile dumps of a window of its generations.
+
+Classes:
+
+    PhaseProfiler - the cumulative time and number of calls of each named phase; SMO_GP times its phases into one when given it.
+
+Functions:
+
+    add_options - add the profiling options to an optparse parser, for the experiment CLIs.
+    from_options - construct a PhaseProfiler from the options parsed by a parser prepared with add_options, or None if profiling is off.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import cProfile
+import logging
+import optparse
+import time
+
+
+class PhaseProfiler(object):
+    '''The cumulative time and number of calls of named phases.  A phase is timed from the last mark() or lap() to a lap() naming it,
+    so that consecutive phases take one clock reading each.  If given a dump_path, the generations from 'start' up to, but excluding,
+    start + count are also run under cProfile, once, and its statistics written to dump_path; generation() is told of each.'''
+
+    def __init__(self, dump_path="", start=0, count=0) -> None:
+        self._phases = {}
+        self._last = time.perf_counter()
+        self.dump_path = dump_path
+        self.start = start
+        self.count = count
+        self._cprofile = None
+        self._dumped = False
+
+    def mark(self):
+        '''Start timing a phase.'''
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        '''Count a call of the phase, taking the time since the last mark() or lap(), and start timing the next.'''
+        now = time.perf_counter()
+        entry = self._phases.get(phase)
+        if entry is None:
+            self._phases[phase] = [1, now - self._last]
+        else:
+            entry[0] += 1
+            entry[1] += now - self._last
+        self._last = now
+
+    def phases(self):
+        '''Return a list of triples of the phases, their numbers of calls and their cumulative times in seconds, in the order first timed.'''
+        return [(phase, calls, seconds) for phase, (calls, seconds) in self._phases.items()]
+
+    def generation(self, generation):
+        '''Start or stop cProfile, if the generation begins or ends its window.'''
+        if not self.dump_path or self._dumped:
+            return
+        if self._cprofile is None and self.start <= generation < self.start + self.count:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self._cprofile is not None and generation >= self.start + self.count:
+            self.close()
+
+    def close(self):
+        '''Stop cProfile if it is running, and write its statistics.'''
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.dump_path)
+            self._cprofile = None
+            self._dumped = True
+            logging.info("Profile written to " + self.dump_path)
+
+    def report(self):
+        '''Return a table of the phases, with their calls, total and mean times and shares of the total time, as a string.'''
+        phases = self.phases()
+        total = sum(seconds for _, _, seconds in phases)
+        width = max([len("phase")] + [len(phase) for phase, _, _ in phases])
+        lines = [f"{'phase':<{width}} {'calls':>10} {'total s':>10} {'mean us':>10} {'share':>7}"]
+        for phase, calls, seconds in phases:
+            lines.append(f"{phase:<{width}} {calls:>10} {seconds:>10.3f} {seconds / calls * 1e6:>10.1f} {seconds / total if total else 0.0:>7.1%}")
+        lines.append(f"{'total':<{width}} {sum(calls for _, calls, _ in phases):>10} {total:>10.3f}")
+        return "\n".join(lines)
+
+
+def add_options(parser):
+    '''Add options for profiling to an optparse parser.'''
+    group = optparse.OptionGroup(parser, "Profiling options")
+    group.add_option("--profile", action="store_true", dest="PROFILE", default=False,
+                    help="time the phases of every generation, and print a breakdown of the times to standard error at the end")
+    group.add_option("--profile-dump", action="store", dest="PROFILE_DUMP", default="",
+                    help="if given, run a window of generations under cProfile, and write its statistics to the file PROFILE_DUMP")
+    group.add_option("--profile-start", type="int", action="store", dest="PROFILE_START", default=100,
+                    help="first generation of the cProfile window (default: %default)")
+    group.add_option("--profile-generations", type="int", action="store", dest="PROFILE_GENERATIONS", default=100,
+                    help="number of generations in the cProfile window (default: %default)")
+    parser.add_option_group(group)
+
+
+def from_options(options):
+    '''Return a new PhaseProfiler as specified by the options added by add_options, or None if neither --profile nor --profile-dump was given.'''
+    if not (options.PROFILE or options.PROFILE_DUMP):
+        return None
+    return PhaseProfiler(options.PROFILE_DUMP, options.PROFILE_START, options.PROFILE_GENERATIONS)
+
+
+# Unit testing code.
+
+import os
+import pstats
+import tempfile
+import unittest as ut
+
+class TestProfiling(ut.TestCase):
+
+    def test_phases(self):
+        p = PhaseProfiler()
+        for _ in range(3):
+            p.mark()
+            p.lap("a")
+            sum(range(1000))
+            p.lap("b")
+        self.assertEqual([(phase, calls) for phase, calls, _ in p.phases()], [("a", 3), ("b", 3)])
+        self.assertTrue(all(seconds >= 0.0 for _, _, seconds in p.phases()))
+        report = p.report().splitlines()
+        self.assertEqual(len(report), 4)
+        self.assertTrue(report[-1].startswith("total"))
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.prof")
+            p = PhaseProfiler(path, start=2, count=3)
+            for g in range(10):
+                p.generation(g)
+                if g == 3:
+                    sorted(range(100))
+            self.assertTrue(os.path.exists(path))
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_options(self):
+        parser = optparse.OptionParser()
+        add_options(parser)
+        options, _ = parser.parse_args([])
+        self.assertIsNone(from_options(options))
+        options, _ = parser.parse_args(["--profile"])
+        self.assertIsInstance(from_options(options), PhaseProfiler)
+
+
+if __name__ == '__main__':
+    ut.main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+'''
+scorecache - Caches for the scores computed by FSMScorer, optionally bounded in entries or estimated memory, with eviction policies and statistics.
+
+Classes:
+
+    ScoreCache - a cache that counts hits, misses and evictions, estimates its memory use, and if bounded, evicts the oldest entry.
+    LRUScoreCache - a bounded cache that evicts the least recently used entry.
+    LFUScoreCache - a bounded cache that evicts the least frequently used entry (the least recently used of those, on a tie).
+
+Functions:
+
+    make_cache - construct a cache from a policy name and limits.
+    add_options - add the cache options to an optparse parser, for the experiment CLIs.
+    from_options - construct a cache from the options parsed by a parser prepared with add_options.
+    format_stats - a one-line summary of cache statistics, for logging.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import collections
+import optparse
+import sys
+
+
+class ScoreCache(object):
+    '''A dictionary-like cache of scores, that counts hits and misses of get(), and estimates the memory taken by its entries.
+    Membership tests and indexing only peek at entries: they are neither counted nor treated as uses.  Without limits, nothing
+    is ever evicted; with them, this class evicts the oldest entry first, and its subclasses choose by use.'''
+
+    # Rough allowance for the hash table slot and bookkeeping of an entry, on top of the sizes of its key and value.
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_entries=None, max_bytes=None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = dict()
+        self._sizes = dict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def items(self):
+        return self._entries.items()
+
+    def values(self):
+        return self._entries.values()
+
+    def get(self, key, default=None):
+        '''Return the cached value for key, counting a hit and a use, or default, counting a miss.'''
+        if key in self._entries:
+            self.hits += 1
+            self._used(key)
+            return self._entries[key]
+        else:
+            self.misses += 1
+            return default
+
+    def __setitem__(self, key, value):
+        size = sys.getsizeof(key) + sys.getsizeof(value) + self.ENTRY_OVERHEAD
+        if key in self._entries:
+            # Replacing a value only updates the estimate; nothing is evicted to make room.
+            self._bytes -= self._sizes[key]
+        else:
+            # Make room before storing, so the new entry is never its own victim.
+            while len(self._entries) > 0 and self._over_limit(1, size):
+                self._evict(self._victim())
+            self._added(key)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._bytes += size
+
+    def discard(self, key):
+        '''Remove the entry for key, if there is one.  This is not counted as an eviction.'''
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        '''Remove all entries; the statistics are kept.'''
+        for key in list(self._entries):
+            self._remove(key)
+
+    def stats(self):
+        '''Return a dict of the number of entries, hits, misses, evictions, the hit rate and the estimated memory in bytes.'''
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "bytes": self._bytes,
+        }
+
+    def _over_limit(self, extra_entries, extra_bytes):
+        '''Whether the cache would exceed a limit, with the given number of entries and bytes more.'''
+        return (self.max_entries is not None and len(self._entries) + extra_entries > self.max_entries) \
+            or (self.max_bytes is not None and self._bytes + extra_bytes > self.max_bytes)
+
+    def _evict(self, key):
+        self._remove(key)
+        self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key)
+        self._forget(key)
+
+    # Hooks for the eviction policies.
+
+    def _added(self, key):
+        '''A new key is about to be stored.'''
+        pass
+
+    def _used(self, key):
+        '''The key was looked up successfully.'''
+        pass
+
+    def _forget(self, key):
+        '''The key has been removed.'''
+        pass
+
+    def _victim(self):
+        '''Return the key to be evicted next: the oldest one stored.'''
+        return next(iter(self._entries))
+
+
+class LRUScoreCache(ScoreCache):
+    '''A score cache that, when over its limits, evicts the least recently stored or used entry.'''
+
+    def __init__(self, max_entries=None, max_bytes=None) -> None:
+        super().__init__(max_entries, max_bytes)
+        self._order = collections.OrderedDict()
+
+    def _added(self, key):
+        self._order[key] = None
+
+    def _used(self, key):
+        self._order.move_to_end(key)
+
+    def _forget(self, key):
+        del self._order[key]
+
+    def _victim(self):
+        return next(iter(self._order))
+
+
+class LFUScoreCache(ScoreCache):
+    '''A score cache that, when over its limits, evicts the entry with the fewest uses, counting its storage as the first.
+    Entries are kept in buckets by use count, so that storing and using an entry take constant time.'''
+
+    def __init__(self, max_entries=None, max_bytes=None) -> None:
+        super().__init__(max_entries, max_bytes)
+        self._counts = dict()
+        self._buckets = collections.defaultdict(collections.OrderedDict)
+        self._lowest = 0
+
+    def _added(self, key):
+        self._counts[key] = 1
+        self._buckets[1][key] = None
+        self._lowest = 1
+
+    def _used(self, key):
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._lowest == count:
+                self._lowest = count + 1
+        self._counts[key] = count + 1
+        self._buckets[count + 1][key] = None
+
+    def _forget(self, key):
+        count = self._counts.pop(key)
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._lowest == count and self._buckets:
+                self._lowest = min(self._buckets)
+
+    def _victim(self):
+        if self._lowest not in self._buckets:
+            self._lowest = min(self._buckets)
+        return next(iter(self._buckets[self._lowest]))
+
+
+POLICIES = {"fifo": ScoreCache, "lru": LRUScoreCache, "lfu": LFUScoreCache}
+
+
+def make_cache(policy="fifo", max_entries=None, max_bytes=None):
+    '''Return a new cache of the named eviction policy ("fifo", "lru" or "lfu"), with the given limits (None for no limit).'''
+    return POLICIES[policy](max_entries, max_bytes)
+
+
+def add_options(parser):
+    '''Add options for the score cache to an optparse parser.'''
+    group = optparse.OptionGroup(parser, "Score cache options")
+    group.add_option("--cache-policy", choices=tuple(POLICIES), action="store", dest="CACHE_POLICY", default="lru",
+                    help="eviction policy of the score cache, when it is limited; one of fifo, lru or lfu (default: %default)")
+    group.add_option("--cache-entries", type="int", action="store", dest="CACHE_ENTRIES", default=0,
+                    help="if not zero, the most entries to keep in the score cache (default: %default)")
+    group.add_option("--cache-mb", type="float", action="store", dest="CACHE_MB", default=0.0,
+                    help="if not zero, the most estimated memory in megabytes for the score cache (default: %default)")
+    group.add_option("--cache-stats", type="int", action="store", dest="CACHE_STATS", default=0,
+                    help="if not zero, log the statistics of the score cache every CACHE_STATS generations (default: %default)")
+    parser.add_option_group(group)
+
+
+def from_options(options):
+    '''Return a new cache as specified by the options added by add_options.'''
+    return make_cache(options.CACHE_POLICY,
+                      options.CACHE_ENTRIES if options.CACHE_ENTRIES > 0 else None,
+                      int(options.CACHE_MB * 1024 * 1024) if options.CACHE_MB > 0 else None)
+
+
+def format_stats(stats):
+    '''Return a one-line summary of the statistics returned by a cache's stats().'''
+    return ("Cache: {entries} entries, {hits} hits, {misses} misses ({hit_rate:.1%} hit rate), "
+            "{evictions} evictions, {megabytes:.1f} MB").format(megabytes=stats["bytes"] / (1024 * 1024), **stats)
+
+
+# Unit testing code.
+
+import unittest as ut
+
+class TestScoreCache(ut.TestCase):
+
+    def test_unbounded(self):
+        c = make_cache()
+        for i in range(100):
+            c[i] = i * i
+        self.assertEqual(len(c), 100)
+        self.assertEqual(c.get(7), 49)
+        self.assertIsNone(c.get(700))
+        self.assertTrue(5 in c)
+        s = c.stats()
+        self.assertEqual((s["hits"], s["misses"], s["evictions"]), (1, 1, 0))
+        self.assertGreater(s["bytes"], 100 * ScoreCache.ENTRY_OVERHEAD)
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.stats()["bytes"], 0)
+        self.assertEqual(c.stats()["hits"], 1)
+
+        c = make_cache("fifo", max_entries=2)
+        c[1] = 1
+        c[2] = 2
+        c.get(1)
+        c[3] = 3
+        self.assertEqual(sorted(c), [2, 3])
+
+    def test_lru(self):
+        c = make_cache("lru", max_entries=3)
+        c["a"] = 1
+        c["b"] = 2
+        c["c"] = 3
+        c.get("a")
+        c["d"] = 4
+        self.assertEqual(sorted(c), ["a", "c", "d"])
+        self.assertEqual(c.stats()["evictions"], 1)
+
+    def test_lfu(self):
+        c = make_cache("lfu", max_entries=3)
+        c["a"] = 1
+        c["b"] = 2
+        c["c"] = 3
+        c.get("a")
+        c.get("a")
+        c.get("c")
+        c["d"] = 4
+        self.assertEqual(sorted(c), ["a", "c", "d"])
+        c.get("d")
+        c.get("d")
+        c["e"] = 5
+        self.assertEqual(sorted(c), ["a", "d", "e"])
+        c.discard("a")
+        c["f"] = 6
+        c["g"] = 7
+        self.assertEqual(len(c), 3)
+        self.assertTrue("d" in c)
+
+    def test_memory_limit(self):
+        c = make_cache("lru", max_bytes=10 * (ScoreCache.ENTRY_OVERHEAD + 200))
+        for i in range(1000):
+            c[i] = i
+        self.assertLess(len(c), 1000)
+        self.assertLessEqual(c.stats()["bytes"], c.max_bytes)
+        self.assertTrue(999 in c)
+
+    def test_options(self):
+        parser = optparse.OptionParser()
+        add_options(parser)
+        options, _ = parser.parse_args(["--cache-policy", "lfu", "--cache-entries", "10"])
+        c = from_options(options)
+        self.assertIsInstance(c, LFUScoreCache)
+        self.assertEqual(c.max_entries, 10)
+        self.assertIsNone(c.max_bytes)
+        self.assertTrue(format_stats(c.stats()).startswith("Cache: 0 entries"))
+
+
+if __name__ == '__main__':
+    ut.main()
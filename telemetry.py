@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+'''
+telemetry - Per-generation records of an evolution run, written to a file by a background thread.
+
+Classes:
+
+    GenerationRecord - the statistics of one generation: its number, the size of the front, the best scores, evaluations, cache hits and level.
+    Sink - the base of the sinks, which queue records and write them from a background thread.
+    JSONLinesSink - a sink writing each record as a line of JSON.
+    BinarySink - a sink writing each record as a packed little-endian structure.
+
+Functions:
+
+    read_binary - read back the records written by a BinarySink.
+    make_sink - construct a sink from a format name and a path.
+    add_options - add the telemetry options to an optparse parser, for the experiment CLIs.
+    from_options - construct a sink from the options parsed by a parser prepared with add_options, or None if telemetry is off.
+    offset - the offset of a sink, or None, to be saved in a checkpoint.
+'''
+
+__author__ = "Gabor 'Tony' Zoltai"
+__copyright__ = "Copyright 2022, Gabor Zoltai"
+__credits__ = ["Gabor Zoltai"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Tony Zoltai"
+__email__ = "tony.zoltai@gmail.com"
+__status__ = "Prototype"
+
+
+import abc
+import collections
+import json
+import numbers
+import optparse
+import os
+import queue
+import struct
+import threading
+
+
+# cache_hits is -1 when the hits cannot be counted: the run has no score cache, or scores in worker processes.  level tells apart the
+# runs of an experiment made of several in turn, such as the U(n) levels of exp7, whose generations each count from 0.
+GenerationRecord = collections.namedtuple("GenerationRecord", ("generation", "front_size", "best_scores", "evaluations", "cache_hits", "level"),
+                                          defaults=(0,))
+
+
+class Sink(abc.ABC):
+    '''A sink for GenerationRecords.  emit() only puts the record on a queue; a background thread takes it off and writes it with
+    write(), which subclasses implement, so that formatting and file output stay off the evolution's thread.  close() writes
+    out whatever is still queued, and closes the file.  offset() tells how far the file has been written, to be saved in a
+    checkpoint; a run resumed from it cuts the file back there (truncate), so that the records written after the checkpoint
+    are not written twice.'''
+
+    def __init__(self, path, mode, truncate=None) -> None:
+        self._file = open(path, mode)
+        if truncate is not None:
+            self._file.truncate(truncate)
+            self._file.seek(0, os.SEEK_END)
+        self._offset = self._file.tell()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        '''Queue a record to be written.'''
+        self._queue.put(record)
+
+    def offset(self):
+        '''Wait for the queued records to be written, and return the length of the file up to the last of them.'''
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait()
+        return self._offset
+
+    def close(self):
+        '''Write out the queued records, stop the background thread and close the file.'''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            if isinstance(record, threading.Event):
+                self._file.flush()
+                self._offset = self._file.tell()
+                record.set()
+                continue
+            self.write(record)
+        self._file.flush()
+
+    @abc.abstractmethod
+    def write(self, record):
+        '''Write a record to self._file; called on the background thread.'''
+
+
+class JSONLinesSink(Sink):
+    '''A sink writing each record as a JSON object on a line of its own, to a new file or appended to an existing one.'''
+
+    def __init__(self, path, append=False, truncate=None) -> None:
+        super().__init__(path, "a" if append else "w", truncate)
+
+    def write(self, record):
+        self._file.write(json.dumps(record._asdict()) + "\n")
+
+
+class BinarySink(Sink):
+    '''A sink writing records in a compact binary format: the MAGIC bytes, then for each record, little-endian, the generation,
+    front size, evaluations, cache hits and level as 64-bit integers, the number of best scores as a 16-bit integer, and the best scores.
+    Each score is a tag byte, then for FLOAT a 64-bit float, or for INTEGER the 16-bit length of a signed integer of any size and its
+    bytes, so that integer scores too large for a float, such as AgreementScorer's, are kept exactly, as in JSON.  Records may be
+    appended to an existing file.'''
+
+    MAGIC = b"FSMT\x03"
+    HEADER = struct.Struct("<qqqqqH")
+    FLOAT = struct.Struct("<Bd")
+    INTEGER = struct.Struct("<BH")
+    FLOAT_TAG = 0
+    INTEGER_TAG = 1
+
+    def __init__(self, path, append=False, truncate=None) -> None:
+        super().__init__(path, "ab" if append else "wb", truncate)
+        if self._file.tell() == 0:
+            self._file.write(self.MAGIC)
+
+    def write(self, record):
+        scores = record.best_scores
+        self._file.write(self.HEADER.pack(record.generation, record.front_size, record.evaluations, record.cache_hits, record.level,
+                                          len(scores)))
+        for score in scores:
+            if isinstance(score, numbers.Integral):
+                score = int(score)
+                data = score.to_bytes(score.bit_length() // 8 + 1, "little", signed=True)
+                self._file.write(self.INTEGER.pack(self.INTEGER_TAG, len(data)) + data)
+            else:
+                self._file.write(self.FLOAT.pack(self.FLOAT_TAG, score))
+
+
+def read_binary(path):
+    '''Return the list of GenerationRecords in a file written by a BinarySink.'''
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(BinarySink.MAGIC):
+        raise ValueError("Not a binary telemetry file: " + str(path))
+    offset = len(BinarySink.MAGIC)
+    while offset < len(data):
+        generation, front_size, evaluations, cache_hits, level, count = BinarySink.HEADER.unpack_from(data, offset)
+        offset += BinarySink.HEADER.size
+        scores = []
+        for _ in range(count):
+            if data[offset] == BinarySink.FLOAT_TAG:
+                scores.append(BinarySink.FLOAT.unpack_from(data, offset)[1])
+                offset += BinarySink.FLOAT.size
+            else:
+                length = BinarySink.INTEGER.unpack_from(data, offset)[1]
+                offset += BinarySink.INTEGER.size
+                scores.append(int.from_bytes(data[offset:offset + length], "little", signed=True))
+                offset += length
+        scores = tuple(scores)
+        records.append(GenerationRecord(generation, front_size, scores, evaluations, cache_hits, level))
+    return records
+
+
+FORMATS = {"jsonl": JSONLinesSink, "binary": BinarySink}
+
+
+def make_sink(format, path, append=False, truncate=None):
+    '''Return a new sink of the named format ("jsonl" or "binary"), writing to the file at path, or appending to it, after cutting it
+    back to the length truncate if given.'''
+    return FORMATS[format](path, append, truncate)
+
+
+def add_options(parser):
+    '''Add options for telemetry to an optparse parser.'''
+    group = optparse.OptionGroup(parser, "Telemetry options")
+    group.add_option("--telemetry", action="store", dest="TELEMETRY", default="",
+                    help="if given, write a record of every generation to the file TELEMETRY")
+    group.add_option("--telemetry-format", choices=tuple(FORMATS), action="store", dest="TELEMETRY_FORMAT", default="jsonl",
+                    help="format of the telemetry file; one of jsonl or binary (default: %default)")
+    parser.add_option_group(group)
+
+
+def from_options(options, resumed=None):
+    '''Return a new sink as specified by the options added by add_options, or None if no telemetry file was given.  If a run is
+    resumed from the checkpointed state 'resumed', the file is appended to, after cutting it back to the offset saved there
+    as "telemetry", if any.'''
+    if not options.TELEMETRY:
+        return None
+    if resumed is None:
+        return make_sink(options.TELEMETRY_FORMAT, options.TELEMETRY)
+    return make_sink(options.TELEMETRY_FORMAT, options.TELEMETRY, True, resumed.get("telemetry"))
+
+
+def offset(sink):
+    '''Return the offset of the sink (see Sink.offset), to be saved in a checkpoint as "telemetry", or None if there is no sink.'''
+    return None if sink is None else sink.offset()
+
+
+# Unit testing code.
+
+import tempfile
+import unittest as ut
+
+class TestTelemetry(ut.TestCase):
+
+    def test_sinks(self):
+        records = [GenerationRecord(g, g + 1, (float(g), -2.5), 10 * g, g // 2, g // 40) for g in range(100)]
+        # Integer scores beyond a float's precision are kept exactly.
+        records[7] = records[7]._replace(best_scores=(15631284162081378181, -2**70, 3, -2.5))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.jsonl")
+            with make_sink("jsonl", path) as sink:
+                for r in records:
+                    sink.emit(r)
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(len(lines), 100)
+            self.assertEqual(lines[3], {"generation": 3, "front_size": 4, "best_scores": [3.0, -2.5], "evaluations": 30, "cache_hits": 1,
+                                        "level": 0})
+
+            path = os.path.join(directory, "run.bin")
+            with make_sink("binary", path) as sink:
+                for r in records[:50]:
+                    sink.emit(r)
+            with make_sink("binary", path, append=True) as sink:
+                for r in records[50:]:
+                    sink.emit(r)
+            self.assertEqual(read_binary(path), records)
+
+            # A resumed run cuts the file back to the offset of its checkpoint, and writes the records after it again.
+            for format in FORMATS:
+                path = os.path.join(directory, "resumed." + format)
+                with make_sink(format, path) as sink:
+                    for r in records[:60]:
+                        sink.emit(r)
+                        if r.generation == 30:
+                            saved = {"telemetry": offset(sink)}
+                with from_options(optparse.Values({"TELEMETRY": path, "TELEMETRY_FORMAT": format}), saved) as sink:
+                    for r in records[31:]:
+                        sink.emit(r)
+                if format == "binary":
+                    self.assertEqual(read_binary(path), records)
+                else:
+                    with open(path) as f:
+                        self.assertEqual([json.loads(line)["generation"] for line in f], list(range(100)))
+
+    def test_abstract(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(TypeError):
+                Sink(os.path.join(directory, "run"), "w")
+
+    def test_options(self):
+        parser = optparse.OptionParser()
+        add_options(parser)
+        options, _ = parser.parse_args([])
+        self.assertIsNone(from_options(options))
+
+
+if __name__ == '__main__':
+    ut.main()